@@ -304,7 +304,7 @@ function renderAssessment(assessment, domRoot) {
       $.each(q.choices, function(i, c) {
         if (typeof c == 'string') {
           // incorrect choice
-          curLI.append('<input type="radio" name="q' + questionNum + '"/>&nbsp;' + c + '<br/>');
+          curLI.append('<input type="radio" name="q' + questionNum + '" value="' + i + '"/>&nbsp;' + c + '<br/>');
         }
         else {
           // wrapped in correct() ...
@@ -312,7 +312,8 @@ function renderAssessment(assessment, domRoot) {
             alert('Error: Malformed question.');
           }
           // correct choice
-          curLI.append('<input type="radio" name="q' + questionNum + '" value="correct"/>&nbsp;' + c[1] + '<br/>');
+          q.correctIndex = i;
+          curLI.append('<input type="radio" name="q' + questionNum + '" value="' + i + '"/>&nbsp;' + c[1] + '<br/>');
         }
       });
     }
@@ -333,21 +334,29 @@ function renderAssessment(assessment, domRoot) {
   }
   domRoot.append('<br/><a class="gcb-button gcb-button-primary" id="submitAnswersBtn">Save Answers</a>');
 
+  // identifies the submissions made from this page, so that the server does
+  // not store the same answers twice if a submission is retried
+  var submissionToken = new Date().getTime().toString(36) + '-' +
+      Math.random().toString(36).substring(2);
+
 
   function checkOrSubmitAnswers(submitAnswers) {
     $('#answerOutput').html('');
 
     var scoreArray = [];
+    var responses = [];
     var lessonsToRead = [];
     
     $.each(assessment.questionsList, function(questionNum, q) {
       var isCorrect = false;
 
       if (q.choices) {
-        isCorrect = checkQuestionRadioSimple(document.assessment['q' + questionNum]);
+        responses.push(getCheckedRadioValue(document.assessment['q' + questionNum]));
+        isCorrect = (responses[questionNum] == String(q.correctIndex));
       }
       else if (q.correctAnswerString) {
         var answerVal = $('#q' + questionNum).val();
+        responses.push(answerVal);
         answerVal = answerVal.replace(/^\s+/,''); // trim leading spaces
         answerVal = answerVal.replace(/\s+$/,''); // trim trailing spaces
 
@@ -355,6 +364,7 @@ function renderAssessment(assessment, domRoot) {
       }
       else if (q.correctAnswerRegex) {
         var answerVal = $('#q' + questionNum).val();
+        responses.push(answerVal);
         answerVal = answerVal.replace(/^\s+/,''); // trim leading spaces
         answerVal = answerVal.replace(/\s+$/,''); // trim trailing spaces
 
@@ -363,7 +373,8 @@ function renderAssessment(assessment, domRoot) {
       }
       else if (q.correctAnswerNumeric) {
         // allow for some small floating-point leeway
-        var answerNum = parseFloat($('#q' + questionNum).val());
+        responses.push($('#q' + questionNum).val());
+        var answerNum = parseFloat(responses[questionNum]);
         var EPSILON = 0.001;
 
         if ((q.correctAnswerNumeric - EPSILON <= answerNum) &&
@@ -410,29 +421,20 @@ function renderAssessment(assessment, domRoot) {
       myInput.setAttribute("value", assessmentType);
       myForm.appendChild(myInput);
 
-      // create a form entry for each question/result pair
-      $.each(scoreArray, function(i, val) {
+      myInput = document.createElement("input");
+      myInput.setAttribute("name", "submission_token");
+      myInput.setAttribute("value", submissionToken);
+      myForm.appendChild(myInput);
+
+      // create a form entry for each question/response pair; the server
+      // grades the responses itself
+      $.each(responses, function(i, val) {
         myInput = document.createElement("input");
         myInput.setAttribute("name", i);
         myInput.setAttribute("value", val);
         myForm.appendChild(myInput);
       });
 
-      myInput = document.createElement("input");
-      myInput.setAttribute("name", "num_correct");
-      myInput.setAttribute("value", numCorrect);
-      myForm.appendChild(myInput);
-
-      myInput = document.createElement("input");
-      myInput.setAttribute("name", "num_questions");
-      myInput.setAttribute("value", numQuestions);
-      myForm.appendChild(myInput);
-
-      myInput = document.createElement("input");
-      myInput.setAttribute("name", "score");
-      myInput.setAttribute("value", score);
-      myForm.appendChild(myInput);
-
       document.body.appendChild(myForm);
       myForm.submit();
       document.body.removeChild(myForm);
@@ -469,19 +471,14 @@ function correct(choiceStr) {
 }
 
 
-// check a radio button answer - simple; return 1 if correct button checked
-function checkQuestionRadioSimple(radioGroup) {
+// get the value of the checked radio button; '' if none is checked
+function getCheckedRadioValue(radioGroup) {
   for (i=0; i<radioGroup.length; i++) {
     if (radioGroup[i].checked) {
-      if (radioGroup[i].value == "correct") {
-        return true;
-      }
-      else {
-        return false;
-      }
+      return radioGroup[i].value;
     }
   }
-  return false;
+  return '';
 }
 
 
@@ -0,0 +1,171 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Handlers for course maintenance tasks; only administrators can run them."""
+
+import time
+from assessments import storeQueuedSubmissions
+from models.courses import CourseIndex
+from models.events import AnswerEventLog
+from models.grading import GradingPolicy
+from models.models import Student, EnrollmentCounter
+from models.submissions import get_submission_queue
+from utils import ApplicationHandler
+from google.appengine.api import users
+from google.appengine.ext import db
+
+
+# the number of students to read and write in one datastore batch
+MIGRATION_BATCH_SIZE = 100
+
+# the time one request may spend migrating before it asks to be continued
+MIGRATION_TIME_BUDGET_SECS = 20
+
+# the time one request may spend storing queued submissions
+SUBMISSION_TIME_BUDGET_SECS = 50
+
+
+"""
+Base handler for administrator only tasks
+"""
+class AdminHandler(ApplicationHandler):
+  def isAdmin(self):
+    """Validate the current user is an administrator of the application."""
+    user = users.get_current_user()
+    if not user:
+      self.redirect(users.create_login_url(self.request.uri))
+      return False
+    if not users.is_current_user_admin():
+      self.error(403)
+      return False
+    return True
+
+  def echo(self, text):
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('%s\n' % text)
+
+
+"""
+Handler for checking and reconciling the sharded counter of enrolled students
+"""
+class EnrollmentCounterHandler(AdminHandler):
+  def get(self):
+    if not self.isAdmin():
+      return
+
+    counted = EnrollmentCounter.get_count()
+    actual = Student.all(keys_only=True).filter(
+        'is_enrolled =', True).count(limit=None)
+    self.echo('Counter: %s' % counted)
+    self.echo('Enrolled students: %s' % actual)
+
+    if self.request.get('reconcile') == 'true':
+      EnrollmentCounter.reset(actual)
+      self.echo('Counter is reset to: %s' % actual)
+
+
+"""
+Handler for making all instances rebuild the index of the course structure;
+visit it after uploading units and lessons with the bulkloader
+"""
+class CourseIndexHandler(AdminHandler):
+  def get(self):
+    if not self.isAdmin():
+      return
+
+    CourseIndex.invalidate()
+    self.echo('Course index is invalidated; it is rebuilt on the next request.')
+
+
+"""
+Handler for moving legacy JSON scores and answers of students into child
+entities; processes students in batches and reports the progress
+"""
+class StudentMigrationHandler(AdminHandler):
+  def get(self):
+    if not self.isAdmin():
+      return
+
+    batch_size = int(self.request.get('batch_size') or MIGRATION_BATCH_SIZE)
+    cursor = self.request.get('cursor')
+    processed = int(self.request.get('processed') or 0)
+    migrated = int(self.request.get('migrated') or 0)
+
+    deadline = time.time() + MIGRATION_TIME_BUDGET_SECS
+    while time.time() < deadline:
+      query = Student.all()
+      if cursor:
+        query.with_cursor(cursor)
+      students = query.fetch(batch_size)
+      if not students:
+        self.echo('Migration complete: %s students processed, %s migrated.' % (
+            processed, migrated))
+        return
+
+      entities = []
+      changed = []
+      for student in students:
+        if student.scores or student.answers:
+          student.migrate()
+          entities += student.get_entities_to_put()
+          changed.append(student)
+      if entities:
+        db.put(entities)
+      for student in changed:
+        student.cached()
+
+      cursor = query.cursor()
+      processed += len(students)
+      migrated += len(changed)
+      self.echo('Processed %s students, migrated %s.' % (processed, migrated))
+
+    self.echo('Continue at: admin/migrate_students?cursor=%s&processed=%s'
+              '&migrated=%s&batch_size=%s' % (
+                  cursor, processed, migrated, batch_size))
+
+
+"""
+Handler for storing assessment submissions queued by AnswerHandler; cron runs
+it every minute, see cron.yaml
+"""
+class SubmissionQueueHandler(AdminHandler):
+  def get(self):
+    is_cron = self.request.headers.get('X-AppEngine-Cron') == 'true'
+    if not is_cron and not self.isAdmin():
+      return
+
+    queue = get_submission_queue()
+    policy = GradingPolicy.get(self.app_context.getDataHome())
+    stored = 0
+    deadline = time.time() + SUBMISSION_TIME_BUDGET_SECS
+    while time.time() < deadline:
+      count = storeQueuedSubmissions(queue, policy)
+      if not count:
+        break
+      stored += count
+    self.echo('Stored %s submissions.' % stored)
+
+
+"""
+Handler for writing the answer events buffered in the instance that serves it;
+cron runs it every minute, see cron.yaml
+"""
+class AnswerEventLogHandler(AdminHandler):
+  def get(self):
+    is_cron = self.request.headers.get('X-AppEngine-Cron') == 'true'
+    if not is_cron and not self.isAdmin():
+      return
+
+    self.echo('Wrote %s answer events.' % AnswerEventLog.flush())
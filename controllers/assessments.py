@@ -17,14 +17,32 @@
 
 """Classes and methods to manage all aspects of student assessments."""
 
-import json, logging
+import logging, os
+from models.courses import CourseIndex, CONTENT_BACKEND_BUNDLE
+from models.events import AnswerEvent, AnswerEventLog
+from models.grading import ANSWER_METADATA_FIELDS, AnswerKeys, GradingPolicy
 from models.models import Student
+from models.submissions import Submission, get_submission_queue
 from models.utils import *
 from utils import BaseHandler
 from google.appengine.api import users
 from google.appengine.ext import db
 
 
+# FIXME: Earlier versions of activity-generic.js graded assessments in the
+#        browser and posted a 'score'; set this to True to keep trusting such
+#        scores. Otherwise the server grades the posted responses itself.
+ACCEPT_CLIENT_SCORES = False
+
+# FIXME: Set this to True to store submissions in the background: the answers
+#        are graded and queued, and the confirmation page is served right
+#        away; admin/store_submissions, run by cron, stores them in batches
+QUEUE_SUBMISSIONS = False
+
+# the number of queued submissions to store in one batch
+SUBMISSION_BATCH_SIZE = 100
+
+
 # Stores the assessment data in the student database entry
 # and returns the (possibly-modified) assessment type,
 # which the caller can use to render an appropriate response page.
@@ -33,12 +51,13 @@ from google.appengine.ext import db
 #
 # FIXME: Course creators can edit this code to implement
 #        custom assessment scoring and storage behavior
-def storeAssessmentData(student, assessment_type, score, answer):
+def storeAssessmentData(student, assessment_type, score, answer, policy=None,
+                        token=None):
   # TODO: Note that the latest version of answers are always saved,
   # but scores are only saved if they're higher than the previous
   # attempt.  This can lead to unexpected analytics behavior, so we
   # should resolve this somehow.
-  setAnswer(student, assessment_type, answer)
+  setAnswer(student, assessment_type, answer, token)
   existing_score = getScore(student, assessment_type)
   # remember to cast to int for comparison
   if (existing_score is None) or (score > int(existing_score)):
@@ -46,24 +65,13 @@ def storeAssessmentData(student, assessment_type, score, answer):
 
   # special handling for computing final score:
   if assessment_type == 'postcourse':
-    midcourse_score = getScore(student, 'midcourse')
-    if midcourse_score is None:
-      midcourse_score = 0
-    else:
-      midcourse_score = int(midcourse_score)
-
-    if existing_score is None:
-      postcourse_score = score
-    else:
-      postcourse_score = int(existing_score)
-      if score > postcourse_score:
-        postcourse_score = score
-
     # Calculate overall score based on a formula
-    overall_score = int((0.30*midcourse_score) + (0.70*postcourse_score))
+    if not policy:
+      policy = GradingPolicy()
+    overall_score = policy.get_overall_score(getAllScores(student))
 
     # TODO: this changing of assessment_type is ugly ...
-    if overall_score >= 70:
+    if policy.is_passing(overall_score):
       assessment_type = 'postcourse_pass'
     else:
       assessment_type = 'postcourse_fail'
@@ -72,20 +80,113 @@ def storeAssessmentData(student, assessment_type, score, answer):
   return assessment_type
 
 
+def isDuplicateSubmission(student, assessment_type, answer, token):
+  """Checks if the answers were already stored by the same submission."""
+  return bool(token) and (
+      token == student.get_answer_token(assessment_type) and
+      answer == student.get_answer(assessment_type))
+
+
+# Stores the queued submissions of one student in the order they were made
+@db.transactional
+def storeSubmissionsTransaction(email, submissions, policy):
+  student = Student.get_by_email(email)
+  if not student or not student.is_enrolled:
+    logging.warning('Dropped %s submissions of %s: not enrolled.',
+                    len(submissions), email)
+    return
+
+  for submission in submissions:
+    if not isDuplicateSubmission(
+        student, submission.assessment_type, submission.answer,
+        submission.token):
+      storeAssessmentData(
+          student, submission.assessment_type, submission.score,
+          submission.answer, policy, submission.token)
+  student.put_changes()
+
+
+def storeQueuedSubmissions(queue, policy, batch_size=SUBMISSION_BATCH_SIZE):
+  """Leases a batch of queued submissions and stores them.
+
+  The submissions of each student are stored in one transaction. The ones that
+  fail are left in the queue and are leased again when their lease expires.
+  Returns the number of submissions leased."""
+  leased = queue.lease(batch_size)
+  by_email = {}
+  for handle, submission in leased:
+    by_email.setdefault(submission.email, []).append((handle, submission))
+
+  stored = []
+  for email, items in by_email.items():
+    items.sort(key=lambda item: item[1].submitted)
+    try:
+      storeSubmissionsTransaction(
+          email, [submission for handle, submission in items], policy)
+      stored += [handle for handle, submission in items]
+    except db.Error:
+      logging.exception('Failed to store submissions of %s.', email)
+  queue.delete(stored)
+  return len(leased)
+
+
 """
 Handler for saving assessment answers
 """
 class AnswerHandler(BaseHandler):
 
-  # Find student entity and save answers
+  def getAnswerKey(self, assessment_type):
+    """Finds the compiled answer key of an assessment; None if not found."""
+    if self.app_context.getContentBackend() == CONTENT_BACKEND_BUNDLE:
+      answer_keys = AnswerKeys.get_from_index(
+          CourseIndex.get(self.app_context))
+    else:
+      answer_keys = AnswerKeys.get_from_folder(
+          os.path.join(self.app_context.getAssetsHome(), 'js'))
+    return answer_keys.get(assessment_type)
+
+  def getScore(self, assessment_type, answer):
+    """Grades the answer on the server; returns None if it can't be graded."""
+    if ACCEPT_CLIENT_SCORES and self.request.get('score'):
+      # TODO: considering storing as float for better precision
+      return int(round(float(self.request.get('score'))))
+
+    answer_key = self.getAnswerKey(assessment_type)
+    if not answer_key:
+      return None
+    return answer_key.score(answer)
+
+  # Find student entity and save answers; the student and the stored answers
+  # are read in one batch get, and only the changed scores and answers are
+  # written. A resubmission of the same answers with the same token, i.e. a
+  # retried request, is graded again but nothing is written. Returns
+  # (None, None) if the student is not enrolled.
   @db.transactional
-  def storeAssessmentTransaction(self, email, original_type, answer):
-    student = Student.get_by_email(email)
+  def storeAssessmentTransaction(
+      self, email, original_type, score, answer, token, policy):
+    student = Student.get_with_answer(email, original_type)
+    if not student or not student.is_enrolled:
+      return (None, None)
+
+    duplicate = isDuplicateSubmission(student, original_type, answer, token)
+    assessment_type = storeAssessmentData(
+        student, original_type, score, answer, policy, token)
+    if not duplicate:
+      student.put_changes()
+    return (student, assessment_type)
 
-    # TODO: considering storing as float for better precision
-    score = int(round(float(self.request.get('score'))))
-    assessment_type = storeAssessmentData(student, original_type, score, answer)
-    student.put()
+  # Queues the answers to be stored later; the result is computed from the
+  # scores stored so far, but nothing is written. Returns (None, None) if the
+  # student is not enrolled.
+  def queueAssessment(self, email, original_type, score, answer, token, policy):
+    student = Student.get_enrolled_student_by_email(email)
+    if not student:
+      return (None, None)
+
+    get_submission_queue().add(
+        Submission(email, original_type, score, answer, token))
+    assessment_type = storeAssessmentData(
+        student, original_type, score, answer, policy, token)
     return (student, assessment_type)
 
   def post(self):
@@ -94,17 +195,31 @@ class AnswerHandler(BaseHandler):
       self.redirect(users.create_login_url(self.request.uri))
       return
     
-    # Read in answers
-    answer = json.dumps(self.request.POST.items())
+    # Read in answers, only keep responses to questions
+    answer = []
+    for name, value in self.request.POST.items():
+      if not name in ANSWER_METADATA_FIELDS:
+        answer.append([name, value])
     original_type = self.request.get('assessment_type')
+    score = self.getScore(original_type, answer)
+    if score is None:
+      logging.error('Unable to grade assessment: %s', original_type)
+      self.error(400)
+      return
 
-    # Check for enrollment status
-    student = Student.get_by_email(user.email())
-    if student and student.is_enrolled:
-      # Log answer submission
-      logging.info(student.key().name() + ':' + answer)
-
-      (student, assessment_type) = self.storeAssessmentTransaction(student.key().name(), original_type, answer)
+    # Store or queue the answers if the student is enrolled
+    token = self.request.get('submission_token') or None
+    if QUEUE_SUBMISSIONS:
+      store = self.queueAssessment
+    else:
+      store = self.storeAssessmentTransaction
+    (student, assessment_type) = store(
+        user.email(), original_type, score, answer, token,
+        GradingPolicy.get(self.app_context.getDataHome()))
+    if student:
+      # Add the submission to the audit log
+      AnswerEventLog.record(AnswerEvent(
+          student.key().name(), original_type, score, answer, token))
 
       # Serve the confirmation page
       self.templateValue['navbar'] = {'course': True}
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 
-from models.models import Unit
+from models.courses import CourseIndex
 from utils import BaseHandler
 from google.appengine.api import users
 
@@ -24,7 +24,7 @@ class CourseHandler(BaseHandler):
   def get(self):
     user = self.personalizePageAndGetUser()
     if user:
-      self.templateValue['units'] = Unit.get_units()
+      self.templateValue['units'] = CourseIndex.get(self.app_context).units
       self.templateValue['navbar'] = {'course': True}
       self.render('course.html')
     else:
@@ -57,30 +57,20 @@ class UnitHandler(BaseHandler):
     self.templateValue['lesson_id'] = lesson_id
 
     # Set template values for a unit and its lesson entities
-    for unit in Unit.get_units():
-      if unit.unit_id == str(unit_id):
-        self.templateValue['units'] = unit
-
-    lessons = Unit.get_lessons(unit_id)
-    self.templateValue['lessons'] = lessons
+    index = CourseIndex.get(self.app_context)
+    unit = index.find_unit(unit_id)
+    if unit:
+      self.templateValue['units'] = unit
+    self.templateValue['lessons'] = index.get_lessons(unit_id)
+    self.templateValue['lesson'] = index.get_lesson(unit_id, lesson_id)
 
     # Set template values for nav bar
     self.templateValue['navbar'] = {'course': True}
 
     # Set template values for back and next nav buttons
-    if lesson_id == 1:
-      self.templateValue['back_button_url'] = ''
-    elif lessons[lesson_id - 2].activity:
-      self.templateValue['back_button_url'] = '/activity?unit=' + str(unit_id) + '&lesson=' + str(lesson_id - 1)
-    else:
-      self.templateValue['back_button_url'] = '/unit?unit=' + str(unit_id) + '&lesson=' + str(lesson_id - 1)
-
-    if lessons[lesson_id - 1].activity:
-      self.templateValue['next_button_url'] = '/activity?unit=' + str(unit_id) + '&lesson=' + str(lesson_id)
-    elif lesson_id == lessons.count():
-      self.templateValue['next_button_url'] = ''
-    else:
-      self.templateValue['next_button_url'] = '/unit?unit=' + str(unit_id) + '&lesson=' + str(lesson_id + 1)
+    (self.templateValue['back_button_url'],
+     self.templateValue['next_button_url']) = index.get_unit_navigation(
+         unit_id, lesson_id)
 
     self.render('unit.html')
 
@@ -112,22 +102,20 @@ class ActivityHandler(BaseHandler):
     self.templateValue['lesson_id'] = lesson_id
 
     # Set template values for a unit and its lesson entities
-    for unit in Unit.get_units():
-      if unit.unit_id == str(unit_id):
-        self.templateValue['units'] = unit
-
-    lessons = Unit.get_lessons(unit_id)
-    self.templateValue['lessons'] = lessons
+    index = CourseIndex.get(self.app_context)
+    unit = index.find_unit(unit_id)
+    if unit:
+      self.templateValue['units'] = unit
+    self.templateValue['lessons'] = index.get_lessons(unit_id)
+    self.templateValue['lesson'] = index.get_lesson(unit_id, lesson_id)
 
     # Set template values for nav-x bar
     self.templateValue['navbar'] = {'course': True}
 
     # Set template values for back and next nav buttons
-    self.templateValue['back_button_url'] = '/unit?unit=' + str(unit_id) + '&lesson=' + str(lesson_id)
-    if lesson_id == lessons.count():
-      self.templateValue['next_button_url'] = ''
-    else:
-      self.templateValue['next_button_url'] = '/unit?unit=' + str(unit_id) + '&lesson=' + str(lesson_id + 1)
+    (self.templateValue['back_button_url'],
+     self.templateValue['next_button_url']) = index.get_activity_navigation(
+         unit_id, lesson_id)
 
     self.render('activity.html')
 
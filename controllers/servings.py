@@ -35,7 +35,7 @@ class CourseHandler(StudentHandler):
     student = self.getEnrolledStudent()
     if student:
       page = self.getOrCreatePage('course_page', lessons.CourseHandler())
-      self.serve(page, student.key().name())
+      self.serve(page, student.email)
     else:
       self.redirect('/preview')
 
@@ -64,7 +64,7 @@ class UnitHandler(StudentHandler):
     if student:
       page = self.getOrCreatePage(
           'lesson%s%s_page' % (class_id, lesson_id), lessons.UnitHandler())
-      self.serve(page, student.key().name())
+      self.serve(page, student.email)
     else:
       self.redirect('/register')
 
@@ -93,7 +93,7 @@ class ActivityHandler(StudentHandler):
     if student:
       page = self.getOrCreatePage(
           'activity' + str(class_id) + str(lesson_id) + '_page', lessons.ActivityHandler())
-      self.serve(page, student.key().name())
+      self.serve(page, student.email)
     else:
       self.redirect('/register')
 
@@ -115,7 +115,7 @@ class AssessmentHandler(StudentHandler):
     if student:
       page = self.getOrCreatePage(
           'assessment' + name + '_page', lessons.AssessmentHandler())
-      self.serve(page, student.key().name())
+      self.serve(page, student.email)
     else:
       self.redirect('/register')
 
@@ -130,7 +130,7 @@ class ForumHandler(StudentHandler):
     student = self.getEnrolledStudent()
     if student:
       page = self.getOrCreatePage('forum_page', utils.ForumHandler())
-      self.serve(page, student.key().name())
+      self.serve(page, student.email)
     else:
       self.redirect('/register')
 
@@ -143,7 +143,7 @@ class PreviewHandler(StudentHandler):
   def get(self):
     user = users.get_current_user()
     if user:
-      if Student.get_enrolled_student_by_email(user.email()):
+      if Student.get_enrollment_by_email(user.email()):
         self.redirect('/course')
       else:
         page = self.getOrCreatePage('loggedin_preview_page', utils.CoursePreviewHandler())
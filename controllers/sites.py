@@ -29,6 +29,14 @@ must set an environment variable in app.yaml file, for example:
 This variable holds a ',' separated list of rewrite rules. Each rewrite rule has
 three ':' separated parts: the word 'course', the URL prefix, and the file system
 location for the site files. The fourth, optional part, is a course namespace name.
+The fifth, optional part, names where the course units and lessons are read from:
+'datastore' (the default) reads the entities uploaded by the bulkloader, 'csv' reads
+the 'data/unit.csv' and 'data/lesson.csv' files of the course directly, so serving
+the course structure needs no datastore reads at all; 'bundle' reads the single
+'data/course.bundle' file written by 'python tools/export.py bundle'. Leave the
+namespace part empty to derive it, for example:
+
+    GCB_COURSES_CONFIG: 'course:/coursea:/courses/a::csv'
 
 The URL prefix specifies, how will the course URL appear in the browser. In the
 example above, the courses will be mapped to http://www.example.com[/coursea] and
@@ -85,6 +93,10 @@ add a 'namespace' parameter, here is an example:
   --namespace=gcb-courses-a
   ...
 
+Courses served from the 'datastore' backend keep their units and lessons in memory
+and in memcache; after each upload, visit '/courses/a/admin/invalidate_course_index'
+as an administrator, so that all instances read the new units and lessons.
+
 If you have an existing course built on a previous version of Course Builder and you
 now decided to use new URL prefix, which is not '/', you will need to update your
 old course html template and JavaScript files. You typically would have to make two
@@ -116,6 +128,7 @@ Good luck!
 """
 
 import appengine_config, logging, mimetypes, os, threading, webapp2
+from models.courses import CONTENT_BACKENDS, CONTENT_BACKEND_DATASTORE
 from google.appengine.api import namespace_manager
 
 
@@ -128,6 +141,7 @@ GCB_BASE_COURSE_NAMESPACE = 'gcb-course'
 # these folder names are reserved
 GCB_ASSETS_FOLDER_NAME = os.path.normpath('/assets/')
 GCB_VIEWS_FOLDER_NAME = os.path.normpath('/views/')
+GCB_DATA_FOLDER_NAME = os.path.normpath('/data/')
 
 # supported site types
 SITE_TYPE_COURSE = 'course'
@@ -191,9 +205,10 @@ def getAllRules():
     parts = rule.split(':')
 
     # validate length
-    if len(parts) < 3:
+    if len(parts) < 3 or len(parts) > 5:
       raise Exception(
-          'Expected rule definition in a form of \'type:slug:folder[:ns]\', got %s: ' % rule)
+          'Expected rule definition in a form of '
+          '\'type:slug:folder[:ns[:backend]]\', got %s: ' % rule)
 
     # validate type
     if parts[0] != SITE_TYPE_COURSE:
@@ -211,7 +226,7 @@ def getAllRules():
 
     # validate or derive namespace
     namespace = None
-    if len(parts) == 4:
+    if len(parts) >= 4 and parts[3]:
       namespace = parts[3]
     else:
       if folder == '/' or folder == '':
@@ -222,7 +237,15 @@ def getAllRules():
         raise Exception('Namespace already defined: %s.' % namespace)
     namespaces[namespace] = True
 
-    all.append(ApplicationContext(type, slug, folder, namespace))
+    # validate content backend
+    backend = CONTENT_BACKEND_DATASTORE
+    if len(parts) == 5:
+      backend = parts[4]
+      if not backend in CONTENT_BACKENDS:
+        raise Exception('Expected one of %s, found: \'%s\'.' % (
+            CONTENT_BACKENDS, backend))
+
+    all.append(ApplicationContext(type, slug, folder, namespace, backend))
   return all
 
 
@@ -313,11 +336,13 @@ class ApplicationContext(object):
       return rule.namespace
     return None
 
-  def __init__(self, type, slug, homefolder, namespace):
+  def __init__(self, type, slug, homefolder, namespace,
+               content_backend=CONTENT_BACKEND_DATASTORE):
     self.slug = slug
     self.homefolder = homefolder
     self.type = type
     self.namespace = namespace
+    self.content_backend = content_backend
 
   def getHomeFolder(self):
     """A folder with the assets belonging to this context."""
@@ -332,6 +357,18 @@ class ApplicationContext(object):
     debug('Template home: %s' % path)
     return path
 
+  def getAssetsHome(self):
+    """A folder with the assets, i.e. activity and assessment scripts."""
+    return abspath(self.getHomeFolder(), GCB_ASSETS_FOLDER_NAME)
+
+  def getDataHome(self):
+    """A folder with the CSV files that define the course layout."""
+    return abspath(self.getHomeFolder(), GCB_DATA_FOLDER_NAME)
+
+  def getContentBackend(self):
+    """Where the course units and lessons are read from, i.e. 'csv'."""
+    return self.content_backend
+
 
 """A class that handles dispatching of all URL's to proper handlers."""
 class ApplicationRequestHandler(webapp2.RequestHandler):
@@ -469,6 +506,16 @@ def TestRuleDefinitions():
   os.environ[GCB_COURSES_CONFIG_ENV_VAR_NAME] = 'course:/a/b:/c/d, course:/e/f:/g/h'
   assert len(getAllRules()) == 2
 
+  # test content backends
+  os.environ[GCB_COURSES_CONFIG_ENV_VAR_NAME] = (
+      'course:/a/b:/c/d::csv, course:/e/f:/g/h:ns')
+  rules = getAllRules()
+  assert rules[0].getContentBackend() == 'csv'
+  assert rules[0].namespace == 'gcb-course-c-d'
+  assert rules[1].getContentBackend() == 'datastore'
+  os.environ[GCB_COURSES_CONFIG_ENV_VAR_NAME] = 'course:/a/b:/c/d::foo'
+  AssertFails(getAllRules)
+
   # test two of the same slugs are not allowed
   os.environ[GCB_COURSES_CONFIG_ENV_VAR_NAME] = 'foo:/a/b:/c/d, bar:/a/b:/c/d'
   AssertFails(getAllRules)
@@ -12,16 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging, urlparse, webapp2, jinja2
-from models.models import Student, Unit, MemcacheManager
+from models.models import Student, MemcacheManager, EnrollmentCounter
+from models.courses import CourseIndex
 from google.appengine.api import users
 from google.appengine.ext import db
 from models.utils import getAllScores
 
 
 # FIXME: Set MAX_CLASS_SIZE to a positive integer if you want to restrict the
-# course size to a maximum of N students. Note, though, that counting the students
-# in this way uses a lot of database calls that may cost you quota and money.
-# TODO(psimakov): we must use sharded counter and not Student.all().count()
+# course size to a maximum of N enrolled students. The students are counted by
+# a sharded EnrollmentCounter; if you enable the limit for a course that already
+# has students, visit /admin/enrollment_counter?reconcile=true once as an
+# administrator to initialize the counter.
 MAX_CLASS_SIZE = None
 
 # a template place holder for the student email 
@@ -149,9 +151,10 @@ class StudentHandler(ApplicationHandler):
     return handler.response.out.getText()
 
   def getEnrolledStudent(self):
+    """Returns StudentEnrollment of the current user if enrolled."""
     user = users.get_current_user()
     if user:
-      return Student.get_enrolled_student_by_email(user.email())
+      return Student.get_enrollment_by_email(user.email())
     else:
       self.redirect(users.create_login_url(self.request.uri))
 
@@ -178,8 +181,8 @@ class CoursePreviewHandler(BaseHandler):
       self.templateValue['logoutUrl'] = users.create_logout_url("/")
 
     self.templateValue['navbar'] = {'course': True}
-    self.templateValue['units'] = Unit.get_units()
-    if user and Student.get_enrolled_student_by_email(user.email()):
+    self.templateValue['units'] = CourseIndex.get(self.app_context).units
+    if user and Student.get_enrollment_by_email(user.email()):
       self.redirect('/course')
     else:
       self.render('preview.html')
@@ -189,6 +192,24 @@ class CoursePreviewHandler(BaseHandler):
 Handler for course registration
 """
 class RegisterHandler(BaseHandler):
+
+  # Create new or re-enroll old student, count the new enrollments; returns
+  # the written student, if any, and the change of the count, which the caller
+  # applies to memcache once the transaction has committed
+  @db.transactional(xg=True)
+  def enrollTransaction(self, email, name):
+    student = Student.get_by_email(email)
+    if student:
+      if student.is_enrolled:
+        return (None, 0)
+      student.is_enrolled = True
+      student.name = name
+    else:
+      student = Student(key_name=email, name=name, is_enrolled=True)
+    EnrollmentCounter.change_in_transaction(1)
+    db.put(student.get_entities_to_put())
+    return (student, 1)
+
   def get(self):
     user = self.personalizePageAndGetUser()
     if not user:
@@ -197,7 +218,7 @@ class RegisterHandler(BaseHandler):
 
     self.templateValue['navbar'] = {'registration': True}
     # Check for existing registration -> redirect to course page
-    student = Student.get_enrolled_student_by_email(user.email())
+    student = Student.get_enrollment_by_email(user.email())
     if student:
       self.redirect('/course')
     else:
@@ -209,21 +230,15 @@ class RegisterHandler(BaseHandler):
       self.redirect(users.create_login_url(self.request.uri))
       return
 
-    if (MAX_CLASS_SIZE and Student.all(keys_only=True).count() >= MAX_CLASS_SIZE):
+    if (MAX_CLASS_SIZE and EnrollmentCounter.get_count() >= MAX_CLASS_SIZE):
       self.templateValue['course_status'] = 'full'
     else:
       # Create student record
       name = self.request.get('form01')
-
-      # create new or re-enroll old student
-      student = Student.get_by_email(user.email())
+      student, delta = self.enrollTransaction(user.email(), name)
       if student:
-        if not student.is_enrolled:
-          student.is_enrolled = True
-          student.name = name
-      else:
-        student = Student(key_name=user.email(), name=name, is_enrolled=True)
-      student.put()
+        student.cached()
+      EnrollmentCounter.changed(delta)
 
     # Render registration confirmation page
     self.templateValue['navbar'] = {'registration': True}
@@ -334,7 +349,7 @@ class AnnouncementsHandler(BaseHandler):
       self.redirect(users.create_login_url(self.request.uri))
       return
 
-    student = Student.get_enrolled_student_by_email(user.email())
+    student = Student.get_enrollment_by_email(user.email())
     if not student:
       self.redirect('/preview')
       return
@@ -347,13 +362,27 @@ class AnnouncementsHandler(BaseHandler):
 Handler for students to unenroll themselves
 """
 class StudentUnenrollHandler(BaseHandler):
+
+  # Unenroll the student and discount the enrollment; returns the written
+  # student, if any, and the change of the count, which the caller applies to
+  # memcache once the transaction has committed
+  @db.transactional(xg=True)
+  def unenrollTransaction(self, email):
+    student = Student.get_by_email(email)
+    if student and student.is_enrolled:
+      student.is_enrolled = False
+      EnrollmentCounter.change_in_transaction(-1)
+      db.put(student.get_entities_to_put())
+      return (student, -1)
+    return (None, 0)
+
   def get(self):
     user = self.personalizePageAndGetUser()
     if not user:
       self.redirect(users.create_login_url(self.request.uri))
       return
 
-    student = Student.get_enrolled_student_by_email(user.email())
+    student = Student.get_enrollment_by_email(user.email())
     if student:
       self.templateValue['student'] = student
     self.templateValue['navbar'] = {'registration': True}
@@ -366,10 +395,10 @@ class StudentUnenrollHandler(BaseHandler):
       return
 
     # Update student record
-    student = Student.get_by_email(user.email())
-    if student and student.is_enrolled:
-      student.is_enrolled = False
-      student.put()
+    student, delta = self.unenrollTransaction(user.email())
+    if student:
+      student.cached()
+    EnrollmentCounter.changed(delta)
     self.templateValue['navbar'] = {'registration': True}
     self.render('unenroll_confirmation.html')
 
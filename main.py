@@ -14,7 +14,7 @@
 
 import sys
 import appengine_config, webapp2
-from controllers import servings, sites, utils, assessments
+from controllers import admin, servings, sites, utils, assessments
 from webapp2 import WSGIApplication, Route
 
 #inject './lib' dir in the path so that we can simple
@@ -31,6 +31,11 @@ debug = True
 urls = [
   ('/', servings.CourseHandler),
   ('/activity', servings.ActivityHandler),
+  ('/admin/enrollment_counter', admin.EnrollmentCounterHandler),
+  ('/admin/migrate_students', admin.StudentMigrationHandler),
+  ('/admin/store_submissions', admin.SubmissionQueueHandler),
+  ('/admin/flush_answer_events', admin.AnswerEventLogHandler),
+  ('/admin/invalidate_course_index', admin.CourseIndexHandler),
   ('/announcements', utils.AnnouncementsHandler),
   ('/answer', assessments.AnswerHandler),
   ('/assessment', servings.AssessmentHandler),
@@ -0,0 +1,339 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""An in-memory index of the structure of a course: its units and lessons.
+
+The course structure is read from one of two content backends, as selected
+for each course in GCB_COURSES_CONFIG (see controllers/sites.py).
+
+The 'datastore' backend reads the structure with one query for all units and
+one for all lessons. The resulting CourseIndex is kept in memory of the
+instance and in memcache. Both copies are stored under a content version,
+which is itself held in memcache; call CourseIndex.invalidate(), i.e. by
+visiting admin/invalidate_course_index after the bulkloader has uploaded new
+units or lessons, to make all instances rebuild their index on the next
+request. The index holds only a
+LessonSummary of each lesson; the full Lesson of the page being rendered is
+read from memcache, or the datastore, on demand.
+
+The 'csv' backend reads the 'data/unit.csv' and 'data/lesson.csv' files of
+the course. The 'bundle' backend reads the 'data/course.bundle' file made by
+"python tools/export.py bundle"; in addition to units and lessons, it holds
+parsed activities and assessments with their answer keys. The resulting
+CourseIndex, with all full lessons, is kept in memory of the instance until
+the modification time or the size of the files changes.
+"""
+
+import os, threading, uuid
+from models.models import MemcacheManager, Unit, Lesson, LessonSummary
+from models.models import encode_entity, decode_entity
+from tools import export, verify
+from google.appengine.api import namespace_manager
+
+
+# version of the format of CourseIndex stored in memcache
+COURSE_INDEX_FORMAT_VERSION = 2
+
+# memcache key of the content version of the course structure
+CONTENT_VERSION_KEY = 'course_content_version'
+
+# supported sources of the course structure
+CONTENT_BACKEND_DATASTORE = 'datastore'
+CONTENT_BACKEND_CSV = 'csv'
+CONTENT_BACKEND_BUNDLE = 'bundle'
+CONTENT_BACKENDS = [
+    CONTENT_BACKEND_DATASTORE, CONTENT_BACKEND_CSV, CONTENT_BACKEND_BUNDLE]
+
+
+def is_true(value):
+  return value == True or value in ['True', 'TRUE', 'true']
+
+
+def make_unit(row):
+  """Makes a Unit view (not stored) from a verify.Unit row of unit.csv."""
+  return Unit(
+      id=int(row.id), type=str(row.type), unit_id=str(row.unit_id),
+      title=str(row.title), release_date=str(row.release_date),
+      now_available=is_true(row.now_available))
+
+
+def make_lesson(row):
+  """Makes a Lesson view (not stored) from a verify.Lesson row of lesson.csv."""
+  return Lesson(
+      unit_id=int(row.unit_id), id=int(row.lesson_id),
+      title=str(row.lesson_title), activity=str(row.lesson_activity),
+      activity_title=str(row.lesson_activity_name),
+      notes=str(row.lesson_notes), slides=str(row.lesson_slides),
+      video=str(row.lesson_video_id), objectives=str(row.lesson_objectives))
+
+
+class CourseIndex(object):
+  """An immutable index of the units and lessons of one course."""
+
+  # course namespace or names of content files -> (content version,
+  # CourseIndex) of this instance
+  _instance_cache = {}
+  _instance_cache_lock = threading.Lock()
+
+  def __init__(self, units, lessons, version=None, content=None):
+    """Makes an index of units and of a Lesson or LessonSummary of lessons.
+
+    Args:
+      units: all units of the course
+      lessons: all lessons of the course, in any order
+      version: the content version the full lessons are cached under
+      content: optional dict of (unit_id, lesson_id) -> full Lesson; if set,
+          get_lesson() is served from it instead of memcache
+    """
+    self.version = version
+    self._content = content
+
+    # only a course bundle provides these
+    self.content_hash = None
+    self.activities = {}
+    self.assessments = {}
+    self.answer_keys = {}
+    self.units = tuple(sorted(units, key=lambda unit: unit.id))
+
+    self._units_by_id = {}
+    self._units_by_unit_id = {}
+    for unit in self.units:
+      self._units_by_id[unit.id] = unit
+      self._units_by_unit_id[unit.unit_id] = unit
+
+    lessons_by_unit = {}
+    self._lesson_ids = set()
+    for lesson in lessons:
+      if not isinstance(lesson, LessonSummary):
+        lesson = LessonSummary.from_lesson(lesson)
+      lessons_by_unit.setdefault(lesson.unit_id, []).append(lesson)
+      self._lesson_ids.add((lesson.unit_id, lesson.id))
+    self._lessons = {}
+    for unit_id, unit_lessons in lessons_by_unit.items():
+      self._lessons[unit_id] = tuple(
+          sorted(unit_lessons, key=lambda lesson: lesson.id))
+
+    self._unit_navigation = {}
+    self._activity_navigation = {}
+    for unit_id, unit_lessons in self._lessons.items():
+      self._index_navigation(unit_id, unit_lessons)
+
+  def _index_navigation(self, unit_id, lessons):
+    """Precomputes back and next button URLs of all pages of the unit."""
+    for i in range(0, len(lessons)):
+      lesson_id = i + 1
+
+      # unit page buttons
+      if lesson_id == 1:
+        back_url = ''
+      elif lessons[i - 1].activity:
+        back_url = '/activity?unit=%s&lesson=%s' % (unit_id, lesson_id - 1)
+      else:
+        back_url = '/unit?unit=%s&lesson=%s' % (unit_id, lesson_id - 1)
+
+      if lessons[i].activity:
+        next_url = '/activity?unit=%s&lesson=%s' % (unit_id, lesson_id)
+      elif lesson_id == len(lessons):
+        next_url = ''
+      else:
+        next_url = '/unit?unit=%s&lesson=%s' % (unit_id, lesson_id + 1)
+      self._unit_navigation[(unit_id, lesson_id)] = (back_url, next_url)
+
+      # activity page buttons
+      back_url = '/unit?unit=%s&lesson=%s' % (unit_id, lesson_id)
+      if lesson_id == len(lessons):
+        next_url = ''
+      else:
+        next_url = '/unit?unit=%s&lesson=%s' % (unit_id, lesson_id + 1)
+      self._activity_navigation[(unit_id, lesson_id)] = (back_url, next_url)
+
+  def find_unit_by_id(self, id):
+    """Finds a unit by its 'id'; returns None if not found."""
+    return self._units_by_id.get(id)
+
+  def find_unit(self, unit_id):
+    """Finds a unit by its 'unit_id', i.e. '1' or 'Pre'; None if not found."""
+    return self._units_by_unit_id.get(str(unit_id))
+
+  def get_lessons(self, unit_id):
+    """Returns LessonSummary of lessons of a unit with integer 'unit_id'."""
+    return self._lessons.get(unit_id, ())
+
+  def _lesson_cache_key(self, unit_id, lesson_id):
+    return 'lesson:%s:%s:%s' % (self.version, unit_id, lesson_id)
+
+  def get_lesson(self, unit_id, lesson_id):
+    """Returns the full Lesson with all its content; None if not found."""
+    if self._content is not None:
+      return self._content.get((unit_id, lesson_id))
+    if not (unit_id, lesson_id) in self._lesson_ids:
+      return None
+
+    key = self._lesson_cache_key(unit_id, lesson_id)
+    lesson = decode_entity(MemcacheManager.get(key))
+    if not lesson:
+      lesson = Lesson.all().filter('unit_id =', unit_id).filter(
+          'id =', lesson_id).get()
+      if lesson:
+        MemcacheManager.set(key, encode_entity(lesson))
+    return lesson
+
+  def get_unit_navigation(self, unit_id, lesson_id):
+    """Returns (back_button_url, next_button_url) of a lesson page."""
+    return self._unit_navigation.get((unit_id, lesson_id), ('', ''))
+
+  def get_activity_navigation(self, unit_id, lesson_id):
+    """Returns (back_button_url, next_button_url) of an activity page."""
+    return self._activity_navigation.get((unit_id, lesson_id), ('', ''))
+
+  def encode(self):
+    """Encodes this index into a value for memcache."""
+    return (COURSE_INDEX_FORMAT_VERSION,
+            [encode_entity(unit) for unit in self.units],
+            [lesson.encode() for lessons in self._lessons.values()
+             for lesson in lessons])
+
+  @classmethod
+  def decode(cls, value, version=None):
+    """Decodes a value made by encode(); returns None if unusable."""
+    if not isinstance(value, tuple) or len(value) != 3:
+      return None
+    if value[0] != COURSE_INDEX_FORMAT_VERSION:
+      return None
+    return CourseIndex([decode_entity(unit) for unit in value[1]],
+                       [LessonSummary.decode(lesson) for lesson in value[2]],
+                       version)
+
+  @classmethod
+  def load(cls, version=None):
+    """Reads the course structure from the datastore.
+
+    The full lessons are read by the same query anyway, so they are put into
+    memcache for get_lesson() right away."""
+    lessons = list(Lesson.all())
+    index = CourseIndex(list(Unit.all()), lessons, version)
+    if version:
+      MemcacheManager.set_multi(dict([(
+          index._lesson_cache_key(lesson.unit_id, lesson.id),
+          encode_entity(lesson)) for lesson in lessons]))
+    return index
+
+  @classmethod
+  def load_from_files(cls, unit_file, lesson_file):
+    """Reads the course structure from the CSV files of the course."""
+    units = verify.ReadObjectsFromCsvFile(
+        unit_file, verify.UNITS_HEADER, verify.Unit)
+    lessons = verify.ReadObjectsFromCsvFile(
+        lesson_file, verify.LESSONS_HEADER, verify.Lesson)
+    lessons = [make_lesson(lesson) for lesson in lessons]
+    return CourseIndex(
+        [make_unit(unit) for unit in units], lessons, content=dict(
+            [((lesson.unit_id, lesson.id), lesson) for lesson in lessons]))
+
+  @classmethod
+  def load_from_bundle(cls, bundle_file):
+    """Reads the course structure and content from a course bundle."""
+    def Fields(item):
+      return dict([(str(name), value) for name, value in item.items()])
+
+    bundle = export.ReadBundle(bundle_file)
+    lessons = [Lesson(**Fields(lesson)) for lesson in bundle['lessons']]
+    index = CourseIndex(
+        [Unit(**Fields(unit)) for unit in bundle['units']], lessons,
+        content=dict([
+            ((lesson.unit_id, lesson.id), lesson) for lesson in lessons]))
+    index.content_hash = bundle['content_hash']
+    index.activities = bundle['activities']
+    index.assessments = bundle['assessments']
+    index.answer_keys = bundle['answer_keys']
+    return index
+
+  @classmethod
+  def get_from_files(cls, fnames, load):
+    """Returns the CourseIndex load(*fnames) made; reloads if files change."""
+    version = []
+    for fname in fnames:
+      stat = os.stat(fname)
+      version += [stat.st_mtime, stat.st_size]
+
+    key = tuple(fnames)
+    cached = CourseIndex._instance_cache.get(key)
+    if cached and cached[0] == version:
+      return cached[1]
+
+    index = load(*fnames)
+    with CourseIndex._instance_cache_lock:
+      CourseIndex._instance_cache[key] = (version, index)
+    return index
+
+  @classmethod
+  def get_content_version(cls):
+    """Returns the current content version, makes a new one if none is set.
+
+    The version is shared by all instances in memcache. Without memcache the
+    version of the index this instance has built is kept, so the index is
+    only rebuilt after invalidate() in the same instance."""
+    if not MemcacheManager.enabled():
+      cached = CourseIndex._instance_cache.get(
+          namespace_manager.get_namespace())
+      if cached:
+        return cached[0]
+      return uuid.uuid4().hex
+
+    version = MemcacheManager.get(CONTENT_VERSION_KEY)
+    if not version:
+      version = uuid.uuid4().hex
+      MemcacheManager.set(CONTENT_VERSION_KEY, version)
+    return version
+
+  @classmethod
+  def get(cls, app_context=None):
+    """Returns the CourseIndex of the course of the current request."""
+    backend = CONTENT_BACKEND_DATASTORE
+    if app_context:
+      backend = app_context.getContentBackend()
+    if backend == CONTENT_BACKEND_CSV:
+      return CourseIndex.get_from_files([
+          os.path.join(app_context.getDataHome(), 'unit.csv'),
+          os.path.join(app_context.getDataHome(), 'lesson.csv')],
+          CourseIndex.load_from_files)
+    if backend == CONTENT_BACKEND_BUNDLE:
+      return CourseIndex.get_from_files([
+          os.path.join(app_context.getDataHome(), export.BUNDLE_FILE_NAME)],
+          CourseIndex.load_from_bundle)
+
+    namespace = namespace_manager.get_namespace()
+    version = CourseIndex.get_content_version()
+
+    cached = CourseIndex._instance_cache.get(namespace)
+    if cached and cached[0] == version:
+      return cached[1]
+
+    key = 'course_index:%s' % version
+    index = CourseIndex.decode(MemcacheManager.get(key), version)
+    if not index:
+      index = CourseIndex.load(version)
+      MemcacheManager.set(key, index.encode())
+
+    with CourseIndex._instance_cache_lock:
+      CourseIndex._instance_cache[namespace] = (version, index)
+    return index
+
+  @classmethod
+  def invalidate(cls):
+    """Makes all instances rebuild the index of the current course."""
+    MemcacheManager.delete(CONTENT_VERSION_KEY)
+    with CourseIndex._instance_cache_lock:
+      CourseIndex._instance_cache.pop(namespace_manager.get_namespace(), None)
@@ -0,0 +1,185 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""An append-only audit log of assessment submissions.
+
+Each submission is recorded as an AnswerEvent. The events are buffered in
+memory of the instance and written in batches, as AnswerEventSegment entities
+in the namespace of the course. The segments are never changed after they are
+written; their key names sort in the order they were written, so the log can
+be read back in order with read_answer_events().
+
+The buffered events of a course are written once ANSWER_EVENT_BATCH_SIZE
+events are buffered, by the first submission after the oldest one has been
+buffered for ANSWER_EVENT_FLUSH_SECS seconds, or by admin/flush_answer_events,
+which cron requests every minute. A cron request is served by one instance, so
+an instance that gets no more submissions may keep its events until cron
+reaches it; they are lost if the instance stops before that. If writes fail,
+at most ANSWER_EVENT_MAX_BUFFERED events of a course are kept buffered; older
+ones are logged as errors and dropped.
+"""
+
+import json, logging, os, threading, time, zlib
+from google.appengine.api import namespace_manager
+from google.appengine.ext import db
+
+
+# the number of buffered events that are written in one segment
+ANSWER_EVENT_BATCH_SIZE = 50
+
+# the longest time an event is buffered before it is written
+ANSWER_EVENT_FLUSH_SECS = 30
+
+# the most events of a course that are kept buffered while writes fail
+ANSWER_EVENT_MAX_BUFFERED = 1000
+
+# version of the encoding of the events held in AnswerEventSegment
+ANSWER_EVENT_FORMAT_VERSION = 1
+
+
+class AnswerEvent(object):
+  """A submission of answers to an assessment."""
+
+  def __init__(self, email, assessment_type, score, answer, token=None,
+               submitted=None):
+    self.email = email
+    self.assessment_type = assessment_type
+    self.score = score
+    self.answer = answer
+    self.token = token
+    if submitted is None:
+      submitted = time.time()
+    self.submitted = submitted
+
+  def to_dict(self):
+    return {'email': self.email, 'assessment_type': self.assessment_type,
+            'score': self.score, 'answer': self.answer, 'token': self.token,
+            'submitted': self.submitted}
+
+  @classmethod
+  def from_dict(cls, value):
+    return AnswerEvent(
+        value['email'], value['assessment_type'], value['score'],
+        value['answer'], value.get('token'), value['submitted'])
+
+
+def encode_answer_events(events):
+  """Encodes events into JSON lines in a versioned, compressed string."""
+  return chr(ANSWER_EVENT_FORMAT_VERSION) + zlib.compress('\n'.join([
+      json.dumps(event.to_dict(), separators=(',', ':'), sort_keys=True)
+      for event in events]))
+
+
+def decode_answer_events(data):
+  """Decodes a value made by encode_answer_events()."""
+  if ord(data[0]) != ANSWER_EVENT_FORMAT_VERSION:
+    raise Exception('Unknown answer event format version %s.' % ord(data[0]))
+  return [AnswerEvent.from_dict(json.loads(line))
+          for line in zlib.decompress(data[1:]).split('\n')]
+
+
+class AnswerEventSegment(db.Model):
+  """A batch of AnswerEvents written together; never changed once written.
+
+  The key name is the time the segment was written, in milliseconds, and a
+  random suffix, so that segments sort in the order they were written."""
+  data = db.BlobProperty()
+  count = db.IntegerProperty(indexed=False)
+
+  @classmethod
+  def make_key_name(cls, now):
+    return '%015d-%s' % (int(now * 1000), os.urandom(4).encode('hex'))
+
+
+class AnswerEventLog(object):
+  """Buffers AnswerEvents of all courses in memory of the instance."""
+
+  # namespace -> list of AnswerEvents not yet written by this instance
+  _buffers = {}
+  _buffers_lock = threading.Lock()
+
+  @classmethod
+  def record(cls, event):
+    """Adds an event to the log of the course of the current namespace."""
+    namespace = namespace_manager.get_namespace()
+    with AnswerEventLog._buffers_lock:
+      events = AnswerEventLog._buffers.setdefault(namespace, [])
+      events.append(event)
+      if (len(events) < ANSWER_EVENT_BATCH_SIZE and
+          time.time() - events[0].submitted < ANSWER_EVENT_FLUSH_SECS):
+        return
+      del AnswerEventLog._buffers[namespace]
+    AnswerEventLog.write(namespace, events)
+
+  @classmethod
+  def flush(cls):
+    """Writes all buffered events of all courses; returns how many."""
+    with AnswerEventLog._buffers_lock:
+      buffers = AnswerEventLog._buffers.items()
+      AnswerEventLog._buffers.clear()
+    written = 0
+    for namespace, events in buffers:
+      if AnswerEventLog.write(namespace, events):
+        written += len(events)
+    return written
+
+  @classmethod
+  def write(cls, namespace, events):
+    """Writes events in one segment; buffers them again if that fails.
+
+    Returns True if the events were written. Events buffered again are
+    written with the next segment; if more than ANSWER_EVENT_MAX_BUFFERED
+    events of the course are then buffered, the oldest ones are dropped."""
+    key = db.Key.from_path(
+        'AnswerEventSegment', AnswerEventSegment.make_key_name(time.time()),
+        namespace=namespace)
+    try:
+      AnswerEventSegment(key=key, count=len(events),
+                         data=db.Blob(encode_answer_events(events))).put()
+      return True
+    except db.Error:
+      logging.exception('Failed to write %s answer events.', len(events))
+
+    with AnswerEventLog._buffers_lock:
+      buffered = AnswerEventLog._buffers.setdefault(namespace, [])
+      buffered[0:0] = events
+      dropped = buffered[0:max(0, len(buffered) - ANSWER_EVENT_MAX_BUFFERED)]
+      del buffered[0:len(dropped)]
+    for event in dropped:
+      logging.error('Dropped answer event: %s', json.dumps(event.to_dict()))
+    return False
+
+  @classmethod
+  def clear(cls):
+    with AnswerEventLog._buffers_lock:
+      AnswerEventLog._buffers.clear()
+
+
+def read_answer_events(since=None, batch_size=20):
+  """Reads the written events of the current namespace in order.
+
+  The segments are read in batches, and the events are yielded one by one.
+
+  Args:
+    since: a time in seconds; only the segments written since then are read
+    batch_size: the number of segments to read in one batch
+  """
+  query = AnswerEventSegment.all().order('__key__')
+  if since:
+    query.filter('__key__ >=', db.Key.from_path(
+        'AnswerEventSegment', '%015d' % int(since * 1000)))
+  for segment in query.run(batch_size=batch_size):
+    for event in decode_answer_events(segment.data):
+      yield event
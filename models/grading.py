@@ -0,0 +1,330 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Grades assessment answers on the server.
+
+Assessments are defined in the 'assets/js/assessment-*.js' files of a course.
+Each file is read with the JavaScript to Python conversion of tools/verify.py
+and compiled once into an AnswerKey: choice indexes, lowercase strings,
+compiled regular expressions and numeric ranges. The answer keys of a course
+are kept in memory of the instance until any of the files changes.
+
+Questions are graded just like activity-generic.js checks them in the browser,
+so the server and the 'Check your Answers' button agree.
+"""
+
+import json, logging, os, re, threading
+from tools import verify
+
+
+# the largest difference between a numeric answer and the correct one that is
+# still correct; the same as EPSILON in activity-generic.js
+NUMERIC_TOLERANCE = 0.001
+
+# flags of JavaScript regular expressions that matter for RegExp.test()
+JS_REGEX_FLAGS = {'i': re.IGNORECASE, 'm': re.MULTILINE}
+
+# the longest prefix of a text that JavaScript parseFloat() reads
+FLOAT_PREFIX = re.compile(r'\s*([+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)')
+
+# assessment file name pattern
+ASSESSMENT_FILE = re.compile(r'^assessment-.*\.js$')
+
+# form fields posted with the answers that are not responses to questions;
+# earlier versions stored them with the answers as JSON text
+ANSWER_METADATA_FIELDS = ['assessment_type', 'num_correct', 'num_questions',
+                          'score', 'submission_token']
+
+# FIXME: Course creators can edit the default weights of the assessments in
+#        the overall score and the overall score needed to pass the course, or
+#        set them for one course in its 'data/grading.json' file
+OVERALL_SCORE_WEIGHTS = [('midcourse', 0.30), ('postcourse', 0.70)]
+PASSING_SCORE = 70
+
+# name of the file in the data folder of a course with its GradingPolicy
+GRADING_POLICY_FILE = 'grading.json'
+
+
+class GradingPolicy(object):
+  """Weights of assessments in the overall score and the passing score.
+
+  A course can set its own policy in 'data/grading.json', for example:
+
+    {"weights": {"midcourse": 0.25, "postcourse": 0.75}, "passing_score": 60}
+  """
+
+  # data folder -> (file signature, GradingPolicy) of this instance
+  _instance_cache = {}
+  _instance_cache_lock = threading.Lock()
+
+  def __init__(self, weights=None, passing_score=PASSING_SCORE):
+    if weights is None:
+      weights = OVERALL_SCORE_WEIGHTS
+    elif isinstance(weights, dict):
+      weights = sorted(weights.items())
+    self.weights = [(str(name), float(weight)) for name, weight in weights]
+    self.passing_score = passing_score
+
+  def get_overall_score(self, scores):
+    """Computes the overall score from a dict of assessment scores."""
+    overall_score = 0
+    for name, weight in self.weights:
+      overall_score += weight * int(scores.get(name) or 0)
+    return int(overall_score)
+
+  def is_passing(self, overall_score):
+    return overall_score >= self.passing_score
+
+  @classmethod
+  def load(cls, data_home):
+    """Reads the policy of a course; the default one if it has none."""
+    fname = os.path.join(data_home, GRADING_POLICY_FILE)
+    if not os.path.exists(fname):
+      return GradingPolicy()
+    policy = json.loads(open(fname).read())
+    return GradingPolicy(
+        policy.get('weights'), policy.get('passing_score', PASSING_SCORE))
+
+  @classmethod
+  def get(cls, data_home):
+    """Returns the policy of a course; rereads it if its file changes."""
+    fname = os.path.join(data_home, GRADING_POLICY_FILE)
+    version = None
+    if os.path.exists(fname):
+      stat = os.stat(fname)
+      version = (stat.st_mtime, stat.st_size)
+
+    cached = GradingPolicy._instance_cache.get(data_home)
+    if cached and cached[0] == version:
+      return cached[1]
+
+    policy = GradingPolicy.load(data_home)
+    with GradingPolicy._instance_cache_lock:
+      GradingPolicy._instance_cache[data_home] = (version, policy)
+    return policy
+
+
+def get_responses(answer):
+  """Returns the [question index, response] pairs of a stored answer.
+
+  Earlier versions stored json.dumps() of all posted form fields, including
+  the assessment type and the score computed in the browser; such answers are
+  decoded and their metadata fields are dropped."""
+  if isinstance(answer, basestring):
+    answer = json.loads(answer)
+  if isinstance(answer, dict):
+    answer = answer.items()
+  return [[name, value] for name, value in answer
+          if not name in ANSWER_METADATA_FIELDS]
+
+
+def is_legacy_answer(answer):
+  """Checks if an answer holds results, not responses, of the questions.
+
+  Earlier versions of activity-generic.js graded assessments in the browser
+  and posted 'true' or 'false' for each question instead of the responses;
+  such answers can't be graded again."""
+  answer = get_responses(answer)
+  if not answer:
+    return False
+  for name, value in answer:
+    if not value in ['true', 'false']:
+      return False
+  return True
+
+
+def compile_js_regex(literal):
+  """Compiles a JavaScript regular expression literal, i.e. '/abc/i'."""
+  end = literal.rindex('/')
+  flags = 0
+  for flag in literal[end + 1:]:
+    flags |= JS_REGEX_FLAGS.get(flag, 0)
+  return re.compile(literal[1:end], flags)
+
+
+def parse_float(text):
+  """Parses a number like JavaScript parseFloat(); returns None if none."""
+  match = FLOAT_PREFIX.match(text)
+  if not match:
+    return None
+  return float(match.group(1))
+
+
+def make_choice_check(index):
+  if index is None:
+    return lambda response: False
+  index = str(index)
+  return lambda response: response == index
+
+
+def make_string_check(correct):
+  correct = correct.lower()
+  return lambda response: response.strip().lower() == correct
+
+
+def make_regex_check(literal):
+  search = compile_js_regex(literal).search
+  return lambda response: search(response.strip()) is not None
+
+
+def make_numeric_check(correct):
+  low = correct - NUMERIC_TOLERANCE
+  high = correct + NUMERIC_TOLERANCE
+  def check(response):
+    number = parse_float(response)
+    return number is not None and low <= number <= high
+  return check
+
+
+class AnswerKey(object):
+  """Compiled correct answers of one assessment."""
+
+  def __init__(self, name, checks):
+    self.name = name
+    self.checks = checks
+
+  @classmethod
+  def compile(cls, assessment):
+    """Compiles an assessment evaluated in verify.MakeDataScope()."""
+    checks = []
+    for question in assessment['questionsList']:
+      if 'choices' in question:
+        correct = None
+        for i in range(0, len(question['choices'])):
+          if isinstance(question['choices'][i], dict):
+            correct = i
+        checks.append(make_choice_check(correct))
+      elif 'correctAnswerString' in question:
+        checks.append(make_string_check(question['correctAnswerString']))
+      elif 'correctAnswerRegex' in question:
+        checks.append(make_regex_check(
+            question['correctAnswerRegex']['regex']))
+      elif 'correctAnswerNumeric' in question:
+        checks.append(make_numeric_check(
+            float(question['correctAnswerNumeric'])))
+      else:
+        raise Exception('Invalid question type in %s: %s' % (
+            assessment['assessmentName'], question))
+    return AnswerKey(assessment['assessmentName'], checks)
+
+  @classmethod
+  def from_answers(cls, name, answers):
+    """Compiles the correct answers listed in a course bundle.
+
+    Args:
+      name: the name of the assessment
+      answers: a dict per question made by ExtractAnswerKey() of
+          tools/export.py, i.e. {'choice': 2} or {'regex': '/sun/i'}
+    """
+    checks = []
+    for answer in answers:
+      if 'choice' in answer:
+        checks.append(make_choice_check(answer['choice']))
+      elif 'string' in answer:
+        checks.append(make_string_check(answer['string']))
+      elif 'regex' in answer:
+        checks.append(make_regex_check(answer['regex']))
+      elif 'numeric' in answer:
+        checks.append(make_numeric_check(float(answer['numeric'])))
+      else:
+        raise Exception('Invalid answer in %s: %s' % (name, answer))
+    return AnswerKey(name, checks)
+
+  def grade(self, answer):
+    """Returns the number of correct responses.
+
+    Args:
+      answer: a list of [question index, response] pairs, as it is stored in
+          StudentAnswer, or a dict of question index to response
+    """
+    if not isinstance(answer, dict):
+      answer = dict(answer)
+    num_correct = 0
+    for i in range(0, len(self.checks)):
+      response = answer.get(str(i))
+      if response is not None and self.checks[i](response):
+        num_correct += 1
+    return num_correct
+
+  def score(self, answer):
+    """Returns the score in percent, rounded just like the browser did."""
+    if not self.checks:
+      return 0
+    return int(round(100.0 * self.grade(answer) / len(self.checks)))
+
+
+def load_answer_keys(folder):
+  """Compiles answer keys of all assessment files in a folder by name."""
+  answer_keys = {}
+  for fname in sorted(os.listdir(folder)):
+    if not ASSESSMENT_FILE.match(fname):
+      continue
+    scope = verify.EvaluateJavaScriptExpressionFromFile(
+        os.path.join(folder, fname), 'assessment',
+        verify.MakeDataScope('assessment'), logging.error)
+    if scope:
+      answer_key = AnswerKey.compile(scope['assessment'])
+      answer_keys[answer_key.name] = answer_key
+  return answer_keys
+
+
+class AnswerKeys(object):
+  """Keeps compiled answer keys of all courses in memory of the instance."""
+
+  # folder or content hash -> (version, dict of name -> AnswerKey)
+  _instance_cache = {}
+  _instance_cache_lock = threading.Lock()
+
+  @classmethod
+  def _get_cached(cls, key, version, load):
+    cached = AnswerKeys._instance_cache.get(key)
+    if cached and cached[0] == version:
+      return cached[1]
+
+    answer_keys = load()
+    with AnswerKeys._instance_cache_lock:
+      AnswerKeys._instance_cache[key] = (version, answer_keys)
+    return answer_keys
+
+  @classmethod
+  def get_from_folder(cls, folder):
+    """Returns answer keys of assessment files; recompiles if files change."""
+    version = []
+    for fname in sorted(os.listdir(folder)):
+      if ASSESSMENT_FILE.match(fname):
+        stat = os.stat(os.path.join(folder, fname))
+        version += [fname, stat.st_mtime, stat.st_size]
+    return AnswerKeys._get_cached(
+        folder, version, lambda: load_answer_keys(folder))
+
+  @classmethod
+  def get_from_index(cls, index):
+    """Returns answer keys of a CourseIndex made of a bundle.
+
+    The answer keys are compiled from the correct answers the bundle lists."""
+    def load():
+      answer_keys = {}
+      for key, answers in index.answer_keys.items():
+        answer_key = AnswerKey.from_answers(
+            index.assessments[key]['assessmentName'], answers)
+        answer_keys[answer_key.name] = answer_key
+      return answer_keys
+    return AnswerKeys._get_cached(
+        index.content_hash, index.content_hash, load)
+
+  @classmethod
+  def clear(cls):
+    with AnswerKeys._instance_cache_lock:
+      AnswerKeys._instance_cache.clear()
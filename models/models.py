@@ -15,9 +15,10 @@
 # @author: psimakov@google.com (Pavel Simakov)
 
 
-import os
+import json, os, random, zlib
 from google.appengine.ext import db
 from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
 
 
 # determine if we run in production environment
@@ -27,9 +28,57 @@ PRODUCTION_MODE = not os.environ.get(
 # set the default amount of time to cache the items for in memcache
 DEFAULT_CACHE_TTL_SECS = 60 * 60
 
+# set the amount of time to cache the absence of an item for in memcache
+NEGATIVE_CACHE_TTL_SECS = 60
+
+# set the amount of time to cache the total of the enrollment counter for; a
+# total recomputed while an enrollment commits may count it twice, so it is
+# recomputed from the shards this often
+ENROLLMENT_COUNT_TTL_SECS = 60
+
 # enable memcache caching, but only if we run in the production mode
 IS_CACHE_ENABLED = PRODUCTION_MODE
 
+# a value cached in place of an item that does not exist
+NO_OBJECT = '__gcb_no_object__'
+
+# version of the wire format used for entities stored in memcache; bump it
+# every time the encoding changes so that old values are treated as a miss
+ENTITY_CACHE_FORMAT_VERSION = 1
+
+
+def encode_entity(entity):
+  """Encodes an entity into a compact, versioned value for memcache."""
+  return (ENTITY_CACHE_FORMAT_VERSION,
+          db.model_to_protobuf(entity).Encode())
+
+
+# version of the encoding of the answers held in StudentAnswer
+ANSWER_FORMAT_VERSION = 1
+
+
+def encode_answer(answer):
+  """Encodes answers into a compact, versioned, compressed string."""
+  return chr(ANSWER_FORMAT_VERSION) + zlib.compress(
+      json.dumps(answer, separators=(',', ':')))
+
+
+def decode_answer(data):
+  """Decodes a value made by encode_answer()."""
+  if ord(data[0]) != ANSWER_FORMAT_VERSION:
+    raise Exception('Unknown answer format version %s.' % ord(data[0]))
+  return json.loads(zlib.decompress(data[1:]))
+
+
+def decode_entity(value):
+  """Decodes a value made by encode_entity(); returns None if unusable."""
+  if not isinstance(value, tuple) or len(value) != 2:
+    return None
+  version, data = value
+  if version != ENTITY_CACHE_FORMAT_VERSION:
+    return None
+  return db.model_from_protobuf(entity_pb.EntityProto(data))
+
 
 class MemcacheManager(object):
   """Class that consolidates all our memcache operations."""
@@ -47,10 +96,21 @@ class MemcacheManager(object):
       return None
 
   @classmethod
-  def set(cls, key, value):
+  def set(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS):
     """Sets an item in memcache if memcache is enabled."""
     if MemcacheManager.enabled():
-      memcache.set(key, value, DEFAULT_CACHE_TTL_SECS)
+      memcache.set(key, value, ttl)
+
+  @classmethod
+  def set_multi(cls, mapping, ttl=DEFAULT_CACHE_TTL_SECS):
+    """Sets many items in memcache in one call if memcache is enabled."""
+    if MemcacheManager.enabled():
+      memcache.set_multi(mapping, ttl)
+
+  @classmethod
+  def set_missing(cls, key):
+    """Records in memcache, for a short time, that an item does not exist."""
+    MemcacheManager.set(key, NO_OBJECT, NEGATIVE_CACHE_TTL_SECS)
 
   @classmethod
   def delete(cls, key):
@@ -58,6 +118,92 @@ class MemcacheManager(object):
     if MemcacheManager.enabled():
       memcache.delete(key)
 
+  @classmethod
+  def incr(cls, key, delta):
+    """Changes a cached integer by delta if it is present in memcache.
+
+    memcache.incr() only takes a non-negative delta, so a negative one is
+    applied with memcache.decr(), which stops at zero."""
+    if MemcacheManager.enabled():
+      if delta < 0:
+        memcache.decr(key, -delta)
+      else:
+        memcache.incr(key, delta)
+
+
+class StudentEnrollment(object):
+  """A compact enrollment record of a Student; cached apart from the Student.
+
+  The hot path of serving course pages only needs to know whether the current
+  user is enrolled, so it uses this record instead of the full Student, which
+  carries the ever growing 'answers' and 'scores'."""
+
+  def __init__(self, email, is_enrolled, name, enrolled_date):
+    self.email = email
+    self.is_enrolled = is_enrolled
+    self.name = name
+    self.enrolled_date = enrolled_date
+
+  @classmethod
+  def cache_key(cls, email):
+    return 'enrollment:%s' % email
+
+  @classmethod
+  def from_student(cls, student):
+    return StudentEnrollment(
+        student.key().name(), student.is_enrolled, student.name,
+        student.enrolled_date)
+
+  def encode(self):
+    return (ENTITY_CACHE_FORMAT_VERSION,
+            self.is_enrolled, self.name, self.enrolled_date)
+
+  @classmethod
+  def decode(cls, email, value):
+    """Decodes a value made by encode(); returns None if unusable."""
+    if not isinstance(value, tuple) or len(value) != 4:
+      return None
+    if value[0] != ENTITY_CACHE_FORMAT_VERSION:
+      return None
+    return StudentEnrollment(email, value[1], value[2], value[3])
+
+
+class StudentScore(db.Model):
+  """A score of a Student in one assessment; a child entity of the Student.
+
+  The key name is the name of the assessment. Scores are indexed, so one can
+  query them, i.e. find all students who scored below 70 in 'midcourse':
+
+    StudentScore.all().filter('assessment_type =', 'midcourse').filter(
+        'score <', 70)
+
+  and take the parent() of each key."""
+  assessment_type = db.StringProperty()
+  score = db.IntegerProperty()
+
+
+class StudentAnswer(db.Model):
+  """Answers of a Student to one assessment; a child entity of the Student.
+
+  The key name is the name of the assessment. The answers are held apart from
+  the Student, so they are only read and written when really needed, and they
+  are compressed by encode_answer(); use the 'answer' attribute to access them,
+  they are decoded on first access. The token is the idempotency token of the
+  submission the answers came from."""
+  data = db.BlobProperty()
+  token = db.StringProperty(indexed=False)
+
+  def get_answer(self):
+    if not hasattr(self, '_answer'):
+      self._answer = decode_answer(self.data)
+    return self._answer
+
+  def set_answer(self, answer):
+    self._answer = answer
+    self.data = db.Blob(encode_answer(answer))
+
+  answer = property(get_answer, set_answer)
+
 
 class Student(db.Model):
   """Student profile."""
@@ -66,35 +212,275 @@ class Student(db.Model):
   name = db.StringProperty()
   is_enrolled = db.BooleanProperty()
 
-  # each of the following is a string representation of a JSON dict
+  # LEGACY: each of the following is a string representation of a JSON dict;
+  # the scores and the answers are now held by StudentScore and StudentAnswer
+  # child entities, these are moved into them on the next put()
   answers = db.TextProperty()
   scores = db.TextProperty()
 
+  def get_json_dict(self, name):
+    """Returns the dict held in JSON text property 'name'; parses it once."""
+    if not hasattr(self, '_json_dicts'):
+      self._json_dicts = {}
+    text = getattr(self, name)
+    entry = self._json_dicts.get(name)
+    if entry is None or entry[0] is not text:
+      if text:
+        value = json.loads(text)
+      else:
+        value = {}
+      entry = (text, value)
+      self._json_dicts[name] = entry
+    return entry[1]
+
+  def get_scores(self):
+    """Returns a dict of all scores of the student; loads them only once."""
+    if getattr(self, '_scores', None) is None:
+      scores = dict(self.get_json_dict('scores'))
+      if self.is_saved():
+        for score in StudentScore.all().ancestor(self):
+          scores[score.key().name()] = score.score
+      self._scores = scores
+      self._changed_scores = set()
+    return self._scores
+
+  def set_score(self, assessment_name, score):
+    """Sets a score; the caller must call put() to commit."""
+    self.get_scores()[assessment_name] = score
+    self._changed_scores.add(assessment_name)
+
+  def get_answer(self, assessment_name):
+    """Returns the answers to an assessment; loads them only once."""
+    answers = self._get_answers()
+    if not assessment_name in answers:
+      self._set_loaded_answer(assessment_name, StudentAnswer.get_by_key_name(
+          assessment_name, parent=self))
+    return answers[assessment_name]
+
+  def get_answer_token(self, assessment_name):
+    """Returns the idempotency token of the stored answers to an assessment."""
+    self.get_answer(assessment_name)
+    return self._answer_tokens.get(assessment_name)
+
+  def set_answer(self, assessment_name, answer, token=None):
+    """Sets the answers to an assessment; the caller must call put()."""
+    self._get_answers()[assessment_name] = answer
+    self._answer_tokens[assessment_name] = token
+    self._changed_answers.add(assessment_name)
+
+  def _get_answers(self):
+    if getattr(self, '_answers', None) is None:
+      self._answers = {}
+      self._answer_tokens = {}
+      self._changed_answers = set()
+    return self._answers
+
+  def _set_loaded_answer(self, assessment_name, entity):
+    """Keeps the answers read from a StudentAnswer entity, or legacy ones."""
+    answers = self._get_answers()
+    if entity:
+      answers[assessment_name] = entity.answer
+      self._answer_tokens[assessment_name] = entity.token
+    else:
+      answers[assessment_name] = self.get_json_dict('answers').get(
+          assessment_name)
+
+  def migrate(self):
+    """Moves legacy JSON scores and answers into the child entities."""
+    scores = self.get_scores()
+    for name in self.get_json_dict('scores').keys():
+      self.set_score(name, scores[name])
+
+    # the legacy answers are always written together with any child entity
+    answers = self._get_answers()
+    for name, value in self.get_json_dict('answers').items():
+      if not name in answers:
+        answers[name] = value
+      self._changed_answers.add(name)
+
+    self.scores = None
+    self.answers = None
+
+  def get_entities_to_put(self, include_self=True):
+    """Returns this Student and all of its changed child entities.
+
+    If include_self is False, the Student is only included if its legacy
+    scores and answers have just been migrated."""
+    if (getattr(self, '_changed_scores', None) or
+        getattr(self, '_changed_answers', None)) and (
+            self.scores or self.answers):
+      self.migrate()
+      include_self = True
+
+    entities = []
+    if include_self:
+      entities.append(self)
+    if getattr(self, '_changed_scores', None):
+      for name in self._changed_scores:
+        entities.append(StudentScore(
+            parent=self, key_name=name, assessment_type=name,
+            score=self._scores[name]))
+      self._changed_scores = set()
+    if getattr(self, '_changed_answers', None):
+      for name in self._changed_answers:
+        entity = StudentAnswer(parent=self, key_name=name,
+                               token=self._answer_tokens.get(name))
+        entity.answer = self._answers[name]
+        entities.append(entity)
+      self._changed_answers = set()
+    return entities
+
   def put(self):
-    """Do the normal put() and also add the object to memcache."""
-    super(Student, self).put()
-    MemcacheManager.set(self.key().name(), self)
+    """Do the normal put() and also add the object to memcache.
+
+    The Student and all of its changed scores and answers are written in one
+    batch. This also replaces any negative cache entries for the student, so
+    the registration of a new student is visible right away."""
+    db.put(self.get_entities_to_put())
+    self.cached()
+    return self.key()
+
+  def put_changes(self):
+    """Writes only the changed scores and answers, in one batch.
+
+    The Student itself is written, and cached, only if it was migrated."""
+    entities = self.get_entities_to_put(include_self=False)
+    if entities:
+      db.put(entities)
+    if entities and entities[0] is self:
+      self.cached()
+
+  def cached(self):
+    """Adds the object to memcache after it was written to the datastore."""
+    MemcacheManager.set(self.key().name(), encode_entity(self))
+    MemcacheManager.set(
+        StudentEnrollment.cache_key(self.key().name()),
+        StudentEnrollment.from_student(self).encode())
 
   def delete(self):
-    """Do the normal delete() and also remove the object from memcache."""
-    super(Student, self).delete()
+    """Delete the student with all scores and answers; remove from memcache."""
+    db.delete(db.Query(keys_only=True).ancestor(self))
     MemcacheManager.delete(self.key().name())
+    MemcacheManager.delete(StudentEnrollment.cache_key(self.key().name()))
 
   @classmethod
   def get_by_email(cls, email):
     return Student.get_by_key_name(email.encode('utf8'))
 
+  @classmethod
+  def get_with_answer(cls, email, assessment_name):
+    """Reads a Student and its answers to an assessment in one batch get."""
+    key = db.Key.from_path('Student', email.encode('utf8'))
+    student, answer = db.get([key, db.Key.from_path(
+        'StudentAnswer', assessment_name, parent=key)])
+    if student:
+      student._set_loaded_answer(assessment_name, answer)
+    return student
+
   @classmethod
   def get_enrolled_student_by_email(cls, email):
-    student = MemcacheManager.get(email)
+    value = MemcacheManager.get(email)
+    if value == NO_OBJECT:
+      return None
+    student = decode_entity(value)
     if not student:
       student = Student.get_by_email(email)
-      MemcacheManager.set(email, student)
+      if student:
+        MemcacheManager.set(email, encode_entity(student))
+      else:
+        MemcacheManager.set_missing(email)
     if student and student.is_enrolled:
       return student
     else:
       return None
 
+  @classmethod
+  def get_enrollment_by_email(cls, email):
+    """Returns StudentEnrollment of an enrolled student, None otherwise."""
+    key = StudentEnrollment.cache_key(email)
+    value = MemcacheManager.get(key)
+    if value == NO_OBJECT:
+      return None
+    enrollment = StudentEnrollment.decode(email, value)
+    if not enrollment:
+      student = Student.get_by_email(email)
+      if student:
+        enrollment = StudentEnrollment.from_student(student)
+        MemcacheManager.set(key, enrollment.encode())
+      else:
+        MemcacheManager.set_missing(key)
+    if enrollment and enrollment.is_enrolled:
+      return enrollment
+    else:
+      return None
+
+
+class EnrollmentCounterShard(db.Model):
+  """One shard of the counter of enrolled students in a course namespace."""
+  count = db.IntegerProperty(default=0)
+
+
+class EnrollmentCounter(object):
+  """A sharded counter of enrolled students with a total cached in memcache."""
+
+  # the number of shards to spread concurrent enrollments over
+  NUM_SHARDS = 20
+
+  CACHE_KEY = 'enrollment_counter_total'
+
+  @classmethod
+  def shard_key_name(cls, index):
+    return 'shard%s' % index
+
+  @classmethod
+  def get_count(cls):
+    """Returns the number of enrolled students."""
+    total = MemcacheManager.get(EnrollmentCounter.CACHE_KEY)
+    if total is None:
+      total = 0
+      for shard in EnrollmentCounterShard.all():
+        total += shard.count
+      MemcacheManager.set(
+          EnrollmentCounter.CACHE_KEY, total, ENROLLMENT_COUNT_TTL_SECS)
+    return total
+
+  @classmethod
+  def change_in_transaction(cls, delta):
+    """Changes the count by delta; must be called inside of a transaction.
+
+    The caller must call changed(delta) after the transaction commits."""
+    key_name = EnrollmentCounter.shard_key_name(
+        random.randint(0, EnrollmentCounter.NUM_SHARDS - 1))
+    shard = EnrollmentCounterShard.get_by_key_name(key_name)
+    if not shard:
+      shard = EnrollmentCounterShard(key_name=key_name)
+    shard.count += delta
+    shard.put()
+
+  @classmethod
+  def changed(cls, delta):
+    """Applies a committed change of the count to the cached total.
+
+    memcache.incr() keeps the expiration time of the total, so a total that
+    was recomputed after the commit, and so counts this change twice, is
+    recomputed within ENROLLMENT_COUNT_TTL_SECS."""
+    if delta:
+      MemcacheManager.incr(EnrollmentCounter.CACHE_KEY, delta)
+
+  @classmethod
+  def reset(cls, total):
+    """Sets the count to a given total, i.e. a real count of students."""
+    shards = []
+    for index in range(0, EnrollmentCounter.NUM_SHARDS):
+      count = 0
+      if index == 0:
+        count = total
+      shards.append(EnrollmentCounterShard(
+          key_name=EnrollmentCounter.shard_key_name(index), count=count))
+    db.put(shards)
+    MemcacheManager.set(
+        EnrollmentCounter.CACHE_KEY, total, ENROLLMENT_COUNT_TTL_SECS)
+
 
 class Unit(db.Model):
   """Unit metadata."""
@@ -105,22 +491,6 @@ class Unit(db.Model):
   release_date = db.StringProperty()
   now_available = db.BooleanProperty()
 
-  @classmethod
-  def get_units(cls):
-    units = MemcacheManager.get('units')
-    if units is None:
-      units = Unit.all().order('id')
-      MemcacheManager.set('units', units)
-    return units
-
-  @classmethod
-  def get_lessons(cls, unit_id):
-    lessons = MemcacheManager.get('lessons' + str(unit_id))
-    if lessons is None:
-      lessons = Lesson.all().filter('unit_id =', unit_id).order('id')
-      MemcacheManager.set('lessons' + str(unit_id), lessons)
-    return lessons
-
 
 class Lesson(db.Model):
   """Lesson metadata."""
@@ -134,3 +504,32 @@ class Lesson(db.Model):
   duration = db.StringProperty()
   activity = db.StringProperty()
   activity_title = db.StringProperty()
+
+
+class LessonSummary(object):
+  """The fields of a Lesson that navigation needs; never stored.
+
+  Unit and activity pages list all lessons of the unit, but render the heavy
+  'objectives', 'notes', 'slides' and 'video' of the current lesson only. The
+  CourseIndex therefore holds lessons in this form and loads the full Lesson
+  of the current page on demand."""
+
+  FIELDS = ['unit_id', 'id', 'title', 'activity', 'activity_title']
+
+  def __init__(self, unit_id, id, title, activity, activity_title):
+    self.unit_id = unit_id
+    self.id = id
+    self.title = title
+    self.activity = activity
+    self.activity_title = activity_title
+
+  @classmethod
+  def from_lesson(cls, lesson):
+    return LessonSummary(*[getattr(lesson, name) for name in cls.FIELDS])
+
+  def encode(self):
+    return tuple([getattr(self, name) for name in LessonSummary.FIELDS])
+
+  @classmethod
+  def decode(cls, value):
+    return LessonSummary(*value)
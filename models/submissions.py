@@ -0,0 +1,144 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Queues graded assessment submissions to be stored later, in batches.
+
+In production the submissions are tasks of the 'submissions' pull queue
+declared in queue.yaml; the tasks of each course are tagged with its
+namespace. In development and tests the submissions are kept in memory of the
+instance instead. Either queue leases submissions for a while: the ones that
+are not deleted before the lease expires are leased again.
+"""
+
+import json, threading, time
+from models.models import PRODUCTION_MODE
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
+
+
+# name of the pull queue in queue.yaml
+SUBMISSION_QUEUE_NAME = 'submissions'
+
+# the time a leased submission is hidden from other workers
+SUBMISSION_LEASE_SECS = 60
+
+# use the App Engine pull queue, but only if we run in the production mode
+IS_TASK_QUEUE_ENABLED = PRODUCTION_MODE
+
+
+class Submission(object):
+  """A graded assessment submission of a student."""
+
+  def __init__(self, email, assessment_type, score, answer, token=None,
+               submitted=None):
+    self.email = email
+    self.assessment_type = assessment_type
+    self.score = score
+    self.answer = answer
+    self.token = token
+    if submitted is None:
+      submitted = time.time()
+    self.submitted = submitted
+
+  def encode(self):
+    return json.dumps([
+        self.email, self.assessment_type, self.score, self.answer,
+        self.token, self.submitted], separators=(',', ':'))
+
+  @classmethod
+  def decode(cls, payload):
+    return Submission(*json.loads(payload))
+
+
+def get_course_tag():
+  """Tags the submissions of the course of the current namespace."""
+  return 'course:%s' % (namespace_manager.get_namespace() or '')
+
+
+class TaskSubmissionQueue(object):
+  """Keeps the submissions of a course in the App Engine pull queue."""
+
+  def __init__(self, tag):
+    self.tag = tag
+    self.queue = taskqueue.Queue(SUBMISSION_QUEUE_NAME)
+
+  def add(self, submission):
+    self.queue.add(taskqueue.Task(
+        payload=submission.encode(), method='PULL', tag=self.tag))
+
+  def lease(self, max_count):
+    """Returns a list of up to max_count (handle, Submission) pairs."""
+    tasks = self.queue.lease_tasks_by_tag(
+        SUBMISSION_LEASE_SECS, max_count, tag=self.tag)
+    return [(task, Submission.decode(task.payload)) for task in tasks]
+
+  def delete(self, handles):
+    if handles:
+      self.queue.delete_tasks(handles)
+
+
+class LocalSubmissionQueue(object):
+  """Keeps the submissions of a course in memory; for development and tests.
+
+  The submissions are lost when the instance stops, so this queue is not
+  durable."""
+
+  # tag -> list of [lease expiry time, id, payload] of this instance
+  _items = {}
+  _items_lock = threading.Lock()
+  _next_id = [0]
+
+  def __init__(self, tag):
+    self.tag = tag
+
+  def add(self, submission):
+    with LocalSubmissionQueue._items_lock:
+      LocalSubmissionQueue._next_id[0] += 1
+      LocalSubmissionQueue._items.setdefault(self.tag, []).append(
+          [0, LocalSubmissionQueue._next_id[0], submission.encode()])
+
+  def lease(self, max_count):
+    """Returns a list of up to max_count (handle, Submission) pairs."""
+    now = time.time()
+    leased = []
+    with LocalSubmissionQueue._items_lock:
+      for item in LocalSubmissionQueue._items.get(self.tag, []):
+        if len(leased) >= max_count:
+          break
+        if item[0] <= now:
+          item[0] = now + SUBMISSION_LEASE_SECS
+          leased.append((item[1], Submission.decode(item[2])))
+    return leased
+
+  def delete(self, handles):
+    handles = set(handles)
+    with LocalSubmissionQueue._items_lock:
+      items = LocalSubmissionQueue._items.get(self.tag, [])
+      items[:] = [item for item in items if not item[1] in handles]
+
+  def count(self):
+    return len(LocalSubmissionQueue._items.get(self.tag, []))
+
+  @classmethod
+  def clear(cls):
+    with LocalSubmissionQueue._items_lock:
+      LocalSubmissionQueue._items.clear()
+
+
+def get_submission_queue():
+  """Returns the submission queue of the course of the current namespace."""
+  if IS_TASK_QUEUE_ENABLED:
+    return TaskSubmissionQueue(get_course_tag())
+  return LocalSubmissionQueue(get_course_tag())
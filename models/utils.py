@@ -17,52 +17,34 @@
 
 """Helper functions to work with various models."""
 
-import json, logging
+# NB: the scores and the answers of a student are stored in StudentScore and
+#     StudentAnswer child entities; they are loaded only once, on first access,
+#     and only the changed ones are written back by student.put()
 
 # returns a dict where the key is the assessment/summary name,
 # and the value is the assessment/summary score (if available)
 def getAllScores(student):
-  if not student.scores:
-    return {}
-  else:
-    return json.loads(student.scores)
-
-def dictGet(dict_as_string, my_key):
-  if not dict_as_string:
-    return None
-  else:
-    return json.loads(dict_as_string).get(my_key)
+  return student.get_scores()
 
 
 # returns the answer array corresponding to the given assessment, or None if
 # not found
 def getAnswer(student, assessment_name):
-  return dictGet(student.answers, assessment_name)
+  return student.get_answer(assessment_name)
 
 # (caller must call student.put() to commit)
 # NB: this does not do any type-checking on 'answer'; it just stores whatever
-#     is passed in.
-def setAnswer(student, assessment_name, answer):
-  if not student.answers:
-    score_dict = {}
-  else:
-    score_dict = json.loads(student.answers)
-  score_dict[assessment_name] = answer
-  student.answers = json.dumps(score_dict)
+#     is passed in, as long as it can be serialized to JSON.
+#     'token' is the idempotency token of the submission, if any.
+def setAnswer(student, assessment_name, answer, token=None):
+  student.set_answer(assessment_name, answer, token)
 
 # returns the score corresponding to the given assessment, or None if not found
 # (caller must cast appropriately)
 def getScore(student, assessment_name):
-  return dictGet(student.scores, assessment_name)
+  return student.get_scores().get(assessment_name)
 
 # (caller must call student.put() to commit)
-# NB: this does not do any type-checking on 'score'; it just stores whatever
-#     is passed in.
+# NB: scores are stored as integers, so 'score' must be an integer.
 def setScore(student, assessment_name, score):
-  if not student.scores:
-    score_dict = {}
-  else:
-    score_dict = json.loads(student.scores)
-  score_dict[assessment_name] = score
-  student.scores = json.dumps(score_dict)
-
+  student.set_score(assessment_name, score)
@@ -0,0 +1,493 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro benchmarks for Course Builder.
+
+Run from the root folder of the app: "python tests/benchmarks.py [name ...]".
+"""
+
+import logging
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+  sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests import suite
+
+
+# the number of times each benchmark body is executed
+DEFAULT_ITERATIONS = 1000
+
+
+def Measure(func, iterations=DEFAULT_ITERATIONS):
+  """Calls func() the given number of times; returns microseconds per call."""
+  start = time.time()
+  for _ in xrange(iterations):
+    func()
+  return (time.time() - start) * 1000000.0 / iterations
+
+
+def Report(name, **values):
+  print '%-40s %s' % (name, ', '.join(
+      ['%s=%s' % (key, values[key]) for key in sorted(values.keys())]))
+
+
+def MakeStudent(email, assessments):
+  """Creates a Student with the given number of stored assessments."""
+  from models.models import Student
+  from models.utils import setAnswer, setScore
+
+  student = Student(key_name=email, name='Test Student', is_enrolled=True)
+  for i in range(0, assessments):
+    name = 'assessment%s' % i
+    setAnswer(student, name, [[str(j), 'true'] for j in range(0, 20)])
+    setScore(student, name, i)
+  return student
+
+
+def BenchmarkStudentCacheEncoding():
+  """Compares pickling a Student for memcache with its compact encoding."""
+  import pickle
+  from models.models import encode_entity, decode_entity
+
+  for assessments in [0, 5, 50]:
+    student = MakeStudent('bench_%s@example.com' % assessments, assessments)
+    student.put()
+
+    pickled = pickle.dumps(student, pickle.HIGHEST_PROTOCOL)
+    Report('student_cache pickle (%s assessments)' % assessments,
+           bytes=len(pickled),
+           encode_us='%.1f' % Measure(
+               lambda: pickle.dumps(student, pickle.HIGHEST_PROTOCOL)),
+           decode_us='%.1f' % Measure(lambda: pickle.loads(pickled)))
+
+    encoded = encode_entity(student)
+    stored = pickle.dumps(encoded, pickle.HIGHEST_PROTOCOL)
+    Report('student_cache entity (%s assessments)' % assessments,
+           bytes=len(stored),
+           encode_us='%.1f' % Measure(lambda: pickle.dumps(
+               encode_entity(student), pickle.HIGHEST_PROTOCOL)),
+           decode_us='%.1f' % Measure(
+               lambda: decode_entity(pickle.loads(stored))))
+
+
+def BenchmarkAssessmentSubmission():
+  """Times storeAssessmentData() on students with many stored assessments."""
+  import json
+  from controllers.assessments import storeAssessmentData
+  from models.models import Student
+
+  def StoreWithReparsing(student, score, answer):
+    """Does what storeAssessmentData() did with scores in JSON text."""
+    def Get(text, key):
+      if text:
+        return json.loads(text).get(key)
+    def Set(student, name, key, value):
+      values = json.loads(getattr(student, name) or '{}')
+      values[key] = value
+      setattr(student, name, json.dumps(values))
+
+    Set(student, 'answers', 'postcourse', answer)
+    existing_score = Get(student.scores, 'postcourse')
+    if existing_score is None or score > int(existing_score):
+      Set(student, 'scores', 'postcourse', score)
+    midcourse_score = int(Get(student.scores, 'midcourse') or 0)
+    postcourse_score = int(Get(student.scores, 'postcourse'))
+    Set(student, 'scores', 'overall_score', int(
+        0.30 * midcourse_score + 0.70 * postcourse_score))
+
+  answer = [[str(j), 'true'] for j in range(0, 20)]
+  for assessments in [5, 50, 500]:
+    names = ['assessment%s' % i for i in range(0, assessments)]
+    answers = json.dumps(dict([(name, answer) for name in names]))
+    scores = json.dumps(dict([(name, 50) for name in names]))
+    legacy = Student(key_name='legacy@example.com', answers=answers,
+                     scores=scores)
+
+    def Legacy():
+      legacy.answers, legacy.scores = answers, scores
+      StoreWithReparsing(legacy, 90, answer)
+
+    email = 'bench_%s@example.com' % assessments
+    MakeStudent(email, assessments).put()
+    student = Student.get_by_email(email)
+    student.get_scores()
+
+    def Structured():
+      storeAssessmentData(student, 'postcourse', 90, answer)
+      student.get_entities_to_put()
+
+    Report('submission (%s assessments)' % assessments,
+           json_text_us='%.1f' % Measure(Legacy, 100),
+           structured_us='%.1f' % Measure(Structured, 100))
+
+
+def BenchmarkAnswerStorage():
+  """Compares entity size and put latency of answers in JSON and compact."""
+  import json
+  from google.appengine.ext import db
+  from models.models import Student, StudentAnswer
+
+  class JsonAnswer(db.Model):
+    """Stores answers the way AnswerHandler used to: JSON of all the POST."""
+    answer = db.TextProperty()
+
+  parent = Student(key_name='bench@example.com')
+  for questions in [4, 20, 100]:
+    post = [('assessment_type', 'postcourse'), ('num_correct', '0'),
+            ('num_questions', str(questions)), ('score', '0.00')]
+    responses = [[str(i), 'false'] for i in range(0, questions)]
+    post += [tuple(response) for response in responses]
+
+    legacy = JsonAnswer(parent=parent, key_name='postcourse',
+                        answer=json.dumps(post))
+    compact = StudentAnswer(parent=parent, key_name='postcourse')
+    compact.answer = responses
+
+    for label, entity in [('json', legacy), ('compact', compact)]:
+      Report('answer_storage %s (%s questions)' % (label, questions),
+             bytes=len(db.model_to_protobuf(entity).Encode()),
+             put_us='%.1f' % Measure(entity.put, 100))
+
+
+def BenchmarkUnitPageBytes():
+  """Compares bytes a unit page reads with full lessons and with summaries."""
+  import pickle
+  from models.courses import CourseIndex
+  from models.models import encode_entity
+
+  index = CourseIndex.load_from_files('data/unit.csv', 'data/lesson.csv')
+  full = [encode_entity(lesson) for lesson in index._content.values()]
+  Report('course_index memcache value',
+         full_lessons_bytes=len(pickle.dumps(
+             ([encode_entity(unit) for unit in index.units], full),
+             pickle.HIGHEST_PROTOCOL)),
+         summaries_bytes=len(pickle.dumps(
+             index.encode(), pickle.HIGHEST_PROTOCOL)))
+
+  for unit in index.units:
+    lessons = index.get_lessons(unit.id)
+    if not lessons:
+      continue
+    before = sum([len(pickle.dumps(encode_entity(index.get_lesson(
+        unit.id, lesson.id)), pickle.HIGHEST_PROTOCOL)) for lesson in lessons])
+    after = sum([len(pickle.dumps(lesson.encode(), pickle.HIGHEST_PROTOCOL))
+                 for lesson in lessons]) + len(pickle.dumps(encode_entity(
+                     index.get_lesson(unit.id, lessons[0].id)),
+                     pickle.HIGHEST_PROTOCOL))
+    Report('unit page (unit %s, %s lessons)' % (unit.id, len(lessons)),
+           full_lessons_bytes=before, summaries_bytes=after)
+
+
+def BenchmarkGrading():
+  """Times grading a large batch of random submissions on the server."""
+  import random
+  from models.grading import AnswerKeys
+
+  answer_keys = AnswerKeys.get_from_folder('assets/js')
+  responses = ['0', '1', '2', '3', 'sunrise', '-kennel', 'define brindle',
+               '354 + 651', '7.9', '7.91', 'I don\'t know', '']
+  for name in sorted(answer_keys.keys()):
+    answer_key = answer_keys[name]
+    submissions = [
+        [[str(i), random.choice(responses)]
+         for i in range(0, len(answer_key.checks))]
+        for _ in range(0, 10000)]
+    submission = iter(submissions * 2).next
+    Report('grading %s (%s questions)' % (name, len(answer_key.checks)),
+           cached_lookup_us='%.1f' % Measure(
+               lambda: AnswerKeys.get_from_folder('assets/js'), 100),
+           grade_us='%.2f' % Measure(
+               lambda: answer_key.score(submission()), len(submissions)))
+
+
+def Percentile(values, percent):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def BenchmarkSubmissionLatency():
+  """Compares latency of stored and queued submissions at a peak rate."""
+  import threading
+  from controllers.assessments import AnswerHandler, storeQueuedSubmissions
+  from models.grading import GradingPolicy
+  from models.models import Student
+  from models.submissions import LocalSubmissionQueue, get_submission_queue
+
+  students, threads, submissions = 50, 8, 2000
+  for i in range(0, students):
+    Student(key_name='peak_%s@example.com' % i, name='Peak',
+            is_enrolled=True).put()
+
+  policy = GradingPolicy()
+  answer = [[str(j), 'sunrise'] for j in range(0, 7)]
+  handler = AnswerHandler()
+  for label, store in [('stored', handler.storeAssessmentTransaction),
+                       ('queued', handler.queueAssessment)]:
+    latencies = []
+    def Submit(thread):
+      for i in range(thread, submissions, threads):
+        start = time.time()
+        store('peak_%s@example.com' % (i % students), 'postcourse', i % 100,
+              answer, 'token-%s' % i, policy)
+        latencies.append((time.time() - start) * 1000.0)
+
+    workers = [threading.Thread(target=Submit, args=(i,))
+               for i in range(0, threads)]
+    start = time.time()
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    Report('submission latency %s (%s threads)' % (label, threads),
+           per_sec='%.0f' % (submissions / (time.time() - start)),
+           p50_ms='%.2f' % Percentile(latencies, 50),
+           p99_ms='%.2f' % Percentile(latencies, 99))
+
+  queue = get_submission_queue()
+  start = time.time()
+  while storeQueuedSubmissions(queue, policy):
+    pass
+  Report('submission queue drain', submissions=submissions,
+         total_ms='%.0f' % ((time.time() - start) * 1000.0))
+  LocalSubmissionQueue.clear()
+
+
+def WriteSyntheticCourse(folder, units, lessons_per_unit, activity='yes'):
+  """Writes unit.csv and lesson.csv of a course of the given size."""
+  import csv
+  from tools import verify
+
+  unit_file = os.path.join(folder, 'unit.csv')
+  lesson_file = os.path.join(folder, 'lesson.csv')
+  with open(unit_file, 'w') as file:
+    writer = csv.writer(file)
+    writer.writerow(verify.UNITS_HEADER.split(','))
+    for i in range(1, units + 1):
+      writer.writerow([i, 'U', i, 'Unit %s' % i, '', 'True'])
+  with open(lesson_file, 'w') as file:
+    writer = csv.writer(file)
+    writer.writerow(verify.LESSONS_HEADER.split(','))
+    for i in range(1, units + 1):
+      for j in range(1, lessons_per_unit + 1):
+        writer.writerow([
+            i, 'Unit %s' % i, j, 'Lesson %s.%s' % (i, j), activity,
+            'Lesson %s.%s Activity' % (i, j), 'Notes of lesson %s.%s' % (i, j),
+            'http://example.com/slides/%s/%s' % (i, j), 'video%s_%s' % (i, j),
+            '<ul><li>objective of lesson %s.%s</li></ul>' % (i, j)])
+  return unit_file, lesson_file
+
+
+def MeasureExportInChild(buffered, unit_file, lesson_file, fname, results):
+  """Exports all formats; reports the growth of the peak memory of the child.
+
+  Buffered is how tools/export.py worked before: all lines are built first,
+  and each format builds all of its code before it is written."""
+  import resource
+  from tools import export
+
+  start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.time()
+  lines = export.GenerateCourseExportLines(unit_file, lesson_file)
+  if buffered:
+    lines = list(lines)
+    for name, writer in export.EXPORT_FORMATS:
+      code = '\n'.join(['  %s' % line for line in lines])
+      export.ExportToFile(fname, lines, [name])
+      del code
+  else:
+    export.ExportToFile(fname, lines)
+  results.put((time.time() - start, resource.getrusage(
+      resource.RUSAGE_SELF).ru_maxrss - start_kb))
+
+
+def BenchmarkExport():
+  """Compares time and peak memory of buffered and streaming exports."""
+  import multiprocessing
+  import shutil
+  import tempfile
+
+  folder = tempfile.mkdtemp()
+  try:
+    for units in [5, 50, 500]:
+      unit_file, lesson_file = WriteSyntheticCourse(folder, units, 100)
+      for label, buffered in [('buffered', True), ('streaming', False)]:
+        results = multiprocessing.Queue()
+        child = multiprocessing.Process(
+            target=MeasureExportInChild, args=(
+                buffered, unit_file, lesson_file,
+                os.path.join(folder, 'course'), results))
+        child.start()
+        seconds, peak_kb = results.get()
+        child.join()
+        Report('export %s (%s lessons)' % (label, units * 100),
+               ms='%.0f' % (seconds * 1000), peak_growth_kb=peak_kb)
+  finally:
+    shutil.rmtree(folder)
+
+
+def MeasureExportCommandInChild(argv, results):
+  """Runs tools/export.py; reports the growth of the peak memory of the child."""
+  import resource
+  from tools import export
+
+  sys.stdout = open(os.devnull, 'w')
+  start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.time()
+  export.main(argv)
+  results.put((time.time() - start, resource.getrusage(
+      resource.RUSAGE_SELF).ru_maxrss - start_kb))
+
+
+def BenchmarkExportCommand():
+  """Measures the whole export command: the verification and the export."""
+  import multiprocessing
+  import shutil
+  import tempfile
+
+  folder = tempfile.mkdtemp()
+  try:
+    os.makedirs(os.path.join(folder, 'data'))
+    for units in [5, 50, 500]:
+      WriteSyntheticCourse(os.path.join(folder, 'data'), units, 100, '')
+      results = multiprocessing.Queue()
+      child = multiprocessing.Process(
+          target=MeasureExportCommandInChild, args=([
+              '--course_folder=%s' % folder, '--formats=js,py,php',
+              '--output=%s' % os.path.join(folder, 'course')], results))
+      child.start()
+      seconds, peak_kb = results.get()
+      child.join()
+      Report('export command (%s lessons)' % (units * 100),
+             ms='%.0f' % (seconds * 1000), peak_growth_kb=peak_kb)
+  finally:
+    shutil.rmtree(folder)
+
+
+def BenchmarkVerifyCache():
+  """Compares a full verification with one that reuses cached results."""
+  import shutil
+  import tempfile
+  from tools import verify
+
+  folder = tempfile.mkdtemp()
+  try:
+    os.makedirs(os.path.join(folder, 'data'))
+    os.makedirs(os.path.join(folder, 'assets', 'js'))
+    activity = os.path.join(
+        os.path.dirname(__file__), '..', 'assets', 'js', 'activity-1.3.js')
+    for units in [2, 10, 50]:
+      WriteSyntheticCourse(os.path.join(folder, 'data'), units, 10)
+      for i in range(1, units + 1):
+        for j in range(1, 11):
+          shutil.copy(activity, os.path.join(
+              folder, 'assets', 'js', 'activity-%s.%s.js' % (i, j)))
+      for label in ['cold', 'cached']:
+        verifier = verify.Verifier(folder, use_cache=True)
+        start = time.time()
+        verifier.LoadAndVerifyModel(lambda x: None)
+        Report('verify %s (%s activities)' % (label, units * 10),
+               ms='%.0f' % ((time.time() - start) * 1000),
+               cache_hits=verifier.cache_hits, errors=verifier.errors)
+      os.remove(os.path.join(folder, 'data', verify.VERIFY_CACHE_FILE_NAME))
+  finally:
+    shutil.rmtree(folder)
+
+
+def BenchmarkVerifyJobs():
+  """Compares verification of activities in one and in several processes."""
+  import shutil
+  import tempfile
+  from tools import verify
+
+  folder = tempfile.mkdtemp()
+  try:
+    os.makedirs(os.path.join(folder, 'data'))
+    os.makedirs(os.path.join(folder, 'assets', 'js'))
+    activity = os.path.join(
+        os.path.dirname(__file__), '..', 'assets', 'js', 'activity-1.3.js')
+    WriteSyntheticCourse(os.path.join(folder, 'data'), 50, 10)
+    for i in range(1, 51):
+      for j in range(1, 11):
+        shutil.copy(activity, os.path.join(
+            folder, 'assets', 'js', 'activity-%s.%s.js' % (i, j)))
+    for jobs in [1, 2, 4, 8]:
+      verifier = verify.Verifier(folder, jobs=jobs)
+      start = time.time()
+      verifier.LoadAndVerifyModel(lambda x: None)
+      times = sorted(verifier.file_times.values())
+      Report('verify %s jobs (500 activities)' % jobs,
+             ms='%.0f' % ((time.time() - start) * 1000),
+             file_p50_ms='%.1f' % (Percentile(times, 50) * 1000),
+             file_max_ms='%.1f' % (times[-1] * 1000))
+  finally:
+    shutil.rmtree(folder)
+
+
+def BenchmarkSchemaValidation():
+  """Measures the validation of large activities against the schema."""
+  import glob
+  from tools import verify
+
+  items = []
+  for fname in sorted(glob.glob(os.path.join(
+      os.path.dirname(__file__), '..', 'assets', 'js', 'activity-*.*.js'))):
+    items += verify.EvaluateJavaScriptExpressionFromFile(
+        fname, 'activity', verify.Activity().scope, logging.error)['activity']
+  for size in [100, 1000, 10000]:
+    activity = (items * (size / len(items) + 1))[:size]
+    Report('validate activity (%s items)' % size, us='%.0f' % Measure(
+        lambda: verify.SchemaHelper().CheckInstancesMatchSchema(
+            activity, verify.SCHEMA['activity'], 'activity'), 10))
+
+
+ALL_BENCHMARKS = [
+    BenchmarkStudentCacheEncoding,
+    BenchmarkAssessmentSubmission,
+    BenchmarkAnswerStorage,
+    BenchmarkUnitPageBytes,
+    BenchmarkGrading,
+    BenchmarkSubmissionLatency,
+    BenchmarkExport,
+    BenchmarkExportCommand,
+    BenchmarkVerifyCache,
+    BenchmarkVerifyJobs,
+    BenchmarkSchemaValidation,
+]
+
+
+def main():
+  """Runs selected (or all) benchmarks against App Engine service stubs."""
+  suite.fix_sys_path()
+  from google.appengine.ext import testbed
+
+  suite.EmptyEnviron()
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_memcache_stub()
+  bed.init_datastore_v3_stub()
+  try:
+    names = sys.argv[1:]
+    for benchmark in ALL_BENCHMARKS:
+      if not names or benchmark.__name__ in names:
+        benchmark()
+  finally:
+    bed.deactivate()
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.ERROR)
+  main()
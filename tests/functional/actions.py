@@ -21,8 +21,11 @@ import main
 import os
 import re
 import suite
+from models.courses import CourseIndex
+from models.events import AnswerEventLog
 from models.models import Unit, Lesson
 from tools import verify
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import namespace_manager
 
 
@@ -34,6 +37,10 @@ class TestBase(suite.BaseTestClass):
   def setUp(self):
     super(TestBase, self).setUp()
 
+    # drop answer events buffered and course indexes built by earlier tests
+    AnswerEventLog.clear()
+    CourseIndex._instance_cache.clear()
+
     # set desired namespace and inits data
     namespace = namespace_manager.get_namespace()
     try:
@@ -106,6 +113,24 @@ class TestBase(suite.BaseTestClass):
     return self.hookResponse(response)
 
 
+class DatastoreCallCounter(object):
+  """Counts datastore RPCs by the call name, i.e. 'Get', 'Put', 'RunQuery'."""
+
+  def __init__(self):
+    self.counts = {}
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'datastore_call_counter_%s' % id(self), self.hook, 'datastore_v3')
+
+  def hook(self, service, call, request, response):
+    self.counts[call] = self.get(call) + 1
+
+  def get(self, call):
+    return self.counts.get(call, 0)
+
+  def reset(self):
+    self.counts = {}
+
+
 def AssertEquals(expected, actual):
   if not expected == actual:
     raise Exception('Expected \'%s\', does not match actual \'%s\'.' % (expected, actual))
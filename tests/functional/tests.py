@@ -16,12 +16,20 @@
 
 __author__ = 'Sean Lip'
 
-import os
-from controllers import sites, utils
+import csv, json, os, shutil, tempfile
+from controllers import assessments, sites, utils
 from models import models
 from controllers.sites import AssertFails
 from actions import *
-from controllers.assessments import getScore, getAllScores
+from controllers.assessments import getAnswer, getScore, getAllScores
+from models.courses import CourseIndex
+from models import events
+from models.events import AnswerEventLog, read_answer_events
+from models.grading import AnswerKeys, GradingPolicy
+from models.grading import get_responses, is_legacy_answer
+from models.submissions import LocalSubmissionQueue, get_submission_queue
+from tools import export, export_students, regrade, verify
+from google.appengine.ext import db
 
 
 class StudentAspectTest(TestBase):
@@ -74,6 +82,57 @@ class StudentAspectTest(TestBase):
     register(self, name3)
     logout()
 
+  def testEnrollmentCounter(self):
+    """Test the enrollment counter follows registrations and can be reconciled."""
+    login('444@example.com')
+    register(self, 'student4')
+    logout()
+
+    login('555@example.com')
+    register(self, 'student5')
+    unregister(self)
+    AssertFails(lambda: self.get('admin/enrollment_counter'))
+
+    os.environ['USER_IS_ADMIN'] = '1'
+    try:
+      response = self.get('admin/enrollment_counter')
+      AssertContains('Counter: 1', response.body)
+      AssertContains('Enrolled students: 1', response.body)
+
+      models.EnrollmentCounter.reset(7)
+      response = self.get('admin/enrollment_counter?reconcile=true')
+      AssertContains('Counter: 7', response.body)
+      AssertContains('Counter is reset to: 1', response.body)
+      AssertEquals(1, models.EnrollmentCounter.get_count())
+    finally:
+      del os.environ['USER_IS_ADMIN']
+      logout()
+
+  def testEnrollmentCounterWithMemcache(self):
+    """Test the total cached in memcache follows enrollments."""
+    models.IS_CACHE_ENABLED = True
+    try:
+      models.EnrollmentCounter.reset(3)
+      cached_total = lambda: models.MemcacheManager.get(
+          models.EnrollmentCounter.CACHE_KEY)
+
+      login('666@example.com')
+      register(self, 'student6')
+      Permissions.assert_enrolled(self)
+      AssertEquals(4, cached_total())
+
+      unregister(self)
+      Permissions.assert_unenrolled(self)
+      AssertEquals(3, cached_total())
+      AssertEquals(3, models.EnrollmentCounter.get_count())
+
+      register(self, 'student6')
+      Permissions.assert_enrolled(self)
+      AssertEquals(4, cached_total())
+      logout()
+    finally:
+      models.IS_CACHE_ENABLED = models.PRODUCTION_MODE
+
   def testPermissions(self):
     """Test student permissions to pages."""
     email = 'test_permissions@example.com'
@@ -102,6 +161,38 @@ class StudentAspectTest(TestBase):
     logout()
     Permissions.assert_logged_out(self)
 
+  def testNegativeCaching(self):
+    """Test unregistered visitors do not cause repeated datastore reads."""
+    email = 'test_negative_caching@example.com'
+    name = 'Test Negative Caching'
+
+    models.IS_CACHE_ENABLED = True
+    try:
+      counter = DatastoreCallCounter()
+
+      # warm up the caches, then count datastore gets of repeated visits
+      view_preview(self)
+      login(email)
+      view_preview(self)
+      view_registration(self)
+      counter.reset()
+      for i in range(0, 5):
+        view_preview(self)
+        view_registration(self)
+        AssertEquals(302, self.get('course').status_int)
+      logout()
+      for i in range(0, 5):
+        view_preview(self)
+      AssertEquals(0, counter.get('Get'))
+
+      # registration must not be hidden by the negative cache entries
+      login(email)
+      register(self, name)
+      view_course(self)
+      logout()
+    finally:
+      models.IS_CACHE_ENABLED = models.PRODUCTION_MODE
+
 
 class PageCacheTest(TestBase):
   """Checks if pages cached for one user are properly render for another."""
@@ -139,6 +230,11 @@ class AssessmentTest(TestBase):
     AssertEquals(response.status_int, 200)
     return response
 
+  def acceptClientScores(self):
+    """Trusts the posted 'score' like the server did before it graded."""
+    assessments.ACCEPT_CLIENT_SCORES = True
+    self.addCleanup(setattr, assessments, 'ACCEPT_CLIENT_SCORES', False)
+
   def testCoursePass(self):
     """Tests student passing final exam."""
     email = 'test_pass@google.com'
@@ -147,6 +243,7 @@ class AssessmentTest(TestBase):
     post = {'assessment_type': 'postcourse',
         'num_correct': '0', 'num_questions': '4',
         'score': '100.00'}
+    self.acceptClientScores()
 
     # register
     login(email)
@@ -197,6 +294,7 @@ class AssessmentTest(TestBase):
         '2': 'false', '3': 'false',
         'num_correct': '0', 'num_questions': '4',
         'score': '100000'}
+    self.acceptClientScores()
 
     # register
     login(email)
@@ -243,6 +341,551 @@ class AssessmentTest(TestBase):
     assert int(getScore(student, 'overall_score')) == int((0.30*2) + (0.70*100000))
 
 
+  def testServerGrading(self):
+    """Tests the server grades responses and ignores the posted score."""
+    email = 'test_grading@google.com'
+    name = 'Test Grading'
+
+    # all responses are correct, except the one to question 3
+    post = {'assessment_type': 'postcourse',
+        '0': '2', '1': '3', '2': '1', '3': 'existe um rest',
+        '4': ' Existe um res ', '5': '7.9', '6': '0',
+        'score': '100.00'}
+
+    login(email)
+    register(self, name)
+
+    response = self.submitAssessment('Fin', post)
+    AssertContains('Your score is 60%', response.body)
+    student = models.Student.get_enrolled_student_by_email(email)
+    AssertEquals(86, int(getScore(student, 'postcourse')))
+    assert ['5', '7.9'] in getAnswer(student, 'postcourse')
+
+    # an assessment without an answer key can't be graded
+    response = self.testapp.post(self.canonicalize('answer'), {
+        'assessment_type': 'unknown', '0': '1'}, expect_errors=True)
+    AssertEquals(400, response.status_int)
+
+  def testQueuedSubmissions(self):
+    """Tests queued submissions are confirmed at once and stored later."""
+    email = 'test_queued@google.com'
+    name = 'Test Queued'
+    post = {'assessment_type': 'postcourse',
+        '0': '2', '1': '3', '2': '1', '3': 'existe um rest',
+        '4': ' Existe um res ', '5': '7.9', '6': '0'}
+
+    assessments.QUEUE_SUBMISSIONS = True
+    self.addCleanup(setattr, assessments, 'QUEUE_SUBMISSIONS', False)
+    self.addCleanup(LocalSubmissionQueue.clear)
+
+    login(email)
+    register(self, name)
+
+    # the result is served, but nothing is stored yet
+    response = self.submitAssessment('Fin', post)
+    AssertContains('Your score is 60%', response.body)
+    response = self.submitAssessment('Fin', dict(post, **{'6': '1'}))
+    student = models.Student.get_by_email(email)
+    AssertEquals(None, getScore(student, 'postcourse'))
+    AssertEquals(None, getAnswer(student, 'postcourse'))
+    AssertEquals(2, get_submission_queue().count())
+
+    # the queue is drained in order, by an administrator or cron
+    response = self.testapp.get(self.canonicalize('admin/store_submissions'),
+                                expect_errors=True)
+    AssertEquals(403, response.status_int)
+    response = self.testapp.get(self.canonicalize('admin/store_submissions'),
+                                headers={'X-AppEngine-Cron': 'true'})
+    AssertContains('Stored 2 submissions.', response.body)
+    AssertEquals(0, get_submission_queue().count())
+
+    student = models.Student.get_by_email(email)
+    AssertEquals(86, int(getScore(student, 'postcourse')))
+    AssertEquals(60, int(getScore(student, 'overall_score')))
+    assert ['6', '1'] in getAnswer(student, 'postcourse')
+
+  def testAnswerEventLog(self):
+    """Tests submissions are logged in batches and read back in order."""
+    email = 'test_events@google.com'
+    name = 'Test Events'
+
+    login(email)
+    register(self, name)
+    for i in range(0, 3):
+      self.submitAssessment('Pre', {'assessment_type': 'precourse',
+                                    '0': str(i), 'submission_token': str(i)})
+
+    # the events are buffered until there are enough of them, or until cron
+    # asks the instance to write them
+    AssertEquals([], list(read_answer_events()))
+    response = self.testapp.get(
+        self.canonicalize('admin/flush_answer_events'), expect_errors=True)
+    AssertEquals(403, response.status_int)
+    response = self.testapp.get(
+        self.canonicalize('admin/flush_answer_events'),
+        headers={'X-AppEngine-Cron': 'true'})
+    AssertContains('Wrote 3 answer events.', response.body)
+    AssertEquals(1, events.AnswerEventSegment.all().count())
+    logged = list(read_answer_events())
+    AssertEquals(['0', '1', '2'], [event.token for event in logged])
+    AssertEquals([['0', '2']], logged[2].answer)
+    AssertEquals(email, logged[2].email)
+    AssertEquals('precourse', logged[2].assessment_type)
+
+    # a batch is written when it is full
+    self.addCleanup(setattr, events, 'ANSWER_EVENT_BATCH_SIZE',
+                    events.ANSWER_EVENT_BATCH_SIZE)
+    events.ANSWER_EVENT_BATCH_SIZE = 2
+    for i in range(3, 5):
+      self.submitAssessment('Pre', {'assessment_type': 'precourse',
+                                    '0': str(i), 'submission_token': str(i)})
+    AssertEquals(['0', '1', '2', '3', '4'],
+                 [event.token for event in read_answer_events()])
+
+    # events that fail to be written are buffered again, but only so many
+    self.addCleanup(setattr, events, 'ANSWER_EVENT_MAX_BUFFERED',
+                    events.ANSWER_EVENT_MAX_BUFFERED)
+    events.ANSWER_EVENT_MAX_BUFFERED = 3
+    def fail_put(entity):
+      raise db.TransactionFailedError()
+    self.addCleanup(setattr, events.AnswerEventSegment, 'put',
+                    events.AnswerEventSegment.put)
+    events.AnswerEventSegment.put = fail_put
+    AnswerEventLog.clear()
+    for i in range(5, 9):
+      AnswerEventLog.record(events.AnswerEvent(email, 'precourse', 0, [], i))
+    AssertEquals(0, AnswerEventLog.flush())
+    AssertEquals([6, 7, 8], [
+        event.token for event in AnswerEventLog._buffers.values()[0]])
+    AnswerEventLog.clear()
+
+  def testSubmissionRpcs(self):
+    """Tests a submission reads once and a retried one writes nothing."""
+    email = 'test_submission_rpcs@google.com'
+    name = 'Test Submission RPCs'
+    post = {'assessment_type': 'precourse', '0': '1', '1': 'sunrise',
+            'submission_token': 'token-1'}
+
+    login(email)
+    register(self, name)
+    counter = DatastoreCallCounter()
+
+    # the student and the stored answers are read in one batch
+    self.submitAssessment('Pre', post)
+    counter.reset()
+    self.post('answer', dict(post, **{'1': 'sunset'}))
+    AssertEquals(1, counter.get('Get'))
+    AssertEquals(1, counter.get('Put'))
+
+    # a retry of the same submission is not written again
+    counter.reset()
+    self.post('answer', dict(post, **{'1': 'sunset'}))
+    AssertEquals(0, counter.get('Put'))
+
+    # but the same answers from another submission are
+    counter.reset()
+    self.post('answer', dict(post, **{
+        '1': 'sunset', 'submission_token': 'token-2'}))
+    AssertEquals(1, counter.get('Put'))
+
+    student = models.Student.get_by_email(email)
+    assert ['1', 'sunset'] in getAnswer(student, 'precourse')
+    AssertEquals('token-2', student.get_answer_token('precourse'))
+
+  def testLegacyScoresMigration(self):
+    """Tests scores and answers stored as JSON text are moved into entities."""
+    email = 'test_legacy@google.com'
+    name = 'Test Legacy'
+
+    # store a student the way it was stored before StudentScore existed: the
+    # answer is the JSON text of all form fields posted by the browser
+    answer = json.dumps([
+        ['assessment_type', 'precourse'], ['0', 'false'], ['1', 'true'],
+        ['num_correct', '1'], ['num_questions', '2'], ['score', '50.00']])
+    legacy = models.Student(
+        key_name=email, name=name, is_enrolled=True,
+        scores='{"precourse": 1, "midcourse": 50}',
+        answers=json.dumps({'precourse': answer}))
+    db.put(legacy)
+
+    # check the legacy scores are visible
+    student = models.Student.get_by_email(email)
+    assert int(getScore(student, 'midcourse')) == 50
+    assert getAnswer(student, 'precourse') == answer
+    AssertEquals([['0', 'false'], ['1', 'true']], get_responses(answer))
+    assert is_legacy_answer(answer)
+    assert not is_legacy_answer([['0', '1'], ['1', 'true']])
+
+    # migrate all students
+    os.environ['USER_IS_ADMIN'] = '1'
+    try:
+      login('admin@example.com')
+      response = self.get('admin/migrate_students?batch_size=1')
+      AssertContains('Migration complete: 1 students processed, 1 migrated.',
+                     response.body)
+      logout()
+    finally:
+      del os.environ['USER_IS_ADMIN']
+
+    student = models.Student.get_by_email(email)
+    assert not student.scores
+    assert not student.answers
+    assert int(getScore(student, 'precourse')) == 1
+    assert int(getScore(student, 'midcourse')) == 50
+    assert getAnswer(student, 'precourse') == answer
+
+    # find students who scored below 70 in 'midcourse'
+    below = models.StudentScore.all(keys_only=True).filter(
+        'assessment_type =', 'midcourse').filter('score <', 70).fetch(10)
+    AssertEquals([email], [key.parent().name() for key in below])
+
+
+class CourseIndexTest(TestBase):
+  """Tests the in-memory index of the course structure."""
+
+  def testNavigation(self):
+    """Test back and next buttons are precomputed like handlers did."""
+    units = [models.Unit(id=2, type='U', unit_id='1', title='Unit 1'),
+             models.Unit(id=1, type='A', unit_id='Pre', title='Pre')]
+    lessons = [models.Lesson(unit_id=1, id=2, title='Two', activity='yes'),
+               models.Lesson(unit_id=1, id=1, title='One', activity=''),
+               models.Lesson(unit_id=1, id=3, title='Three', activity='')]
+    index = CourseIndex(units, lessons)
+
+    AssertEquals(['Pre', '1'], [unit.unit_id for unit in index.units])
+    AssertEquals('Unit 1', index.find_unit(1).title)
+    AssertEquals('Pre', index.find_unit_by_id(1).unit_id)
+    AssertEquals([1, 2, 3], [lesson.id for lesson in index.get_lessons(1)])
+    AssertEquals((), index.get_lessons(2))
+
+    AssertEquals(('', '/unit?unit=1&lesson=2'),
+                 index.get_unit_navigation(1, 1))
+    AssertEquals(('/unit?unit=1&lesson=1', '/activity?unit=1&lesson=2'),
+                 index.get_unit_navigation(1, 2))
+    AssertEquals(('/activity?unit=1&lesson=2', ''),
+                 index.get_unit_navigation(1, 3))
+    AssertEquals(('/unit?unit=1&lesson=2', '/unit?unit=1&lesson=3'),
+                 index.get_activity_navigation(1, 2))
+
+  def testCaching(self):
+    """Test the index is built once and rebuilt after invalidation."""
+    models.IS_CACHE_ENABLED = True
+    try:
+      counter = DatastoreCallCounter()
+      index = CourseIndex.get()
+      queries = counter.get('RunQuery')
+      assert queries > 0
+      assert index is CourseIndex.get()
+      AssertEquals(queries, counter.get('RunQuery'))
+
+      # another instance only needs memcache
+      CourseIndex._instance_cache.clear()
+      assert len(CourseIndex.get().units) == len(index.units)
+      AssertEquals(queries, counter.get('RunQuery'))
+
+      # an administrator invalidates the index after a bulkloader upload
+      login('admin@example.com')
+      AssertFails(lambda: self.get('admin/invalidate_course_index'))
+      os.environ['USER_IS_ADMIN'] = '1'
+      try:
+        response = self.get('admin/invalidate_course_index')
+        AssertContains('Course index is invalidated', response.body)
+      finally:
+        del os.environ['USER_IS_ADMIN']
+        logout()
+      assert not index is CourseIndex.get()
+      assert counter.get('RunQuery') > queries
+    finally:
+      models.IS_CACHE_ENABLED = models.PRODUCTION_MODE
+      CourseIndex._instance_cache.clear()
+
+  def testCachingWithoutMemcache(self):
+    """Test the index is kept by the instance if memcache is disabled."""
+    try:
+      counter = DatastoreCallCounter()
+      index = CourseIndex.get()
+      queries = counter.get('RunQuery')
+      assert index is CourseIndex.get()
+      AssertEquals(queries, counter.get('RunQuery'))
+
+      CourseIndex.invalidate()
+      assert not index is CourseIndex.get()
+      assert counter.get('RunQuery') > queries
+    finally:
+      CourseIndex._instance_cache.clear()
+
+  def testLessonContent(self):
+    """Test the index holds lesson summaries and loads content on demand."""
+    models.IS_CACHE_ENABLED = True
+    try:
+      models.Lesson(unit_id=100, id=1, title='Lesson', activity='yes',
+                    objectives='Objectives', video='Video').put()
+      CourseIndex.invalidate()
+      index = CourseIndex.get()
+      summary = index.get_lessons(100)[0]
+      AssertEquals('Lesson', summary.title)
+      assert not hasattr(summary, 'objectives')
+
+      # content of a freshly loaded index is already in memcache
+      counter = DatastoreCallCounter()
+      AssertEquals('Objectives', index.get_lesson(100, 1).objectives)
+      AssertEquals(None, index.get_lesson(100, 2))
+      AssertEquals(0, counter.get('RunQuery'))
+
+      # another instance reads the content of one lesson
+      CourseIndex._instance_cache.clear()
+      models.MemcacheManager.delete('lesson:%s:100:1' % index.version)
+      AssertEquals('Video', CourseIndex.get().get_lesson(100, 1).video)
+      AssertEquals(1, counter.get('RunQuery'))
+    finally:
+      models.IS_CACHE_ENABLED = models.PRODUCTION_MODE
+      CourseIndex._instance_cache.clear()
+
+  def testCsvBackend(self):
+    """Test the course structure is read from CSV files without datastore."""
+    context = sites.ApplicationContext('course', '/', '/', '', 'csv')
+    try:
+      counter = DatastoreCallCounter()
+      index = CourseIndex.get(context)
+      assert index.units
+      assert index.get_lessons(index.units[0].id)
+      assert index is CourseIndex.get(context)
+      AssertEquals(0, counter.get('RunQuery'))
+
+      # the layout on disk matches the one the bulkloader has uploaded
+      AssertEquals([unit.unit_id for unit in CourseIndex.load().units],
+                   [unit.unit_id for unit in index.units])
+    finally:
+      CourseIndex._instance_cache.clear()
+
+
+  def testBundleBackend(self):
+    """Test a course bundle round trips through export and the index."""
+    verifier = verify.Verifier()
+    verifier.LoadAndVerifyModel(lambda x: None)
+    fname = os.path.join(tempfile.mkdtemp(), export.BUNDLE_FILE_NAME)
+    export.WriteBundle(fname, export.MakeBundle(verifier))
+
+    try:
+      index = CourseIndex.get_from_files([fname], CourseIndex.load_from_bundle)
+      assert index is CourseIndex.get_from_files(
+          [fname], CourseIndex.load_from_bundle)
+      AssertEquals(len(verifier.units), len(index.units))
+      lesson = verifier.lessons[0]
+      AssertEquals(lesson.lesson_objectives, index.get_lesson(
+          lesson.unit_id, lesson.lesson_id).objectives)
+
+      AssertEquals(40, len(index.content_hash))
+      AssertEquals(
+          sorted(verifier.assessment_files.keys()),
+          sorted(index.assessments.keys()))
+      AssertEquals({'string': 'sunrise'}, index.answer_keys['Pre'][2])
+
+      # the server grades with the answer keys of the bundle
+      answer_key = AnswerKeys.get_from_index(index)['precourse']
+      AssertEquals(100, answer_key.score(
+          {'0': '2', '1': '0', '2': 'Sunrise', '3': '354 + 651'}))
+      AssertEquals(50, answer_key.score({'0': '2', '1': '0'}))
+    finally:
+      CourseIndex._instance_cache.clear()
+
+
+class ExportTest(TestBase):
+  """Tests data exports of the course content."""
+
+  def testDataExports(self):
+    """Test all data formats hold the same records and deltas are minimal."""
+    verifier = verify.Verifier()
+    verifier.LoadAndVerifyModel(lambda x: None)
+    fname = os.path.join(tempfile.mkdtemp(), 'course')
+    manifest = export.ExportData(fname, verifier, ['json', 'jsonl', 'msgpack'])
+
+    header, records = export.ReadDataExport(fname + '.json')
+    AssertEquals(export.DATA_SCHEMA_VERSION, header['schema_version'])
+    AssertEquals(manifest['content_hash'], header['content_hash'])
+    AssertEquals(len(manifest['entities']), len(records))
+    for extension in ['.jsonl', '.msgpack']:
+      AssertEquals((header, records), export.ReadDataExport(fname + extension))
+    kinds = [record['kind'] for record in records]
+    AssertEquals(len(verifier.units), kinds.count('unit'))
+    AssertEquals(len(verifier.lessons), kinds.count('lesson'))
+    AssertEquals(len(verifier.activity_files), kinds.count('activity'))
+    AssertEquals(len(verifier.assessment_files), kinds.count('assessment'))
+
+    # nothing changed since the last export
+    previous = export.ReadManifest(fname + '.manifest.json')
+    export.ExportData(fname, verifier, ['jsonl'], previous)
+    header, records = export.ReadDataExport(fname + '.jsonl')
+    AssertEquals(manifest['content_hash'], header['delta_of'])
+    AssertEquals([], records)
+
+    # one entity changed and one was removed since the last export
+    previous['entities']['assessment:Pre'] = 'changed'
+    previous['entities']['unit:999'] = 'removed'
+    export.ExportData(fname, verifier, ['msgpack'], previous)
+    header, records = export.ReadDataExport(fname + '.msgpack')
+    AssertEquals(['assessment', 'unit'], [record['kind'] for record in records])
+    AssertEquals('Pre', records[0]['key'])
+    assert records[0]['data']['questionsList']
+    AssertEquals({'kind': 'unit', 'key': '999', 'deleted': True}, records[1])
+
+
+class VerifyTest(TestBase):
+  """Tests incremental and parallel verification of the course files."""
+
+  def testVerifyUnitTests(self):
+    """Runs the self-tests of the parser and the schema of tools/verify.py."""
+    verify.RunAllUnitTests()
+
+  def CopyCourse(self):
+    folder = tempfile.mkdtemp()
+    root = os.path.join(os.path.dirname(verify.__file__), '..')
+    shutil.copytree(os.path.join(root, 'data'), os.path.join(folder, 'data'))
+    shutil.copytree(os.path.join(root, 'assets', 'js'),
+                    os.path.join(folder, 'assets', 'js'))
+    return folder
+
+  def testVerifyCache(self):
+    """Test cached results report the same as a full verification."""
+    folder = self.CopyCourse()
+
+    def Verify(use_cache):
+      verifier = verify.Verifier(folder, use_cache)
+      verifier.LoadAndVerifyModel(lambda x: None)
+      return verifier
+
+    try:
+      expected = Verify(False)
+      AssertEquals(0, expected.cache_hits)
+      AssertEquals(0, Verify(True).cache_hits)
+      verifier = Verify(True)
+      files = len(verifier.assessment_files)
+      assert files
+      AssertEquals(files, verifier.cache_hits)
+      AssertEquals(expected.errors, verifier.errors)
+      AssertEquals(expected.warnings, verifier.warnings)
+      AssertEquals(expected.schema_helper.type_stats,
+                   verifier.schema_helper.type_stats)
+
+      # a changed file is verified again
+      with open(verifier.assessment_files.values()[0], 'a') as file:
+        file.write('\n')
+      AssertEquals(files - 1, Verify(True).cache_hits)
+    finally:
+      shutil.rmtree(folder)
+
+  def testVerifyJobs(self):
+    """Test verification in several processes reports as a serial one."""
+    folder = self.CopyCourse()
+
+    def Verify(jobs):
+      output = []
+      verifier = verify.Verifier(folder, jobs=jobs)
+      verifier.LoadAndVerifyModel(output.append)
+      return verifier, [line for line in output if not 'Took ' in line]
+
+    try:
+      serial, serial_output = Verify(1)
+      parallel, parallel_output = Verify(3)
+      AssertEquals(serial_output, parallel_output)
+      AssertEquals(serial.errors, parallel.errors)
+      AssertEquals(serial.warnings, parallel.warnings)
+      AssertEquals(serial.schema_helper.type_stats,
+                   parallel.schema_helper.type_stats)
+      AssertEquals(sorted(serial.assessment_files.values()),
+                   sorted(parallel.file_times.keys()))
+    finally:
+      shutil.rmtree(folder)
+
+
+class StudentExportTest(TestBase):
+  """Tests the parallel, resumable export of students."""
+
+  def testExportStudents(self):
+    """Test an interrupted export resumes and exports each student once."""
+    for i in range(0, 10):
+      student = models.Student(key_name='student%s@example.com' % i,
+                               name='Student %s' % i, is_enrolled=True)
+      student.set_score('midcourse', i)
+      student.set_answer('midcourse', [['0', str(i)]])
+      student.put()
+    answer = json.dumps([['assessment_type', 'precourse'], ['0', 'a\\b'],
+                         ['score', '5.00']])
+    db.put(models.Student(
+        key_name='legacy@example.com', name='Legacy', is_enrolled=False,
+        scores='{"precourse": 5}', answers=json.dumps({'precourse': answer})))
+
+    fname = os.path.join(tempfile.mkdtemp(), 'students.jsonl')
+    options = export_students.ParseArgs([
+        '--output=%s' % fname, '--shards=3', '--workers=2', '--batch_size=4'])
+
+    # export a part of the first shard, as if the export was interrupted
+    checkpoint = export_students.Checkpoint(fname + '.checkpoint', options)
+    checkpoint.Start(options, export_students.GetShardBoundaries(3))
+    AssertEquals(3, len(checkpoint.state['shards']))
+    export_students.ExportShard(options, checkpoint, 0, max_batches=1)
+    assert checkpoint.state['shards'][0]['students']
+    assert not checkpoint.state['shards'][0]['done']
+
+    AssertEquals(11, export_students.ExportStudents(options))
+    assert not os.path.exists(fname + '.checkpoint')
+    assert not os.path.exists(fname + '.part000')
+    students = [json.loads(line) for line in open(fname)]
+    AssertEquals(sorted(['legacy@example.com'] + [
+        'student%s@example.com' % i for i in range(0, 10)]),
+                 [student['email'] for student in students])
+    AssertEquals({'precourse': 5}, students[0]['scores'])
+    AssertEquals({'precourse': answer}, students[0]['answers'])
+    AssertEquals(False, students[0]['is_enrolled'])
+    AssertEquals({'midcourse': 3}, students[4]['scores'])
+    AssertEquals({'midcourse': [['0', '3']]}, students[4]['answers'])
+
+    # select fields of a CSV export
+    fname = os.path.join(tempfile.mkdtemp(), 'students.csv')
+    options = export_students.ParseArgs([
+        '--output=%s' % fname, '--format=csv', '--fields=email,scores'])
+    AssertEquals(11, export_students.ExportStudents(options))
+    rows = list(csv.reader(open(fname)))
+    AssertEquals(['email', 'scores'], rows[0])
+    AssertEquals(['student3@example.com', '{"midcourse": 3}'], rows[5])
+
+
+class GradingPolicyTest(TestBase):
+  """Tests weights of assessments and the passing score of a course."""
+
+  def testGradingPolicy(self):
+    """Test the default policy and a course policy from its data folder."""
+    folder = tempfile.mkdtemp()
+    policy = GradingPolicy.get(folder)
+    AssertEquals(int((0.30 * 2) + (0.70 * 3)), policy.get_overall_score(
+        {'midcourse': 2, 'postcourse': '3'}))
+    assert policy.is_passing(70)
+    assert not policy.is_passing(69)
+
+    fname = os.path.join(folder, 'grading.json')
+    open(fname, 'w').write(
+        '{"weights": {"midcourse": 0.5, "postcourse": 0.5}, '
+        '"passing_score": 50}')
+    policy = GradingPolicy.get(folder)
+    AssertEquals(75, policy.get_overall_score(
+        {'midcourse': 50, 'postcourse': 100}))
+    AssertEquals(50, policy.get_overall_score({'postcourse': 100}))
+    assert policy.is_passing(50)
+    assert policy is GradingPolicy.get(folder)
+
+  def testRegradeKeepsHighestScore(self):
+    """Test regrading only lowers scores if asked to overwrite them."""
+    policy = GradingPolicy()
+    scores = {'midcourse': 80, 'postcourse': 90, 'overall_score': 87}
+    AssertEquals({}, regrade.GetChangedScores(
+        scores, {'midcourse': 60, 'postcourse': 90}, policy))
+    AssertEquals({'midcourse': 100, 'overall_score': 93},
+                 regrade.GetChangedScores(scores, {'midcourse': 100}, policy))
+    AssertEquals({'midcourse': 60, 'overall_score': 81},
+                 regrade.GetChangedScores(
+                     scores, {'midcourse': 60}, policy, overwrite=True))
+
+
 class CourseUrlRewritingTest(StudentAspectTest, PageCacheTest, AssessmentTest):
   """Runs existing tests using rewrite rules for '/courses/pswg' base URL."""
 
@@ -14,95 +14,656 @@
 #
 # @author: psimakov@google.com (Pavel Simakov)
 
-"""Allows export of Lessons and Units to other systems."""
+"""Allows export of Lessons and Units to other systems.
 
-import verify, os
+Run "python tools/export.py" to export the course as JavaScript, Python and
+PHP code; select some of the formats with "--formats=js,py". The code of all
+formats is written in one pass over the course files, so the export itself
+takes about the same memory for a course of any size. The export only starts
+after tools/verify.py has checked the course, and the verification keeps all
+units and lessons in memory, so the memory of the whole command still grows
+with the number of lessons; see BenchmarkExportCommand in tests/benchmarks.py.
+
+Formats "json", "jsonl" and "msgpack" export the units, lessons, activities and
+assessments as data; the first value of each file is a header with the schema
+version and the content hash of the course. Each data export also writes a
+manifest; pass it as "--since=<output>.manifest.json" to the next export to
+only export the entities changed since then.
+
+Run "python tools/export.py bundle" to write the course bundle: one versioned
+file with units, lessons, parsed activities and assessments, their answer keys
+and a hash of all content files. Serve a course from its bundle by selecting
+the 'bundle' content backend in GCB_COURSES_CONFIG."""
+
+import hashlib, json, optparse, os, struct, sys, verify, zlib
 from datetime import datetime
 
 RELEASE_TAG = "1.0"
 
+# the first line of the bundle file is "<BUNDLE_MAGIC> <version> <hash>"
+BUNDLE_MAGIC = "gcb-course-bundle"
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_FILE_NAME = "course.bundle"
+
+# the header of data exports names their format and the version of its schema
+DATA_MAGIC = "gcb-course-data"
+DATA_SCHEMA_VERSION = 1
+
 
 def Echo(x):
   pass
 
 
+class ExportWriter(object):
+  """Streams the export code into a file in one format.
+
+  The code is made of the Begin() lines, one line for each line of the export,
+  and the End() lines; only the current line is held in memory."""
+
+  EXTENSION = None
+
+  def __init__(self, fname, date):
+    self.file = open("%s.%s" % (fname, self.EXTENSION), "w")
+    self.file.write(self.Header(date))
+    self.file.write("\n".join(self.Begin()))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def Write(self, line):
+    self.file.write("\n")
+    self.file.write(self.FormatLine(line))
+
+  def End(self):
+    """Completes the code; the export is complete once it is closed."""
+    for code in self.EndLines():
+      self.file.write("\n")
+      self.file.write(code)
+    self.file.write(self.Footer())
+
+  def Close(self):
+    self.file.close()
+
+
+class JavaScriptWriter(ExportWriter):
+  EXTENSION = "js"
+
+  def Header(self, date):
+    return ("// Course Builder %s JavaScript Export on %s\n"
+            "// begin\n" % (RELEASE_TAG, date))
+
+  def Begin(self):
+    return ["function gcb_import(){"]
+
+  def FormatLine(self, line):
+    if len(line) != 0: return "  %s" % line
+    else: return ""
+
+  def EndLines(self):
+    return ["", "  return units;", "}"]
+
+  def Footer(self):
+    return "\n// end"
+
+
+class PythonWriter(ExportWriter):
+  EXTENSION = "py"
+
+  def Header(self, date):
+    return ("# Course Builder %s Python Export on %s\n"
+            "# begin\n" % (RELEASE_TAG, date))
+
+  def Begin(self):
+    return ["class Array(dict):", "  pass", "", "true = True", "false = False",
+            "", "def gcb_import():"]
+
+  def FormatLine(self, line):
+    return "  %s" % line
+
+  def EndLines(self):
+    return ["  return units", "", "if __name__ == \"__main__\":", "  init()"]
+
+  def Footer(self):
+    return "\n# end"
+
+
+class PHPWriter(ExportWriter):
+  EXTENSION = "php"
+
+  def Header(self, date):
+    return ("<?php\n// Course Builder %s PHP Export on %s\n"
+            "// begin\n" % (RELEASE_TAG, date))
+
+  def Begin(self):
+    return ["function gcb_import(){"]
+
+  def FormatLine(self, line):
+    if len(line) != 0: return "  $%s" % line
+    else: return ""
+
+  def EndLines(self):
+    return ["", "  return $units;", "}"]
+
+  def Footer(self):
+    return "\n// end?>"
+
+
+# export format name -> writer, in the order the formats are written
+EXPORT_FORMATS = [
+    ("js", JavaScriptWriter), ("py", PythonWriter), ("php", PHPWriter)]
+
+
 def ExportToJavaScript(fname, lines, date):
-  file = open("%s.js" % fname, 'w')
-  file.write("// Course Builder %s JavaScript Export on %s\n" % (RELEASE_TAG, date))
-  file.write("// begin\n")
-  code = []
-  code.append("function gcb_import(){")
-  for line in lines:
-    if len(line) != 0: code.append("  %s" % line)
-    else: code.append("")
-  code.append("")
-  code.append("  return units;")
-  code.append("}")
-  file.write("\n".join(code))
-  file.write("\n// end");
-  file.close()
+  ExportToFile(fname, lines, ["js"], date)
 
 
 def ExportToPython(fname, lines, date):
-  code = []
-  code.append("class Array(dict):")
-  code.append("  pass")
-  code.append("")
-  code.append("true = True")
-  code.append("false = False")
-  code.append("")
-  code.append("def gcb_import():")
-  for line in lines:
-    code.append("  %s" % line)
-  code.append("  return units")
-  code.append("")
-  code.append("if __name__ == \"__main__\":")
-  code.append("  init()")
-
-  file = open("%s.py" % fname, 'w')
-  file.write("# Course Builder %s Python Export on %s\n" % (RELEASE_TAG, date))
-  file.write("# begin\n")
-  file.write("\n".join(code))
-  file.write("\n# end");
-  file.close()
+  ExportToFile(fname, lines, ["py"], date)
 
 
 def ExportToPHP(fname, lines, date):
-  file = open("%s.php" % fname, 'w')
-  file.write("<?php\n")
-  file.write("// Course Builder %s PHP Export on %s\n" % (RELEASE_TAG, date))
-  file.write("// begin\n")
-  code = []
-  code.append("function gcb_import(){")
-  for line in lines:
-    if len(line) != 0: code.append("  $%s" % line)
-    else: code.append("")
-  code.append("")
-  code.append("  return $units;")
-  code.append("}")
-  file.write("\n".join(code))
-  file.write("\n// end");
-  file.write("?>")
+  ExportToFile(fname, lines, ["php"], date)
+
+
+def HashContentFiles(fnames):
+  """Makes a hash of the names and the content of the given files."""
+  digest = hashlib.sha1()
+  for fname in sorted(fnames):
+    digest.update(os.path.basename(fname))
+    digest.update(open(fname, "rb").read())
+  return digest.hexdigest()
+
+
+def ExtractAnswerKey(assessment):
+  """Lists the correct answer of each question of an assessment.
+
+  The server grades submissions with these answers, see models/grading.py; a
+  choice question counts its last correct choice, like the browser does."""
+  answers = []
+  for question in assessment["questionsList"]:
+    if "choices" in question:
+      correct = None
+      for i in range(0, len(question["choices"])):
+        if isinstance(question["choices"][i], dict):
+          correct = i
+      answers.append({"choice": correct})
+    elif "correctAnswerString" in question:
+      answers.append({"string": question["correctAnswerString"]})
+    elif "correctAnswerRegex" in question:
+      answers.append({"regex": question["correctAnswerRegex"]["regex"]})
+    elif "correctAnswerNumeric" in question:
+      answers.append({"numeric": question["correctAnswerNumeric"]})
+    else:
+      answers.append({})
+  return answers
+
+
+def UnitToDict(unit):
+  return {
+      "id": unit.id, "type": str(unit.type), "unit_id": str(unit.unit_id),
+      "title": unit.title, "release_date": str(unit.release_date),
+      "now_available": verify.IsOneOf(
+          unit.now_available, [True, "True", "TRUE", "true"])}
+
+
+def LessonToDict(lesson):
+  return {
+      "unit_id": lesson.unit_id, "id": lesson.lesson_id,
+      "title": lesson.lesson_title, "activity": lesson.lesson_activity,
+      "activity_title": lesson.lesson_activity_name,
+      "notes": lesson.lesson_notes, "slides": lesson.lesson_slides,
+      "video": str(lesson.lesson_video_id),
+      "objectives": lesson.lesson_objectives}
+
+
+def ReadActivity(verifier, fname):
+  return verify.EvaluateJavaScriptExpressionFromFile(
+      fname, "activity", verify.MakeDataScope("activity"),
+      verifier.error)["activity"]
+
+
+def ReadAssessment(verifier, fname):
+  return verify.EvaluateJavaScriptExpressionFromFile(
+      fname, "assessment", verify.MakeDataScope("assessment"),
+      verifier.error)["assessment"]
+
+
+def HashCourseFiles(verifier):
+  return HashContentFiles(
+      [verifier.unit_file, verifier.lesson_file] +
+      verifier.activity_files.values() + verifier.assessment_files.values())
+
+
+def MakeBundle(verifier):
+  """Makes the course bundle from content loaded by a verifier."""
+  bundle = {
+      "units": [], "lessons": [], "activities": {}, "assessments": {},
+      "answer_keys": {}}
+
+  for unit in verifier.units:
+    bundle["units"].append(UnitToDict(unit))
+  for lesson in verifier.lessons:
+    bundle["lessons"].append(LessonToDict(lesson))
+
+  for key, fname in verifier.activity_files.items():
+    bundle["activities"][key] = ReadActivity(verifier, fname)
+  for key, fname in verifier.assessment_files.items():
+    assessment = ReadAssessment(verifier, fname)
+    bundle["assessments"][key] = assessment
+    bundle["answer_keys"][key] = ExtractAnswerKey(assessment)
+
+  bundle["content_hash"] = HashCourseFiles(verifier)
+  return bundle
+
+
+def WriteBundle(fname, bundle):
+  """Writes a header line and the compressed JSON of the bundle."""
+  file = open(fname, "wb")
+  file.write("%s %s %s\n" % (
+      BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, bundle["content_hash"]))
+  file.write(zlib.compress(json.dumps(bundle, separators=(",", ":")), 9))
   file.close()
 
 
-def ExportToFile(fname, lines):
-  date = datetime.utcnow()
-  ExportToJavaScript(fname, lines, date)
-  ExportToPython(fname, lines, date)
-  ExportToPHP(fname, lines, date)
+def ReadBundle(fname):
+  """Reads a bundle made by WriteBundle()."""
+  data = open(fname, "rb").read()
+  header, body = data.split("\n", 1)
+  parts = header.split(" ")
+  if len(parts) != 3 or parts[0] != BUNDLE_MAGIC:
+    raise Exception("Not a course bundle: %s" % fname)
+  if int(parts[1]) != BUNDLE_FORMAT_VERSION:
+    raise Exception("Unsupported course bundle version %s in %s" % (
+        parts[1], fname))
+  return json.loads(zlib.decompress(body))
 
 
-if __name__ == "__main__":
+def ExportToFile(fname, lines, formats=None, date=None):
+  """Writes the export in the given formats, all of them by default.
+
+  The lines are read once, and each one is written to all formats, so lines
+  can be a generator, i.e. GenerateCourseExportLines()."""
+  if formats is None:
+    formats = [name for name, writer in EXPORT_FORMATS]
+  if date is None:
+    date = datetime.utcnow()
+
+  writers = []
+  try:
+    for name, writer in EXPORT_FORMATS:
+      if name in formats:
+        writers.append(writer(fname, date))
+    for line in lines:
+      for writer in writers:
+        writer.Write(line)
+    for writer in writers:
+      writer.End()
+  finally:
+    for writer in writers:
+      writer.Close()
+
+
+def GenerateCourseExportLines(unit_file, lesson_file):
+  """Yields the export code of a course, reading its CSV files as it goes."""
+  return verify.GenerateExportLines(
+      verify.IterObjectsFromCsvFile(
+          unit_file, verify.UNITS_HEADER, verify.Unit),
+      verify.IterObjectsFromCsvFile(
+          lesson_file, verify.LESSONS_HEADER, verify.Lesson))
+
+
+def PackValue(value, out):
+  """Appends the MessagePack encoding of a JSON-like value to a list."""
+  if value is None:
+    out.append("\xc0")
+  elif value is True:
+    out.append("\xc3")
+  elif value is False:
+    out.append("\xc2")
+  elif isinstance(value, (int, long)):
+    if 0 <= value < 0x80:
+      out.append(chr(value))
+    elif -0x20 <= value < 0:
+      out.append(struct.pack(">b", value))
+    elif 0 <= value < 0x100000000:
+      out.append("\xce" + struct.pack(">I", value))
+    elif 0 <= value:
+      out.append("\xcf" + struct.pack(">Q", value))
+    else:
+      out.append("\xd3" + struct.pack(">q", value))
+  elif isinstance(value, float):
+    out.append("\xcb" + struct.pack(">d", value))
+  elif isinstance(value, basestring):
+    if isinstance(value, unicode):
+      value = value.encode("utf8")
+    if len(value) < 0x20:
+      out.append(chr(0xa0 | len(value)))
+    elif len(value) < 0x100:
+      out.append("\xd9" + chr(len(value)))
+    elif len(value) < 0x10000:
+      out.append("\xda" + struct.pack(">H", len(value)))
+    else:
+      out.append("\xdb" + struct.pack(">I", len(value)))
+    out.append(value)
+  elif isinstance(value, (list, tuple)):
+    if len(value) < 0x10:
+      out.append(chr(0x90 | len(value)))
+    else:
+      out.append("\xdd" + struct.pack(">I", len(value)))
+    for item in value:
+      PackValue(item, out)
+  elif isinstance(value, dict):
+    if len(value) < 0x10:
+      out.append(chr(0x80 | len(value)))
+    else:
+      out.append("\xdf" + struct.pack(">I", len(value)))
+    for key in sorted(value.keys()):
+      PackValue(key, out)
+      PackValue(value[key], out)
+  else:
+    raise Exception("Can't pack value of type %s" % type(value))
+
+
+def Pack(value):
+  out = []
+  PackValue(value, out)
+  return "".join(out)
+
+
+# MessagePack type byte -> (struct format, size) of a fixed size value
+UNPACK_FIXED = {
+    "\xca": (">f", 4), "\xcb": (">d", 8), "\xcc": (">B", 1), "\xcd": (">H", 2),
+    "\xce": (">I", 4), "\xcf": (">Q", 8), "\xd0": (">b", 1), "\xd1": (">h", 2),
+    "\xd2": (">i", 4), "\xd3": (">q", 8)}
+
+# MessagePack type byte -> (struct format, size) of the length of a str, an
+# array or a map
+UNPACK_LENGTH = {
+    "\xd9": (">B", 1), "\xda": (">H", 2), "\xdb": (">I", 4),
+    "\xdc": (">H", 2), "\xdd": (">I", 4), "\xde": (">H", 2), "\xdf": (">I", 4)}
+
+
+def UnpackValue(data, offset):
+  """Decodes one MessagePack value; returns (value, offset after it)."""
+  code = data[offset]
+  byte = ord(code)
+  offset += 1
+  if byte < 0x80:
+    return byte, offset
+  if byte >= 0xe0:
+    return byte - 0x100, offset
+  if code == "\xc0":
+    return None, offset
+  if code in ["\xc2", "\xc3"]:
+    return code == "\xc3", offset
+  if code in UNPACK_FIXED:
+    format, size = UNPACK_FIXED[code]
+    return struct.unpack(format, data[offset:offset + size])[0], offset + size
+
+  if code in UNPACK_LENGTH:
+    format, size = UNPACK_LENGTH[code]
+    length = struct.unpack(format, data[offset:offset + size])[0]
+    offset += size
+    kind = {"\xd9": "str", "\xda": "str", "\xdb": "str", "\xdc": "array",
+            "\xdd": "array"}.get(code, "map")
+  elif byte & 0xe0 == 0xa0:
+    kind, length = "str", byte & 0x1f
+  elif byte & 0xf0 == 0x90:
+    kind, length = "array", byte & 0x0f
+  elif byte & 0xf0 == 0x80:
+    kind, length = "map", byte & 0x0f
+  else:
+    raise Exception("Unsupported MessagePack type 0x%02x" % byte)
+
+  if kind == "str":
+    return data[offset:offset + length].decode("utf8"), offset + length
+  if kind == "array":
+    items = []
+    for _ in range(0, length):
+      item, offset = UnpackValue(data, offset)
+      items.append(item)
+    return items, offset
+  items = {}
+  for _ in range(0, length):
+    key, offset = UnpackValue(data, offset)
+    items[key], offset = UnpackValue(data, offset)
+  return items, offset
+
+
+def UnpackValues(data):
+  """Decodes a stream of MessagePack values one by one."""
+  offset = 0
+  while offset < len(data):
+    value, offset = UnpackValue(data, offset)
+    yield value
+
+
+def HashEntity(data):
+  return hashlib.sha1(json.dumps(
+      data, sort_keys=True, separators=(",", ":"))).hexdigest()
+
+
+def GenerateDataRecords(verifier):
+  """Yields a record for each unit, lesson, activity and assessment.
+
+  A record is a dict with the kind of the entity, its key, a hash of its data
+  and the data: a unit or a lesson as in the course bundle, or an activity or
+  an assessment as evaluated by tools/verify.py."""
+  def Record(kind, key, data):
+    return {"kind": kind, "key": str(key), "hash": HashEntity(data),
+            "data": data}
+
+  for unit in verifier.units:
+    yield Record("unit", unit.id, UnitToDict(unit))
+  for lesson in verifier.lessons:
+    yield Record("lesson", "%s.%s" % (lesson.unit_id, lesson.lesson_id),
+                 LessonToDict(lesson))
+  for key, fname in sorted(verifier.activity_files.items()):
+    yield Record("activity", key, ReadActivity(verifier, fname))
+  for key, fname in sorted(verifier.assessment_files.items()):
+    yield Record("assessment", key, ReadAssessment(verifier, fname))
+
+
+class JsonDataWriter(object):
+  """Writes one JSON document: {"header": {...}, "entities": [...]}."""
+
+  EXTENSION = "json"
+
+  def __init__(self, fname, header):
+    self.file = open("%s.%s" % (fname, self.EXTENSION), "wb")
+    self.file.write('{"header":%s,"entities":[' % json.dumps(
+        header, sort_keys=True, separators=(",", ":")))
+    self.count = 0
+
+  def Write(self, record):
+    if self.count:
+      self.file.write(",")
+    self.file.write("\n")
+    self.file.write(json.dumps(record, sort_keys=True, separators=(",", ":")))
+    self.count += 1
+
+  def End(self):
+    self.file.write("\n]}\n")
+
+  def Close(self):
+    self.file.close()
+
+
+class JsonLinesDataWriter(JsonDataWriter):
+  """Writes the header and then each record as one line of JSON."""
+
+  EXTENSION = "jsonl"
+
+  def __init__(self, fname, header):
+    self.file = open("%s.%s" % (fname, self.EXTENSION), "wb")
+    self.Write(header)
+
+  def Write(self, record):
+    self.file.write(json.dumps(record, sort_keys=True, separators=(",", ":")))
+    self.file.write("\n")
+
+  def End(self):
+    pass
+
+
+class MessagePackDataWriter(JsonDataWriter):
+  """Writes the header and then each record as one MessagePack value."""
+
+  EXTENSION = "msgpack"
+
+  def __init__(self, fname, header):
+    self.file = open("%s.%s" % (fname, self.EXTENSION), "wb")
+    self.Write(header)
+
+  def Write(self, record):
+    self.file.write(Pack(record))
+
+  def End(self):
+    pass
+
+
+# data export format name -> writer
+DATA_FORMATS = [
+    ("json", JsonDataWriter), ("jsonl", JsonLinesDataWriter),
+    ("msgpack", MessagePackDataWriter)]
+
+
+def ReadManifest(fname):
+  manifest = json.loads(open(fname, "rb").read())
+  if manifest.get("schema_version") != DATA_SCHEMA_VERSION:
+    raise Exception("Unsupported manifest schema version %s in %s" % (
+        manifest.get("schema_version"), fname))
+  return manifest
+
+
+def ExportData(fname, verifier, formats, previous=None, date=None):
+  """Writes the data export in the given formats and its manifest.
+
+  The manifest lists the hash of each entity. If the manifest of a previous
+  export is given, only new and changed entities are written, and a record
+  {"kind", "key", "deleted": true} for each removed one. Returns the manifest,
+  which always describes the complete course."""
+  if date is None:
+    date = datetime.utcnow()
+  header = {
+      "format": DATA_MAGIC, "schema_version": DATA_SCHEMA_VERSION,
+      "content_hash": HashCourseFiles(verifier), "exported_on": str(date),
+      "delta_of": None}
+  previous_hashes = {}
+  if previous:
+    header["delta_of"] = previous["content_hash"]
+    previous_hashes = previous["entities"]
+
+  manifest = {
+      "schema_version": DATA_SCHEMA_VERSION,
+      "content_hash": header["content_hash"], "entities": {}}
+  writers = []
+  try:
+    for name, writer in DATA_FORMATS:
+      if name in formats:
+        writers.append(writer(fname, header))
+    for record in GenerateDataRecords(verifier):
+      name = "%s:%s" % (record["kind"], record["key"])
+      manifest["entities"][name] = record["hash"]
+      if previous_hashes.get(name) == record["hash"]:
+        continue
+      for writer in writers:
+        writer.Write(record)
+    for name in sorted(previous_hashes.keys()):
+      if not name in manifest["entities"]:
+        kind, key = name.split(":", 1)
+        for writer in writers:
+          writer.Write({"kind": kind, "key": key, "deleted": True})
+    for writer in writers:
+      writer.End()
+  finally:
+    for writer in writers:
+      writer.Close()
+
+  with open("%s.manifest.json" % fname, "wb") as file:
+    file.write(json.dumps(manifest, sort_keys=True, indent=1))
+  return manifest
+
+
+def ReadDataExport(fname):
+  """Reads a data export of any format; returns (header, list of records)."""
+  data = open(fname, "rb").read()
+  if fname.endswith(".msgpack"):
+    values = list(UnpackValues(data))
+  elif fname.endswith(".jsonl"):
+    values = [json.loads(line) for line in data.splitlines() if line]
+  else:
+    document = json.loads(data)
+    values = [document["header"]] + document["entities"]
+  header = values[0]
+  if header.get("format") != DATA_MAGIC:
+    raise Exception("Not a course data export: %s" % fname)
+  if header.get("schema_version") != DATA_SCHEMA_VERSION:
+    raise Exception("Unsupported schema version %s in %s" % (
+        header.get("schema_version"), fname))
+  return header, values[1:]
+
+
+def ParseArgs(argv):
+  parser = optparse.OptionParser(usage="%prog [bundle] [options]")
+  parser.add_option(
+      "--formats", default=",".join([name for name, writer in EXPORT_FORMATS]),
+      help="comma separated export formats: js, py, php as code, or json, "
+      "jsonl, msgpack as data")
+  parser.add_option(
+      "--output", default=os.path.join(os.getcwd(), "coursebuilder_course"),
+      help="name of the exported files, without the extension")
+  parser.add_option(
+      "--since", help="manifest of a previous data export; only export "
+      "entities changed since then")
+  parser.add_option(
+      "--course_folder", help="folder of the course to export; the folder "
+      "tools/ is in by default")
+  options, args = parser.parse_args(argv)
+  options.formats = options.formats.split(",")
+  known = dict(EXPORT_FORMATS + DATA_FORMATS)
+  for name in options.formats:
+    if not name in known:
+      parser.error("Unknown export format: %s" % name)
+  options.bundle = args == ["bundle"]
+  return options
+
+
+def main(argv):
+  options = ParseArgs(argv)
   print "Export started using %s" % os.path.realpath(__file__)
 
-  verifier = verify.Verifier()
+  verifier = verify.Verifier(options.course_folder)
   errors = verifier.LoadAndVerifyModel(Echo)
-  if errors and len(errors) != 0:
+  if errors:
     raise Exception(
         "Please fix all errors reported by tools/verify.py before continuing!")
 
-  fname = os.path.join(os.getcwd(), "coursebuilder_course")
-  ExportToFile(fname, verifier.export)
+  if options.bundle:
+    fname = os.path.join(
+        os.path.dirname(verifier.unit_file), BUNDLE_FILE_NAME)
+    WriteBundle(fname, MakeBundle(verifier))
+  else:
+    fname = options.output
+    date = datetime.utcnow()
+    code_formats = [name for name, writer in EXPORT_FORMATS
+                    if name in options.formats]
+    if code_formats:
+      ExportToFile(fname, GenerateCourseExportLines(
+          verifier.unit_file, verifier.lesson_file), code_formats, date)
+    data_formats = [name for name, writer in DATA_FORMATS
+                    if name in options.formats]
+    if data_formats:
+      previous = None
+      if options.since:
+        previous = ReadManifest(options.since)
+      ExportData(fname, verifier, data_formats, previous, date)
   print "Export complete to %s" % fname
 
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
+
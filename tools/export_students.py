@@ -0,0 +1,369 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Exports students with their scores and answers, in parallel and resumably.
+
+This replaces the Student transformer of bulkloader.yaml. Run the script from
+the root directory of the app with the App Engine SDK in the PYTHONPATH:
+
+    python tools/export_students.py --server=myapp.appspot.com --namespace=ns \\
+        --output=students.jsonl
+
+The output is either JSON Lines, one student per line, which tools/regrade.py
+reads as a --snapshot:
+
+    {"email": "a@example.com", "scores": {"midcourse": 50},
+     "answers": {"midcourse": [["0", "1"], ["1", "define brindle"]]}}
+
+or CSV with --format=csv, where scores and answers are JSON text. Select the
+fields with --fields; reading scores and answers is only needed when they are
+selected.
+
+The Student keys are split into --shards key ranges, and the ranges are read by
+--workers threads at once. Each range is read with one key ordered query of all
+kinds, so each student is followed by its StudentScore and StudentAnswer child
+entities; the query is paged with cursors. Each range is written into its own
+part file, and the end of each part is recorded in the checkpoint file
+<output>.checkpoint after each batch. If the export is interrupted, run the
+same command again to resume it; the part files are merged into the output
+once all ranges are done.
+"""
+
+import csv, json, optparse, os, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+# all fields of a student that can be exported, in the default order
+STUDENT_FIELDS = [
+    "email", "name", "is_enrolled", "enrolled_date", "scores", "answers"]
+
+# the number of random keys sampled for each shard to find the key ranges
+SCATTER_OVERSAMPLING = 32
+
+# version of the checkpoint file; a checkpoint of another version is not used
+CHECKPOINT_VERSION = 1
+
+# a key name above the key names of all students, i.e. their emails
+MAX_KEY_NAME = u"\uffff"
+
+
+def ParseArgs(argv):
+  parser = optparse.OptionParser()
+  parser.add_option("--server", help="host name of the deployed app")
+  parser.add_option("--namespace", default="", help="course namespace")
+  parser.add_option("--output", default="students.jsonl",
+                    help="the file to write")
+  parser.add_option("--format", default="jsonl", help="jsonl or csv")
+  parser.add_option("--fields", default=",".join(STUDENT_FIELDS),
+                    help="comma separated fields: %s" % ", ".join(
+                        STUDENT_FIELDS))
+  parser.add_option("--shards", type="int", default=8,
+                    help="the number of key ranges to split the students in")
+  parser.add_option("--workers", type="int", default=4,
+                    help="the number of key ranges to read at once")
+  parser.add_option("--batch_size", type="int", default=200,
+                    help="the number of entities to read in one batch")
+  options, args = parser.parse_args(argv)
+  options.fields = options.fields.split(",")
+  for name in options.fields:
+    if not name in STUDENT_FIELDS:
+      parser.error("Unknown field: %s" % name)
+  if not options.format in ["jsonl", "csv"]:
+    parser.error("Unknown format: %s" % options.format)
+  options.parser = parser
+  return options
+
+
+def GetShardBoundaries(shards):
+  """Finds key names of students that split them into about equal ranges.
+
+  Samples random keys with the __scatter__ property; if there are too few of
+  them, i.e. in a small datastore, reads all keys instead."""
+  from models.models import Student
+
+  if shards <= 1:
+    return []
+  keys = Student.all(keys_only=True).order("__scatter__").fetch(
+      shards * SCATTER_OVERSAMPLING)
+  if len(keys) < shards * SCATTER_OVERSAMPLING:
+    keys = list(Student.all(keys_only=True).order("__key__").run(
+        batch_size=1000))
+  names = sorted(set([key.name() for key in keys]))
+  step = len(names) / float(shards)
+  return sorted(set([names[int(i * step)] for i in range(1, shards)
+                     if int(i * step) < len(names)]))
+
+
+class Checkpoint(object):
+  """Progress of an export; saved after each batch of each shard."""
+
+  def __init__(self, fname, options):
+    self.fname = fname
+    self.lock = threading.Lock()
+    self.state = None
+    if os.path.exists(fname):
+      state = json.loads(open(fname).read())
+      if (state.get("version") == CHECKPOINT_VERSION and
+          state.get("namespace") == options.namespace and
+          state.get("format") == options.format and
+          state.get("fields") == options.fields):
+        self.state = state
+
+  def Start(self, options, boundaries):
+    """Plans the shards of a new export."""
+    starts = [None] + boundaries
+    ends = boundaries + [None]
+    self.state = {
+        "version": CHECKPOINT_VERSION, "namespace": options.namespace,
+        "format": options.format, "fields": options.fields, "shards": [
+            {"start": starts[i], "end": ends[i], "after": None,
+             "part_size": 0, "students": 0, "done": False}
+            for i in range(0, len(starts))]}
+    self.Save()
+
+  def Update(self, index, **values):
+    """Records the progress of a shard and saves the checkpoint."""
+    with self.lock:
+      self.state["shards"][index].update(values)
+    self.Save()
+
+  def Save(self):
+    with self.lock:
+      data = json.dumps(self.state, sort_keys=True, indent=1)
+      with open(self.fname + ".tmp", "w") as file:
+        file.write(data)
+      os.rename(self.fname + ".tmp", self.fname)
+
+
+def MakeStudentRecord(student, fields):
+  """Starts the exported record of a Student entity."""
+  record = {}
+  for name in fields:
+    if name == "email":
+      record[name] = student.key().name()
+    elif name == "enrolled_date":
+      record[name] = student.enrolled_date and student.enrolled_date.strftime(
+          "%Y-%m-%d %H:%M:%S")
+    elif name == "scores":
+      record[name] = dict(student.get_json_dict("scores"))
+    elif name == "answers":
+      record[name] = dict(student.get_json_dict("answers"))
+    else:
+      record[name] = getattr(student, name)
+  return record
+
+
+def AddChildEntity(record, entity):
+  """Adds a StudentScore or StudentAnswer to the record of its parent."""
+  kind = entity.kind()
+  if kind == "StudentScore" and "scores" in record:
+    record["scores"][entity.key().name()] = entity.score
+  elif kind == "StudentAnswer" and "answers" in record:
+    record["answers"][entity.key().name()] = entity.answer
+
+
+def FormatRecord(record, options):
+  """Formats an exported record as one line of the output."""
+  if options.format == "jsonl":
+    return json.dumps(record, sort_keys=True) + "\n"
+  row = []
+  for name in options.fields:
+    value = record.get(name)
+    if isinstance(value, dict):
+      value = json.dumps(value, sort_keys=True)
+    elif isinstance(value, unicode):
+      value = value.encode("utf8")
+    elif value is None:
+      value = ""
+    row.append(value)
+  line = []
+  csv.writer(FileLines(line)).writerow(row)
+  return "".join(line)
+
+
+class FileLines(object):
+  """A file-like list of the strings written to it."""
+
+  def __init__(self, lines):
+    self.lines = lines
+
+  def write(self, text):
+    self.lines.append(text)
+
+
+def GetShardQuery(options, shard):
+  """Makes a key ordered query of the students of a shard, and their data."""
+  from google.appengine.ext import db
+  from models.models import Student
+
+  if "scores" in options.fields or "answers" in options.fields:
+    query = db.Query()
+  else:
+    query = Student.all()
+  if shard["after"] is not None:
+    query.filter("__key__ >", db.Key.from_path("Student", shard["after"]))
+  elif shard["start"] is not None:
+    query.filter("__key__ >=", db.Key.from_path("Student", shard["start"]))
+  else:
+    query.filter("__key__ >=", db.Key.from_path("Student", 1))
+  query.filter("__key__ <", db.Key.from_path(
+      "Student", shard["end"] or MAX_KEY_NAME))
+  return query.order("__key__")
+
+
+def GetRootKey(key):
+  while key.parent():
+    key = key.parent()
+  return key
+
+
+def ExportShard(options, checkpoint, index, max_batches=None):
+  """Exports the students of one shard into its part file.
+
+  A student is written once all of its child entities were read, so the last
+  student of a batch is kept until the next batch. After each batch the part
+  file and the checkpoint record the last student written."""
+  shard = dict(checkpoint.state["shards"][index])
+  if shard["done"]:
+    return
+
+  fname = "%s.part%03d" % (options.output, index)
+  file = open(fname, "ab")
+  try:
+    # drop anything written after the last checkpoint
+    file.truncate(shard["part_size"])
+    file.seek(shard["part_size"])
+
+    query = GetShardQuery(options, shard)
+    cursor = None
+    record = None
+    batches = 0
+    while max_batches is None or batches < max_batches:
+      if cursor:
+        query.with_cursor(cursor)
+      entities = query.fetch(options.batch_size)
+      cursor = query.cursor()
+      batches += 1
+
+      lines = []
+      last = shard["after"]
+      done = len(entities) < options.batch_size
+      for entity in entities:
+        root = GetRootKey(entity.key())
+        if root.kind() != "Student" or root.name() is None:
+          done = True
+          break
+        if root.name() == shard["after"]:
+          continue
+        if entity.kind() == "Student":
+          if record:
+            lines.append(FormatRecord(record, options))
+            last = record["email"]
+          record = MakeStudentRecord(entity, options.fields + ["email"])
+        elif record and root.name() == record["email"]:
+          AddChildEntity(record, entity)
+      if done and record:
+        lines.append(FormatRecord(record, options))
+        last = record["email"]
+        record = None
+
+      file.write("".join(lines))
+      file.flush()
+      os.fsync(file.fileno())
+      checkpoint.Update(
+          index, part_size=file.tell(), after=last, done=done,
+          students=shard["students"] + len(lines))
+      shard = dict(checkpoint.state["shards"][index])
+      if done:
+        break
+  finally:
+    file.close()
+
+
+def MergeParts(options, checkpoint):
+  """Writes the output from the part files of all shards; removes them."""
+  with open(options.output + ".tmp", "wb") as output:
+    if options.format == "csv":
+      csv.writer(output).writerow(options.fields)
+    for index in range(0, len(checkpoint.state["shards"])):
+      fname = "%s.part%03d" % (options.output, index)
+      if os.path.exists(fname):
+        with open(fname, "rb") as part:
+          for line in part:
+            output.write(line)
+  os.rename(options.output + ".tmp", options.output)
+  for index in range(0, len(checkpoint.state["shards"])):
+    fname = "%s.part%03d" % (options.output, index)
+    if os.path.exists(fname):
+      os.remove(fname)
+  os.remove(checkpoint.fname)
+
+
+def ExportStudents(options):
+  """Exports all students of a namespace; resumes an interrupted export."""
+  from google.appengine.api import namespace_manager
+
+  namespace_manager.set_namespace(options.namespace)
+  start = time.time()
+  checkpoint = Checkpoint(options.output + ".checkpoint", options)
+  if checkpoint.state:
+    print >> sys.stderr, "Resuming the export from %s" % checkpoint.fname
+  else:
+    checkpoint.Start(options, GetShardBoundaries(options.shards))
+
+  pending = range(0, len(checkpoint.state["shards"]))
+  pending_lock = threading.Lock()
+  errors = []
+
+  def Work():
+    namespace_manager.set_namespace(options.namespace)
+    while True:
+      with pending_lock:
+        if not pending or errors:
+          return
+        index = pending.pop(0)
+      try:
+        ExportShard(options, checkpoint, index)
+      except Exception as e:
+        errors.append(e)
+        raise
+
+  workers = [threading.Thread(target=Work)
+             for i in range(0, max(1, options.workers))]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  if errors:
+    raise Exception("Export interrupted, run again to resume: %s" % errors[0])
+
+  count = sum([shard["students"] for shard in checkpoint.state["shards"]])
+  MergeParts(options, checkpoint)
+  print >> sys.stderr, "Exported %s students in %.1fs to %s" % (
+      count, time.time() - start, options.output)
+  return count
+
+
+def main(argv):
+  options = ParseArgs(argv)
+  if not options.server:
+    options.parser.error("Expected --server.")
+  from regrade import ConnectToServer
+  ConnectToServer(options.server)
+  ExportStudents(options)
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,404 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Regrades stored assessment answers against the current answer keys.
+
+Run this script after fixing an answer key in assets/js/assessment-*.js; it
+recomputes the scores of all students and their overall score.
+
+Here is how to use the script:
+     - migrate legacy students first by visiting /admin/migrate_students
+     - regrade all students of a deployed course over remote_api; run the
+       script from the root directory of the app with the App Engine SDK in
+       the PYTHONPATH:
+
+         python tools/regrade.py --server=myapp.appspot.com --namespace=ns
+
+     - or regrade an exported snapshot, a file with one student per line:
+
+         {"email": "a@example.com", "scores": {"midcourse": 50},
+          "answers": {"midcourse": [["0", "1"], ["1", "define brindle"]]}}
+
+         python tools/regrade.py --snapshot=students.jsonl > changed.jsonl
+
+       the output lists the changed scores of each changed student
+
+To only recompute the overall scores, i.e. after changing the weights of the
+assessments in data/grading.json, add --overall_only. All component scores
+are then loaded into NumPy arrays and the overall scores and pass/fail of all
+students are recomputed in one vectorized pass; only the overall scores that
+change are written back. The writes are idempotent, so rerun an interrupted
+recompute to resume it.
+
+Answers are graded in a pool of worker processes and changed scores are
+written back in one batch per --batch_size answers. Each progress line ends
+with a cursor; pass it as --cursor to resume an interrupted run. Answers saved
+by earlier versions of activity-generic.js hold no responses and are skipped.
+Like a new attempt, a regraded answer only raises a score. Only the latest
+answer to each assessment is stored, so a lower grade may belong to a later,
+worse attempt; add --overwrite to replace scores with the grades of the latest
+answers anyway, i.e. after an answer key that accepted wrong responses was
+fixed. Scores written by students during the run may be overwritten, so run it
+when no assessment is open.
+"""
+
+import json, multiprocessing, optparse, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from models import grading
+
+
+ASSESSMENTS_FOLDER = os.path.join(
+    os.path.dirname(__file__), "..", "assets", "js")
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), "..", "data")
+
+# answer keys of the assessments; set in each worker process
+answer_keys = None
+
+
+def ParseArgs(argv):
+  parser = optparse.OptionParser()
+  parser.add_option("--server", help="host name of the deployed app")
+  parser.add_option("--namespace", default="", help="course namespace")
+  parser.add_option("--snapshot", help="regrade this file, not the datastore")
+  parser.add_option("--cursor", help="resume after this cursor")
+  parser.add_option("--batch_size", type="int", default=500)
+  parser.add_option("--workers", type="int", default=multiprocessing.cpu_count())
+  parser.add_option("--dry_run", action="store_true", default=False,
+                    help="report changes, but do not write them")
+  parser.add_option("--overwrite", action="store_true", default=False,
+                    help="also lower scores that regrading lowers")
+  parser.add_option("--overall_only", action="store_true", default=False,
+                    help="only recompute overall scores, in NumPy")
+  parser.add_option("--data_folder", default=DATA_FOLDER,
+                    help="folder with grading.json of the course")
+  options, args = parser.parse_args(argv)
+  if bool(options.server) == bool(options.snapshot):
+    parser.error("Expected either --server or --snapshot.")
+  return options
+
+
+def InitWorker(folder):
+  global answer_keys
+  answer_keys = grading.load_answer_keys(folder)
+
+
+def RegradeAnswers(items):
+  """Grades a list of (email, assessment type, answer) in a worker process.
+
+  An answer is either a list of [question index, response] pairs, its
+  encoded form from StudentAnswer.data or the JSON text of all form fields
+  stored by earlier versions. Returns (email, assessment type, score) of all
+  answers that can be graded."""
+  results = []
+  for email, assessment_type, answer in items:
+    answer_key = answer_keys.get(assessment_type)
+    if not answer_key:
+      continue
+    if isinstance(answer, str):
+      from models.models import decode_answer
+      answer = decode_answer(answer)
+    answer = grading.get_responses(answer)
+    if grading.is_legacy_answer(answer):
+      continue
+    results.append((email, assessment_type, answer_key.score(answer)))
+  return results
+
+
+def Regrade(pool, items, workers):
+  """Grades items in parallel; returns a dict of email -> {type: score}."""
+  size = max(1, len(items) / (workers * 4))
+  chunks = [items[i:i + size] for i in range(0, len(items), size)]
+  regraded = {}
+  for results in pool.imap_unordered(RegradeAnswers, chunks):
+    for email, assessment_type, score in results:
+      regraded.setdefault(email, {})[assessment_type] = score
+  return regraded
+
+
+def GetChangedScores(scores, regraded, policy, overwrite=False):
+  """Returns the scores of a student that regrading changes.
+
+  A regraded score only replaces a higher stored score if overwrite is set,
+  just like a new attempt only replaces a lower score."""
+  new_scores = dict(scores)
+  for name, score in regraded.items():
+    if (overwrite or scores.get(name) is None or
+        score > int(scores[name])):
+      new_scores[name] = score
+  if "postcourse" in new_scores:
+    new_scores["overall_score"] = policy.get_overall_score(new_scores)
+
+  changed = {}
+  for name, score in new_scores.items():
+    if scores.get(name) is None or int(scores[name]) != score:
+      changed[name] = score
+  return changed
+
+
+class Progress(object):
+  """Counts answers and changes; reports throughput."""
+
+  def __init__(self):
+    self.start = time.time()
+    self.answers = 0
+    self.changed = 0
+
+  def Report(self, cursor=None):
+    elapsed = max(time.time() - self.start, 0.001)
+    line = ("Regraded %s answers in %.1fs (%.0f answers/s), changed %s "
+            "students" % (self.answers, elapsed, self.answers / elapsed,
+                          self.changed))
+    if cursor:
+      line += "; cursor: %s" % cursor
+    print >> sys.stderr, line
+
+
+def ConnectToServer(server):
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+
+  import getpass
+  from google.appengine.ext.remote_api import remote_api_stub
+  def Auth():
+    return raw_input("Email: "), getpass.getpass("Password: ")
+  remote_api_stub.ConfigureRemoteApi(None, "/remote_api", Auth, server)
+
+
+def RegradeDatastore(options, pool):
+  """Regrades all StudentAnswer entities of a namespace in key order."""
+  from google.appengine.api import namespace_manager
+  from google.appengine.ext import db
+  from models.models import StudentAnswer, StudentScore
+
+  namespace_manager.set_namespace(options.namespace)
+  progress = Progress()
+  cursor = options.cursor
+  while True:
+    query = StudentAnswer.all().order("__key__")
+    if cursor:
+      query.with_cursor(cursor)
+    answers = query.fetch(options.batch_size)
+    if not answers:
+      break
+    cursor = query.cursor()
+
+    regraded = Regrade(pool, [
+        (answer.parent_key().name(), answer.key().name(), answer.data)
+        for answer in answers], options.workers)
+
+    # read all scores the regraded scores and the overall score depend on
+    keys = []
+    for email, scores in regraded.items():
+      names = set(scores.keys() + ["overall_score"] +
+                  [name for name, weight in options.policy.weights])
+      for name in names:
+        keys.append(db.Key.from_path(
+            "Student", email, "StudentScore", name))
+    stored = {}
+    for key, entity in zip(keys, db.get(keys)):
+      if entity:
+        stored.setdefault(key.parent().name(), {})[key.name()] = entity.score
+
+    entities = []
+    for email, scores in regraded.items():
+      changed = GetChangedScores(
+          stored.get(email, {}), scores, options.policy, options.overwrite)
+      if changed:
+        progress.changed += 1
+      for name, score in changed.items():
+        entities.append(StudentScore(
+            parent=db.Key.from_path("Student", email), key_name=name,
+            assessment_type=name, score=score))
+    if entities and not options.dry_run:
+      db.put(entities)
+
+    progress.answers += len(answers)
+    progress.Report(cursor)
+  progress.Report()
+
+
+def ReadSnapshot(fname, start):
+  """Reads students from a snapshot file, skipping the first 'start' ones."""
+  for i, line in enumerate(open(fname)):
+    if i >= start and line.strip():
+      yield i + 1, json.loads(line)
+
+
+def RegradeSnapshot(options, pool):
+  """Regrades students of a snapshot file; prints their changed scores."""
+  progress = Progress()
+  students = ReadSnapshot(options.snapshot, int(options.cursor or 0))
+  while True:
+    batch = []
+    items = []
+    for position, student in students:
+      batch.append(student)
+      for name, answer in student.get("answers", {}).items():
+        items.append((student["email"], name, answer))
+      if len(items) >= options.batch_size:
+        break
+    if not batch:
+      break
+
+    regraded = Regrade(pool, items, options.workers)
+    for student in batch:
+      changed = GetChangedScores(
+          student.get("scores", {}), regraded.get(student["email"], {}),
+          options.policy, options.overwrite)
+      if changed:
+        progress.changed += 1
+        print json.dumps({"email": student["email"], "scores": changed})
+
+    progress.answers += len(items)
+    progress.Report(position)
+  progress.Report()
+
+
+def GetComponentNames(policy):
+  """Names of the scores the overall score is computed from."""
+  return sorted(set([name for name, weight in policy.weights] +
+                    ["postcourse"]))
+
+
+def RecomputeOverallScores(policy, components, overall):
+  """Recomputes the overall scores of many students in one vectorized pass.
+
+  Computes exactly what GradingPolicy.get_overall_score() does for each
+  student, and only for students who have a 'postcourse' score, just like
+  storeAssessmentData().
+
+  Args:
+    policy: the GradingPolicy
+    components: dict of name -> float array of the scores of all students,
+        one student per row, NaN where the student has no such score
+    overall: float array of stored overall scores, NaN where none
+
+  Returns:
+    (overall scores, rows that changed, rows that pass), all arrays
+  """
+  import numpy
+
+  total = numpy.zeros(len(overall))
+  for name, weight in policy.weights:
+    total += weight * numpy.nan_to_num(components[name])
+  new_overall = total.astype(numpy.int64)
+
+  eligible = ~numpy.isnan(components["postcourse"])
+  changed = eligible & (numpy.isnan(overall) | (overall != new_overall))
+  passing = eligible & (new_overall >= policy.passing_score)
+  return new_overall, changed, passing
+
+
+def MakeScoreArrays(emails, scores, names):
+  """Lays out a dict of email -> {name: score} as arrays of students."""
+  import numpy
+
+  columns = {}
+  for name in names + ["overall_score"]:
+    column = numpy.empty(len(emails))
+    column.fill(numpy.nan)
+    for i in range(0, len(emails)):
+      score = scores[emails[i]].get(name)
+      if score is not None:
+        column[i] = int(score)
+    columns[name] = column
+  return columns
+
+
+def ReportRecompute(progress, passing, changed, count):
+  print >> sys.stderr, (
+      "Recomputed %s overall scores in %.1fs, %s changed, %s passing" % (
+          count, time.time() - progress.start, changed.sum(), passing.sum()))
+
+
+def RecomputeDatastore(options):
+  """Recomputes overall scores of all students of a namespace."""
+  from google.appengine.api import namespace_manager
+  from google.appengine.ext import db
+  from models.models import StudentScore
+
+  namespace_manager.set_namespace(options.namespace)
+  progress = Progress()
+
+  # stream the scores of each component; StudentScore is indexed by type
+  names = GetComponentNames(options.policy)
+  scores = {}
+  for name in names + ["overall_score"]:
+    query = StudentScore.all().filter("assessment_type =", name)
+    for entity in query.run(batch_size=options.batch_size):
+      scores.setdefault(entity.parent_key().name(), {})[name] = entity.score
+  emails = sorted(scores.keys())
+
+  columns = MakeScoreArrays(emails, scores, names)
+  overall, changed, passing = RecomputeOverallScores(
+      options.policy, columns, columns.pop("overall_score"))
+
+  entities = []
+  for i in changed.nonzero()[0]:
+    entities.append(StudentScore(
+        parent=db.Key.from_path("Student", emails[i]),
+        key_name="overall_score", assessment_type="overall_score",
+        score=int(overall[i])))
+  if not options.dry_run:
+    for i in range(0, len(entities), options.batch_size):
+      db.put(entities[i:i + options.batch_size])
+  ReportRecompute(progress, passing, changed, len(emails))
+
+
+def RecomputeSnapshot(options):
+  """Recomputes overall scores of a snapshot; prints the changed ones."""
+  progress = Progress()
+  scores = {}
+  for position, student in ReadSnapshot(options.snapshot, 0):
+    scores[student["email"]] = student.get("scores", {})
+  emails = sorted(scores.keys())
+
+  names = GetComponentNames(options.policy)
+  columns = MakeScoreArrays(emails, scores, names)
+  overall, changed, passing = RecomputeOverallScores(
+      options.policy, columns, columns.pop("overall_score"))
+  for i in changed.nonzero()[0]:
+    print json.dumps({
+        "email": emails[i], "scores": {"overall_score": int(overall[i])}})
+  ReportRecompute(progress, passing, changed, len(emails))
+
+
+def main(argv):
+  options = ParseArgs(argv)
+  options.policy = grading.GradingPolicy.load(options.data_folder)
+  if options.server:
+    ConnectToServer(options.server)
+
+  if options.overall_only:
+    if options.server:
+      RecomputeDatastore(options)
+    else:
+      RecomputeSnapshot(options)
+    return
+
+  pool = multiprocessing.Pool(
+      options.workers, InitWorker, (ASSESSMENTS_FOLDER,))
+  try:
+    if options.server:
+      RegradeDatastore(options, pool)
+    else:
+      RegradeSnapshot(options, pool)
+  finally:
+    pool.close()
+    pool.join()
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -29,13 +29,25 @@ Here is how to use the script:
        directory of the app and then typing "python tools/verify.py"
      - review the report printed to the console for errors and warnings
 
+The results of verifying activity and assessment files are kept in the
+data/.verify_cache.json file; the files that have not changed since the last
+run are not verified again, and their results are reported from the cache.
+Type "python tools/verify.py --no_cache" to verify all files. Add "--jobs=4"
+to verify the activity and assessment files in four processes at once; the
+report is the same as the one of a serial run.
+
 Good luck!
 """
 
+import collections
 import csv
+import hashlib
+import json
+import optparse
 import os
 import re
 import sys
+import time
 
 
 BOOLEAN = object()
@@ -84,7 +96,8 @@ UNITS_HEADER = (
     "id,type,unit_id,title,release_date,now_available")
 LESSONS_HEADER = (
     "unit_id,unit_title,lesson_id,lesson_title,lesson_activity,"
-    "lesson_activity_name,lesson_notes,lesson_video_id,lesson_objectives")
+    "lesson_activity_name,lesson_notes,lesson_slides,lesson_video_id,"
+    "lesson_objectives")
 
 NO_VERIFY_TAG_NAME_OPEN = "<gcb-no-verify>"
 NO_VERIFY_TAG_NAME_CLOSE = "</gcb-no-verify>"
@@ -92,6 +105,14 @@ NO_VERIFY_TAG_NAME_CLOSE = "</gcb-no-verify>"
 OUTPUT_FINE_LOG = False
 OUTPUT_DEBUG_LOG = False
 
+# the number of the last elements visited by SchemaHelper kept in its parse log
+PARSE_LOG_SIZE = 1000
+
+# version of the verification cache; bump it when the format of the cache or
+# the meaning of a cached result changes
+VERIFY_CACHE_VERSION = 1
+VERIFY_CACHE_FILE_NAME = ".verify_cache.json"
+
 
 class SchemaException(Exception):
   """A class to represent a schema error."""
@@ -149,54 +170,85 @@ class SchemaException(Exception):
 
 
 class Context(object):
-  """"A class that manages a stack of traversal contexts."""
+  """"A class that manages a stack of traversal contexts.
 
-  def __init__(self):
-    self.parent = None
-    self.path = ["/"]
+  The path of a context is a tuple of the path of its parent and a name, so
+  a new context shares the path of its parent rather than copying it; the
+  path is only formatted when needed."""
+
+  def __init__(self, path=(None, "")):
+    self.path = path
 
   def New(self, names):
     """"Derives a new context from the current one."""
 
-    context = Context()
-    context.parent = self
-    context.path = list(self.path)
+    path = self.path
     if names:
       if isinstance(names, list):
         for name in names:
           if name:
-            context.path.append("/" + "%s" % name)
+            path = (path, name)
       else:
-        context.path.append("/" + "%s" % names)
-    return context
+        path = (path, names)
+    return Context(path)
 
   def FormatPath(self):
     """"Formats the canonical name of this context."""
 
-    return "".join(self.path)
+    return FormatContextPath(self.path)
+
+
+def FormatContextPath(path):
+  names = []
+  while path:
+    path, name = path
+    names.append("/%s" % name)
+  names.reverse()
+  return "".join(names)
 
 
 class SchemaHelper(object):
-  """A class that knows how to apply the schema."""
+  """A class that knows how to apply the schema.
+
+  The parse log keeps the last PARSE_LOG_SIZE elements visited, as raw
+  (kind, type, path, value) records; they are only formatted if the log is
+  read, i.e. to report an error."""
 
   def __init__(self):
     self.type_stats = {}
+    self.ResetParseLog()
+
+  def ResetParseLog(self):
+    self.parse_records = collections.deque(maxlen=PARSE_LOG_SIZE)
+    self.parse_record_count = 0
+
+  @property
+  def parse_log(self):
+    """The parse log formatted as a list of lines."""
+    lines = []
+    omitted = self.parse_record_count - len(self.parse_records)
+    if omitted:
+      lines.append("  ... %s earlier elements not logged" % omitted)
+    for kind, atype, path, value in self.parse_records:
+      if kind == "TERMINAL":
+        lines.append("  TERMINAL: %s %s = %s" % (
+            atype, FormatContextPath(path), value))
+      elif kind == "NON-TERMINAL":
+        lines.append("  NON-TERMINAL: %s %s" % (
+            atype, FormatContextPath(path)))
+      else:
+        lines.append("  ROOT %s" % FormatContextPath(path))
+    return lines
 
   def VisitElement(self, atype, value, context, is_terminal=True):
     """"This method is called once for each schema element being traversed."""
 
-    if self.type_stats.has_key(atype):
-      count = self.type_stats[atype]
-    else:
-      count = 0
-    self.type_stats[atype] = count + 1
-
+    self.type_stats[atype] = self.type_stats.get(atype, 0) + 1
+    self.parse_record_count += 1
     if is_terminal:
-      self.parse_log.append("  TERMINAL: %s %s = %s" % (
-          atype, context.FormatPath(), value))
+      self.parse_records.append(("TERMINAL", atype, context.path, value))
     else:
-      self.parse_log.append("  NON-TERMINAL: %s %s" % (
-          atype, context.FormatPath()))
+      self.parse_records.append(("NON-TERMINAL", atype, context.path, None))
 
   def ExtractAllTermsToDepth(self, key, values, type_map):
     """Walks schema recursively and creates a list of all known terms."""
@@ -247,283 +299,340 @@ class SchemaHelper(object):
         selector.update({akey: avalue})
     return selector
 
-  def FindCompatibleDict(self, value_map, type_map, context):
-    """Find the type map most compatible with the value map."""
+  def CheckValueOfValidType(self, value, types, context):
+    """Checks if a value matches the types; raises SchemaException if not."""
 
-    """"A value map is considered compatible with a type map when former
-    contains the same key names and the value types as the type map."""
+    error = GetSchemaValidator(types)(self, value, context)
+    if error is not None:
+      raise error
 
-    # special case when we have just one type; check name and type are the same
-    if len(type_map) == 1:
-      for value_key in value_map.keys():
-        for key in type_map[0].keys():
-          if value_key == key: return key, type_map[0]
-      raise SchemaException(
-          "Expected: '%s'\nfound: %s", type_map[0].keys()[0], value_map)
-
-    # case when we have several types to choose from
-    for adict in type_map:
-      dict_selector = self.FindSelectors(adict)
-      for akey, avalue in dict_selector.items():
-        if value_map[akey] == avalue: return akey, adict
-    return None, None
-
-  def CheckSingleValueMatchesType(self, value, atype, context):
-    """Checks if a single value matches a specific (primitive) type."""
-
-    if atype == BOOLEAN:
-      if (value == "True") or (value == "False") or (value == "true") or (
-          value == "false") or (isinstance(value, bool)) or value == BOOLEAN:
-        self.VisitElement("BOOLEAN", value, context)
-        return True
-      else:
-        raise SchemaException("Expected: 'true' or 'false'\nfound: %s", value)
-    if isinstance(atype, str):
-      if isinstance(value, str):
-        self.VisitElement("str", value, context)
-        return True
-      else:
-        raise SchemaException("Expected: 'string'\nfound: %s", value)
-    if atype == STRING:
-      if isinstance(value, str):
-        self.VisitElement("STRING", value, context)
-        return True
-      else:
-        raise SchemaException("Expected: 'string'\nfound: %s", value)
-    if atype == REGEX and value == REGEX:
-      self.VisitElement("REGEX", value, context)
-      return True
-    if atype == CORRECT and value == CORRECT:
-      self.VisitElement("CORRECT", value, context)
-      return True
-    if atype == FLOAT:
-      if IsNumber(value):
-        self.VisitElement("NUMBER", value, context)
-        return True
-      else:
-        raise SchemaException("Expected: 'number'\nfound: %s", value)
-    if atype == INTEGER:
-      if IsInteger(value):
-        self.VisitElement("INTEGER", value, context)
-        return True
-      else:
-        raise SchemaException(
-            "Expected: 'integer'\nfound: %s", value, path=context.FormatPath())
-    raise SchemaException(
-        "Unexpected value '%s'\n"
-        "for type %s", value, atype, path=context.FormatPath())
-
-  def CheckValueListMatchesType(self, value, atype, context):
-    """Checks if all items in value list match a specific type."""
-
-    for value_item in value:
-      found = False
-      for atype_item in atype:
-        if isinstance(atype_item, list):
-          for atype_item_item in atype_item:
-            if self.DoesValueMatchType(value_item, atype_item_item, context):
-              found = True
-              break
-        else:
-          if self.DoesValueMatchType(value_item, atype_item, context):
-            found = True
-            break
-      if not found:
-        raise SchemaException("Expected: '%s'\nfound: %s", atype, value)
-    return True
-
-  def CheckValueMatchesType(self, value, atype, context):
-    """Checks if single value or a list of values match a specific type."""
-
-    if isinstance(atype, list) and isinstance(value, list):
-      return self.CheckValueListMatchesType(value, atype, context)
-    else:
-      return self.CheckSingleValueMatchesType(value, atype, context)
-
-  def DoesValueMatchType(self, value, atype, context):
-    """Same as other method, but does not throw an exception."""
+  def CheckInstancesMatchSchema(self, values, types, name):
+    """Recursively decomposes 'values' to see if they match schema (types)."""
 
-    try:
-      return self.CheckValueMatchesType(value, atype, context)
-    except SchemaException:
-      return False
+    self.ResetParseLog()
+    context = Context().New(name)
+    self.parse_record_count += 1
+    self.parse_records.append(("ROOT", None, context.path, None))
 
-  def DoesValueMatchesOneOfTypes(self, value, types, context):
-    """Checks if a value matches to one of the types in the list."""
+    # handle {..} containers
+    if isinstance(types, dict):
+      if not isinstance(values, dict):
+        raise SchemaException("Error at '/': expected {...}, found %s" % (
+            values.__class_.__name__))
+      self.CheckValueOfValidType(values, types, context.New([]))
+      return
 
-    type_names = None
+    # handle [...] containers
     if isinstance(types, list):
-      type_names = types
-    if type_names:
-      for i in range(0, len(type_names)):
-        if self.DoesValueMatchType(value, type_names[i], context):
-          return True
-
-    return False
+      if not isinstance(values, list):
+        raise SchemaException("Error at '/': expected [...], found %s" % (
+            values.__class_.__name__))
+      for i in range(0, len(values)):
+        self.CheckValueOfValidType(
+            values[i], types, context.New("[%s]" % i))
+      return
 
-  def DoesValueMatchMapOfType(self, value, types, context):
-    """Checks if value matches any variation of {...} type."""
+    raise SchemaException(
+        "Expected an array or a dictionary.", None, path=context.FormatPath())
 
-    # find all possible map types
-    maps = []
-    for atype in types:
-      if isinstance(atype, dict): maps.append(atype)
-    if len(maps) == 0 and isinstance(types, dict):
-      maps.append(types)
 
-    # check if the structure of value matches one of the maps
-    if isinstance(value, dict):
-      aname, adict = self.FindCompatibleDict(value, maps, context)
-      if adict:
-        self.VisitElement("dict", value, context.New(aname), False)
-        for akey, avalue in value.items():
-          if not adict.has_key(akey):
-            raise SchemaException(
-                "Unknown term '%s'", akey, path=context.FormatPath())
-          self.CheckValueOfValidType(
-              avalue, adict[akey], context.New([aname, akey]))
-        return True
-      raise SchemaException(
-          "The value:\n  %s\n"
-          "is incompatible with expected type(s):\n  %s",
-          value, types, path=context.FormatPath())
+# id of a schema type -> (the type, its validator); the type is kept, so that
+# its id is not reused
+COMPILED_SCHEMAS = {}
 
-    return False
 
-  def FormatNameWithIndex(self, alist, aindex):
-    """custom function to format a context name with an array element index."""
+def GetSchemaValidator(types):
+  """Returns the validator of a schema type; compiles it once."""
+  compiled = COMPILED_SCHEMAS.get(id(types))
+  if compiled is None:
+    compiled = (types, CompileSchema(types))
+    COMPILED_SCHEMAS[id(types)] = compiled
+  return compiled[1]
 
-    if len(alist) == 1:
-      return ""
-    else:
-      return "[%s]" % aindex
 
-  def DoesValueMatchListOfTypesInOrder(self, value, types, context, target):
-    """Iterates the value and the types in given order and checks for match."""
+def NewSchemaException(*args, **kwargs):
+  """Makes a SchemaException that a validator returns rather than raises.
 
-    all_values_are_lists = True
-    for avalue in value:
-      if not isinstance(avalue, list):
-        all_values_are_lists = False
+  The message of some exceptions fails to format, i.e. for some empty values;
+  the error of formatting is returned instead."""
+  try:
+    return SchemaException(*args, **kwargs)
+  except Exception as e:
+    return e
 
-    if all_values_are_lists:
-      for i in range(0, len(value)):
-        self.CheckValueOfValidType(value[i], types, context.New(
-            self.FormatNameWithIndex(value, i)), True)
-    else:
-      if len(target) != len(value):
-        raise SchemaException(
-            "Expected: '%s' values\n" + "found: %s." % value,
-            len(target), path=context.FormatPath())
-      for i in range(0, len(value)):
-        self.CheckValueOfValidType(value[i], target[i], context.New(
-            self.FormatNameWithIndex(value, i)))
 
-    return True
+def FormatNameWithIndex(alist, aindex):
+  """Formats a context name with an array element index."""
 
-  def DoesValueMatchListOfTypesAnyOrder(self, value, types, context, lists):
-    """Iterates the value and types and checks if they match in any order."""
+  if len(alist) == 1:
+    return ""
+  else:
+    return "[%s]" % aindex
 
-    target = lists
-    if len(target) == 0:
-      if not isinstance(types, list):
-        raise SchemaException(
-            "Unsupported type %s",
-            None, types, path=context.FormatPath())
-      target = types
 
-    for i in range(0, len(value)):
-      found = False
-      for atarget in target:
-        try:
-          self.CheckValueOfValidType(value[i], atarget, context.New(
-              self.FormatNameWithIndex(value, i)))
-          found = True
-          break
-        except:
-          continue
+def CompileSchema(types):
+  """Compiles a schema type into a validator function.
 
-      if not found:
-        raise SchemaException(
-            "The value:\n  %s\n"
-            "is incompatible with expected type(s):\n  %s",
-            value, types, path=context.FormatPath())
-    return True
+  A validator is called as validator(schema_helper, value, context). It visits
+  the elements of the value with the schema_helper and returns None if the
+  value matches the type, or the exception to raise if it does not. So the
+  alternatives of a type are tried without raising exceptions.
 
-  def DoesValueMatchListOfType(self, value, types, context, in_order):
-    """Checks if a value matches a variation of [...] type."""
+  All the decisions that depend only on the type, like which alternative maps
+  and lists a type has and which selectors tell its maps apart, are made here
+  once; the checks are made in the same order and report the same errors as
+  when the schema was interpreted for each value."""
 
-    """Extra argument controls whether matching must be done in a specific or
-    in any order. A specific  order is demanded by [[...]]] construct,
-    i.e. [[STRING, INTEGER, BOOLEAN]], while sub elements inside {...} and
-    [...] can be matched in any order."""
+  if not (isinstance(types, list) or isinstance(types, dict)):
+    return CompileSingleValueCheck(types)
 
-    # prepare a list of list types
-    lists = []
-    for atype in types:
-      if isinstance(atype, list): lists.append(atype)
-    if len(lists) > 1:
-      raise SchemaException(
+  lists = [atype for atype in types if isinstance(atype, list)]
+  if len(lists) > 1:
+    def CheckMultipleLists(helper, value, context):
+      return NewSchemaException(
           "Unable to validate types with multiple alternative "
           "lists %s", None, types, path=context.FormatPath())
+    return CheckMultipleLists
 
+  check_list = CompileListCheck(types, lists)
+  check_map = CompileMapCheck(types)
+  if isinstance(types, list):
+    alternatives = [CompileSingleValueCheck(atype) for atype in types]
+  else:
+    alternatives = []
+
+  def CheckValidType(helper, value, context):
     if isinstance(value, list):
-      if len(lists) > 1:
-        raise SchemaException(
-            "Allowed at most one list\nfound: %s.",
-            None, types, path=context.FormatPath())
-
-      # determine if list is in order or not as hinted by double array [[..]];
-      # [STRING, NUMBER] is in any order, but [[STRING, NUMBER]] demands order
-      ordered = len(lists) == 1 and isinstance(types, list)
-      if in_order or ordered:
-        return self.DoesValueMatchListOfTypesInOrder(
-            value, types, context, lists[0])
-      else:
-        return self.DoesValueMatchListOfTypesAnyOrder(
-            value, types, context, lists)
+      return check_list(helper, value, context)
+    if isinstance(value, dict):
+      return check_map(helper, value, context)
+    for check in alternatives:
+      error = check(helper, value, context)
+      if error is None:
+        return None
+      if not isinstance(error, SchemaException):
+        return error
+    return NewSchemaException(
+        "Unknown type %s", value, path=context.FormatPath())
 
-    return False
+  return CheckValidType
 
-  def CheckValueOfValidType(self, value, types, context, in_order=None):
-    """Check if a value matches any of the given types."""
 
-    if not (isinstance(types, list) or isinstance(types, dict)):
-      self.CheckValueMatchesType(value, types, context)
-      return
-    if self.DoesValueMatchListOfType(value, types, context, in_order): return
-    if self.DoesValueMatchMapOfType(value, types, context): return
-    if self.DoesValueMatchesOneOfTypes(value, types, context): return
+def CompileSingleValueCheck(atype):
+  """Compiles a check of a single value against a primitive type."""
+
+  def Unexpected(helper, value, context):
+    return NewSchemaException(
+        "Unexpected value '%s'\n"
+        "for type %s", value, atype, path=context.FormatPath())
 
-    raise SchemaException("Unknown type %s", value, path=context.FormatPath())
+  if atype == BOOLEAN:
+    def CheckBoolean(helper, value, context):
+      if (value == "True") or (value == "False") or (value == "true") or (
+          value == "false") or (isinstance(value, bool)) or value == BOOLEAN:
+        helper.VisitElement("BOOLEAN", value, context)
+        return None
+      return NewSchemaException(
+          "Expected: 'true' or 'false'\nfound: %s", value)
+    return CheckBoolean
+
+  if isinstance(atype, str) or atype == STRING:
+    name = "str"
+    if atype == STRING:
+      name = "STRING"
+    def CheckString(helper, value, context):
+      if isinstance(value, str):
+        helper.VisitElement(name, value, context)
+        return None
+      return NewSchemaException("Expected: 'string'\nfound: %s", value)
+    return CheckString
+
+  if atype == REGEX or atype == CORRECT:
+    name = "REGEX"
+    if atype == CORRECT:
+      name = "CORRECT"
+    def CheckMarker(helper, value, context):
+      if value == atype:
+        helper.VisitElement(name, value, context)
+        return None
+      return Unexpected(helper, value, context)
+    return CheckMarker
+
+  if atype == FLOAT:
+    def CheckNumber(helper, value, context):
+      try:
+        is_number = IsNumber(value)
+      except Exception as e:
+        return e
+      if is_number:
+        helper.VisitElement("NUMBER", value, context)
+        return None
+      return NewSchemaException("Expected: 'number'\nfound: %s", value)
+    return CheckNumber
+
+  if atype == INTEGER:
+    def CheckInteger(helper, value, context):
+      try:
+        is_integer = IsInteger(value)
+      except Exception as e:
+        return e
+      if is_integer:
+        helper.VisitElement("INTEGER", value, context)
+        return None
+      return NewSchemaException(
+          "Expected: 'integer'\nfound: %s", value, path=context.FormatPath())
+    return CheckInteger
+
+  return Unexpected
+
+
+def CompileListCheck(types, lists):
+  """Compiles a check of a list value against a type.
+
+  A [[...]] type demands the items in the order of the inner list; items of
+  other list types can match any of the types in any order."""
+
+  if len(lists) == 1 and isinstance(types, list):
+    target = lists[0]
+    checks = [CompileSchema(atype) for atype in target]
+
+    def CheckInOrder(helper, value, context):
+      all_values_are_lists = True
+      for avalue in value:
+        if not isinstance(avalue, list):
+          all_values_are_lists = False
+
+      if all_values_are_lists:
+        for i in range(0, len(value)):
+          error = CheckInOrder(helper, value[i], context.New(
+              FormatNameWithIndex(value, i)))
+          if error is not None:
+            return error
+        return None
 
-  def CheckInstancesMatchSchema(self, values, types, name):
-    """Recursively decomposes 'values' to see if they match schema (types)."""
+      if len(target) != len(value):
+        try:
+          message = "Expected: '%s' values\n" + "found: %s." % value
+        except Exception as e:
+          return e
+        return NewSchemaException(
+            message, len(target), path=context.FormatPath())
+      for i in range(0, len(value)):
+        error = checks[i](helper, value[i], context.New(
+            FormatNameWithIndex(value, i)))
+        if error is not None:
+          return error
+      return None
 
-    self.parse_log = []
-    context = Context().New(name)
-    self.parse_log.append("  ROOT %s" % context.FormatPath())
+    return CheckInOrder
 
-    # handle {..} containers
-    if isinstance(types, dict):
-      if not isinstance(values, dict):
-        raise SchemaException("Error at '/': expected {...}, found %s" % (
-            values.__class_.__name__))
-      self.CheckValueOfValidType(values, types, context.New([]))
-      return
+  if not isinstance(types, list):
+    def CheckUnsupported(helper, value, context):
+      return NewSchemaException(
+          "Unsupported type %s", None, types, path=context.FormatPath())
+    return CheckUnsupported
 
-    # handle [...] containers
-    if isinstance(types, list):
-      if not isinstance(values, list):
-        raise SchemaException("Error at '/': expected [...], found %s" % (
-            values.__class_.__name__))
-      for i in range(0, len(values)):
-        self.CheckValueOfValidType(
-            values[i], types, context.New("[%s]" % i))
-      return
+  checks = [CompileSchema(atype) for atype in types]
 
-    raise SchemaException(
-        "Expected an array or a dictionary.", None, path=context.FormatPath())
+  def CheckAnyOrder(helper, value, context):
+    for i in range(0, len(value)):
+      item_context = context.New(FormatNameWithIndex(value, i))
+      for check in checks:
+        if check(helper, value[i], item_context) is None:
+          break
+      else:
+        return NewSchemaException(
+            "The value:\n  %s\n"
+            "is incompatible with expected type(s):\n  %s",
+            value, types, path=context.FormatPath())
+    return None
+
+  return CheckAnyOrder
+
+
+def CompileMapCheck(types):
+  """Compiles a check of a dict value against a type.
+
+  If a type allows only one map, the value is checked against it. If it
+  allows several, the map is selected by the properties of the map that have
+  a fixed string value, i.e. 'questionType'; when all maps are selected by
+  the same property, the map is found in a dispatch table."""
+
+  maps = [atype for atype in types if isinstance(atype, dict)]
+  if len(maps) == 0 and isinstance(types, dict):
+    maps.append(types)
+  checks = {}
+  for adict in maps:
+    checks[id(adict)] = dict([
+        (akey, CompileSchema(avalue)) for akey, avalue in adict.items()])
+
+  def CheckMap(helper, value, context, aname, adict):
+    helper.VisitElement("dict", value, context.New(aname), False)
+    adict_checks = checks[id(adict)]
+    for akey, avalue in value.items():
+      if not akey in adict_checks:
+        return NewSchemaException(
+            "Unknown term '%s'", akey, path=context.FormatPath())
+      error = adict_checks[akey](helper, avalue, context.New([aname, akey]))
+      if error is not None:
+        return error
+    return None
+
+  def Incompatible(value, context):
+    return NewSchemaException(
+        "The value:\n  %s\n"
+        "is incompatible with expected type(s):\n  %s",
+        value, types, path=context.FormatPath())
+
+  if len(maps) == 1:
+    adict = maps[0]
+    keys = adict.keys()
+
+    def CheckOnlyMap(helper, value, context):
+      # the map is named after the first property of the value it defines
+      for value_key in value.keys():
+        if value_key in adict:
+          return CheckMap(helper, value, context, value_key, adict)
+      if not keys:
+        return IndexError("list index out of range")
+      return NewSchemaException("Expected: '%s'\nfound: %s", keys[0], value)
+
+    return CheckOnlyMap
+
+  selectors = []
+  for adict in maps:
+    for akey, avalue in SchemaHelper().FindSelectors(adict).items():
+      selectors.append((akey, avalue, adict))
+  names = set([akey for akey, avalue, adict in selectors])
+
+  if len(names) == 1:
+    aname = selectors[0][0]
+    table = {}
+    for akey, avalue, adict in reversed(selectors):
+      table[avalue] = adict
+
+    def CheckSelectedMap(helper, value, context):
+      if not aname in value:
+        return KeyError(aname)
+      selected = value[aname]
+      adict = None
+      if isinstance(selected, basestring):
+        adict = table.get(selected)
+      if adict is None:
+        return Incompatible(value, context)
+      return CheckMap(helper, value, context, aname, adict)
+
+    return CheckSelectedMap
+
+  def CheckSelectors(helper, value, context):
+    for akey, avalue, adict in selectors:
+      if not akey in value:
+        return KeyError(akey)
+      if value[akey] == avalue:
+        return CheckMap(helper, value, context, akey, adict)
+    return Incompatible(value, context)
+
+  return CheckSelectors
 
 
 def escapeQuote(value):
@@ -561,6 +670,7 @@ class Lesson(object):
     self.lesson_activity = ""
     self.lesson_activity_name = ""
     self.lesson_notes = ""
+    self.lesson_slides = ""
     self.lesson_video_id = ""
     self.lesson_objectives = ""
 
@@ -577,6 +687,7 @@ class Lesson(object):
     output.append("%s['lesson_activity'] = %s;" % (name, activity))
     output.append("%s['lesson_activity_name'] = '%s';" % (name, escapeQuote(self.lesson_activity_name)))
     output.append("%s['lesson_notes'] = '%s';" % (name, escapeQuote(self.lesson_notes)))
+    output.append("%s['lesson_slides'] = '%s';" % (name, escapeQuote(self.lesson_slides)))
     output.append("%s['lesson_video_id'] = '%s';" % (name, escapeQuote(self.lesson_video_id)))
     output.append("%s['lesson_objectives'] = '%s';" % (name, escapeQuote(self.lesson_objectives)))
 
@@ -636,18 +747,6 @@ def IsOneOf(value, values):
   return False
 
 
-def TextToLineNumberedText(text):
-  """Adds line numbers to the provided text."""
-
-  lines = text.split("\n")
-  results = []
-  i = 1
-  for line in lines:
-    results.append(str(i) + ": " + line)
-    i += 1
-  return "\n  ".join(results)
-
-
 def SetObjectAttributes(target_object, names, values):
   """Sets object attributes from provided values."""
 
@@ -668,56 +767,270 @@ def SetObjectAttributes(target_object, names, values):
         setattr(target_object, names[i], int(values[i]))
       continue
     if IsBoolean(values[i]):
-      setattr(target_object, names[i], bool(values[i]))
+      setattr(target_object, names[i], values[i] == "True")
       continue
     setattr(target_object, names[i], values[i])
 
 def ReadObjectsFromCsvFile(fname, header, new_object):
-  return ReadObjectsFromCsv(csv.reader(open(fname)), header, new_object)
+  return list(IterObjectsFromCsvFile(fname, header, new_object))
 
 
 def ReadObjectsFromCsv(value_rows, header, new_object):
-  values = []
-  for row in value_rows:
-    if len(row) == 0:
-      continue
-    values.append(row)
-  names = header.split(",")
+  return list(IterObjectsFromCsv(value_rows, header, new_object))
 
-  if names != values[0]:
-    raise SchemaException(
-        "Error reading CSV header.\n  "
-        "Header row had %s element(s): %s\n  "
-        "Expected header row with %s element(s): %s" % (
-            len(values[0]), values[0], len(names), names))
-
-  items = []
-  for i in range (1, len(values)):
-    if len(names) != len(values[i]):
-      raise SchemaException(
-          "Error reading CSV data row.\n  "
-          "Row #%s had %s element(s): %s\n  "
-          "Expected %s element(s): %s" % (
-              i, len(values[i]), values[i], len(names), names))
-
-    item = new_object()
-    SetObjectAttributes(item, names, values[i])
-    items.append(item)
-  return items
 
+def IterObjectsFromCsvFile(fname, header, new_object):
+  """Reads objects from a CSV file one by one, i.e. to stream an export."""
+  with open(fname) as file:
+    for item in IterObjectsFromCsv(csv.reader(file), header, new_object):
+      yield item
 
-def EscapeJavascriptRegex(text):
-  return re.sub(r"([:][ ]*)([/])(.*)([/][ismx]*)", r': regex("\2\3\4")', text)
 
+def IterObjectsFromCsv(value_rows, header, new_object):
+  names = header.split(",")
+  i = 0
+  for row in value_rows:
+    if len(row) == 0:
+      continue
+    if i == 0 and names != row:
+      raise SchemaException(
+          "Error reading CSV header.\n  "
+          "Header row had %s element(s): %s\n  "
+          "Expected header row with %s element(s): %s" % (
+              len(row), row, len(names), names))
 
-def RemoveJavaScriptSingleLineComment(text):
-  text = re.sub(re.compile("^(.*?)[ ]+//(.*)$", re.MULTILINE), r"\1", text)
-  text = re.sub(re.compile("^//(.*)$", re.MULTILINE), r"", text)
-  return text
+    if i > 0:
+      if len(names) != len(row):
+        raise SchemaException(
+            "Error reading CSV data row.\n  "
+            "Row #%s had %s element(s): %s\n  "
+            "Expected %s element(s): %s" % (
+                i, len(row), row, len(names), names))
+
+      item = new_object()
+      SetObjectAttributes(item, names, row)
+      yield item
+    i += 1
 
 
-def RemoveJavaScriptMultiLineComment(text):
-  return re.sub(re.compile("/\*(.*)\*/", re.MULTILINE + re.DOTALL), r"", text)
+# a token of the JavaScript object literal subset of activities and assessments;
+# the loops over the characters of strings are unrolled, which is much faster
+JS_TOKEN = re.compile(r"""
+    (?P<space>(?:\s+|//[^\n]*|/\*.*?\*/)+)|
+    (?P<string>'[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*")|
+    (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<name>[A-Za-z_$][\w$]*)|
+    (?P<regex>/(?:[^/\\\n\[]|\\.|\[(?:[^]\\\n]|\\.)*\])+/[a-zA-Z]*)|
+    (?P<punct>[][{}():,;=+-])""", re.VERBOSE | re.DOTALL)
+
+JS_STRING_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)",
+                              re.DOTALL)
+JS_STRING_ESCAPES = {
+    "n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v",
+    "0": "\0", "\n": "", "\r": "", "\r\n": ""}
+
+
+class JavaScriptSyntaxError(Exception):
+  """A class to represent an error in a JavaScript file at a line and column."""
+
+  def __init__(self, message, text, pos):
+    start = text.rfind("\n", 0, pos) + 1
+    end = text.find("\n", pos)
+    if end == -1:
+      end = len(text)
+    self.line = text.count("\n", 0, pos) + 1
+    self.column = pos - start + 1
+
+    # show up to 40 characters around the error; some lines are very long
+    left = max(start, pos - 40)
+    super(JavaScriptSyntaxError, self).__init__(
+        "Line %s, column %s: %s\n  %s\n  %s^" % (
+            self.line, self.column, message,
+            text[left:min(end, pos + 40)].replace("\t", " "),
+            " " * (pos - left)))
+
+
+def TokenizeJavaScript(text):
+  """Splits text into a list of (kind, text, position) tokens."""
+
+  tokens = []
+  pos = 0
+  while pos < len(text):
+    match = JS_TOKEN.match(text, pos)
+    if not match:
+      if text.startswith("/*", pos):
+        raise JavaScriptSyntaxError("Unterminated comment", text, pos)
+      if text[pos] in "'\"":
+        raise JavaScriptSyntaxError("Unterminated string", text, pos)
+      raise JavaScriptSyntaxError(
+          "Unexpected character '%s'" % text[pos], text, pos)
+    if match.lastgroup != "space":
+      tokens.append((match.lastgroup, match.group(), pos))
+    pos = match.end()
+  tokens.append(("end", "", pos))
+  return tokens
+
+
+def DecodeJavaScriptString(text):
+  """Decodes the escape sequences of the body of a JavaScript string."""
+
+  def Replace(match):
+    escape = match.group(1)
+    if len(escape) > 2:
+      return unichr(int(escape[1:], 16)).encode("utf8")
+    return JS_STRING_ESCAPES.get(escape, escape)
+
+  if not "\\" in text:
+    return text
+  return JS_STRING_ESCAPE.sub(Replace, text)
+
+
+def ParseJavaScriptNumber(text):
+  if text[:2] in ["0x", "0X"]:
+    return int(text, 16)
+  if "." in text or "e" in text or "E" in text:
+    return float(text)
+  return int(text)
+
+
+class JavaScriptLiteralParser(object):
+  """Evaluates variables set to object literals in a JavaScript text.
+
+  This is the subset of JavaScript used by the activity and assessment files:
+  'var name = value;' statements, where a value is a string, a number, a
+  regular expression, an array, an object, a '+' of values, or a name or a
+  call of a function of the scope. A regular expression literal is passed to
+  the 'regex' function of the scope as text."""
+
+  def __init__(self, text, scope):
+    self.text = text
+    self.scope = scope
+    self.tokens = TokenizeJavaScript(text)
+    self.index = 0
+
+  def Error(self, message, token):
+    return JavaScriptSyntaxError(message, self.text, token[2])
+
+  def Describe(self, token):
+    if token[0] == "end":
+      return "the end of the file"
+    if len(token[1]) > 20:
+      return "%s %s..." % (token[0], token[1][:20])
+    return "%s %s" % (token[0], token[1])
+
+  def Next(self):
+    token = self.tokens[self.index]
+    self.index += 1
+    return token
+
+  def IsNext(self, punct):
+    token = self.tokens[self.index]
+    return token[0] == "punct" and token[1] == punct
+
+  def Expect(self, *puncts):
+    token = self.Next()
+    if token[0] != "punct" or not token[1] in puncts:
+      raise self.Error("Expected %s, found %s" % (
+          " or ".join(["'%s'" % punct for punct in puncts]),
+          self.Describe(token)), token)
+    return token[1]
+
+  def ParseProgram(self):
+    """Returns a dict of the variables set and their values."""
+    bindings = {}
+    while self.tokens[self.index][0] != "end":
+      token = self.Next()
+      if token[0] == "punct" and token[1] == ";":
+        continue
+      if token[0] == "name" and token[1] == "var":
+        token = self.Next()
+      if token[0] != "name":
+        raise self.Error("Expected a variable name, found %s" %
+                         self.Describe(token), token)
+      self.Expect("=")
+      bindings[token[1]] = self.ParseValue()
+      if self.tokens[self.index][0] != "end":
+        self.Expect(";")
+    return bindings
+
+  def ParseValue(self):
+    token = self.tokens[self.index]
+    value = self.ParseTerm()
+    while self.IsNext("+"):
+      self.Next()
+      try:
+        value += self.ParseTerm()
+      except TypeError as e:
+        raise self.Error(str(e), token)
+    return value
+
+  def ParseTerm(self):
+    token = self.Next()
+    kind, text = token[0], token[1]
+    if kind == "string":
+      return DecodeJavaScriptString(text[1:-1])
+    if kind == "number":
+      return ParseJavaScriptNumber(text)
+    if kind == "regex":
+      return self.Call("regex", [text], token)
+    if kind == "name":
+      if self.IsNext("("):
+        self.Next()
+        return self.Call(text, self.ParseList(")"), token)
+      return self.Lookup(text, token)
+    if kind == "punct":
+      if text == "-" and self.tokens[self.index][0] == "number":
+        return -ParseJavaScriptNumber(self.Next()[1])
+      if text == "[":
+        return self.ParseList("]")
+      if text == "{":
+        return self.ParseObject()
+      if text == "(":
+        value = self.ParseValue()
+        self.Expect(")")
+        return value
+    raise self.Error("Expected a value, found %s" % self.Describe(token), token)
+
+  def ParseList(self, end):
+    values = []
+    while not self.IsNext(end):
+      values.append(self.ParseValue())
+      if self.Expect(",", end) == end:
+        return values
+    self.Next()
+    return values
+
+  def ParseObject(self):
+    value = {}
+    while not self.IsNext("}"):
+      token = self.Next()
+      if token[0] == "name" or token[0] == "number":
+        key = token[1]
+      elif token[0] == "string":
+        key = DecodeJavaScriptString(token[1][1:-1])
+      else:
+        raise self.Error("Expected a property name, found %s" %
+                         self.Describe(token), token)
+      self.Expect(":")
+      value[key] = self.ParseValue()
+      if self.Expect(",", "}") == "}":
+        return value
+    self.Next()
+    return value
+
+  def Lookup(self, name, token):
+    if not name in self.scope:
+      raise self.Error("Unknown name '%s'" % name, token)
+    return self.scope[name]
+
+  def Call(self, name, args, token):
+    function = self.Lookup(name, token)
+    if not callable(function):
+      raise self.Error("'%s' is not a function" % name, token)
+    try:
+      return function(*args)
+    except TypeError as e:
+      raise self.Error(str(e), token)
 
 
 def RemoveContentMarkedNoVerify(content):
@@ -725,60 +1038,117 @@ def RemoveContentMarkedNoVerify(content):
 
   """If you have any free-form JavaScript in the activity file, you need
   to place it between //<gcb-no-verify> ... //</gcb-no-verify> tags
-  so that the verifier can selectively ignore it."""
+  so that the verifier can selectively ignore it. The lines of the content
+  are kept empty, so errors are reported at the right line numbers."""
 
   pattern = re.compile("(%s)(.*)(%s)" % (
       NO_VERIFY_TAG_NAME_OPEN, NO_VERIFY_TAG_NAME_CLOSE), re.DOTALL)
-  return re.sub(pattern, "", content)
-
-
-def ConvertJavaScriptToPython(content, root_name):
-  """Removes JavaScript specific syntactic constructs."""
-
-  """Reads the content and removes JavaScript comments, var's, and escapes
-  regular expressions."""
-
-  content = RemoveContentMarkedNoVerify(content)
-  content = RemoveJavaScriptMultiLineComment(content)
-  content = RemoveJavaScriptSingleLineComment(content)
-  content = content.replace("var %s = " % root_name, "%s = " % root_name)
-  content = EscapeJavascriptRegex(content)
-  return content
+  return re.sub(pattern, lambda match: "\n" * match.group().count("\n"),
+                content)
 
 
-def ConvertJavaScriptFileToPython(fname, root_name):
-  return ConvertJavaScriptToPython(
-      "".join(open(fname, "r").readlines()), root_name)
+def ParseJavaScriptLiterals(content, scope):
+  """Evaluates the variables set in an activity or an assessment file."""
+  return JavaScriptLiteralParser(
+      RemoveContentMarkedNoVerify(content), scope).ParseProgram()
 
 
-def EvaluatePythonExpressionFromText(content, root_name, scope):
-  """Compiles and evaluates a Python script in a restricted environment."""
+def MakeDataScope(root_name):
+  """Makes bindings that keep the values of correct(), regex() and booleans.
 
-  """First compiles and then evaluates a Python script text in a restricted
-  environment using provided bindings. Returns the resulting bindings if
-  evaluation completed."""
-
-  # create a new execution scope that has only the schema terms defined;
-  # remove all other languages constructs including __builtins__
-  restricted_scope = {}
-  restricted_scope.update(scope)
-  restricted_scope.update({"__builtins__": {}})
-  code = compile(content, "<string>", "exec")
-  exec code in restricted_scope
-  if not restricted_scope[root_name]:
-    raise Exception("Unable to find '%s'" % root_name)
-  return restricted_scope
+  The scope of Assessment and Activity maps these terms onto schema markers,
+  which is all verification needs; this scope keeps the actual values, so the
+  evaluated content can be exported."""
+  scope = {}
+  SchemaHelper().ExtractAllTermsToDepth(root_name, SCHEMA[root_name], scope)
+  scope.update({
+      "correct": lambda x: {"correct": x},
+      "regex": lambda x: {"regex": x},
+      "true": True,
+      "false": False})
+  return scope
 
 
 def EvaluateJavaScriptExpressionFromFile(fname, root_name, scope, error):
-  content = ConvertJavaScriptFileToPython(fname, root_name)
+  """Returns the variables set in a file, or None if root_name is not set."""
+  content = open(fname, "r").read()
   try:
-    return EvaluatePythonExpressionFromText(content, root_name, scope)
-  except:
-    error("Unable to parse %s in file %s\n  %s" % (
-        root_name, fname, TextToLineNumberedText(content)))
-    for message in sys.exc_info():
-      error(str(message))
+    bindings = ParseJavaScriptLiterals(content, scope)
+  except JavaScriptSyntaxError as e:
+    error("Unable to parse %s in file %s\n  %s" % (root_name, fname, e))
+    return None
+  if not bindings.get(root_name):
+    error("Unable to find '%s' in file %s" % (root_name, fname))
+    return None
+  return bindings
+
+
+def GenerateExportLines(units, lessons):
+  """Yields the export code of units and lessons one line at a time.
+
+  The lines are the body of the gcb_import() function of tools/export.py."""
+  yield "units = Array();"
+  for unit in units:
+    output = ["", "units[%s] = Array();" % unit.id,
+              "units[%s]['lessons'] = Array();" % unit.id]
+    unit.ListProperties("units[%s]" % unit.id, output)
+    for line in output:
+      yield line
+  for lesson in lessons:
+    output = ["", "units[%s]['lessons'][%s] = Array();" % (
+        lesson.unit_id, lesson.lesson_id)]
+    lesson.ListProperties("units[%s]['lessons'][%s]" % (
+        lesson.unit_id, lesson.lesson_id), output)
+    for line in output:
+      yield line
+
+
+class VerificationCache(object):
+  """Results of verifying activity and assessment files by content hash.
+
+  A cached result is the log of the verification of a file and the schema
+  usage statistics it added. It is only used for a file with the same content
+  and the same root name, verified by the same version of this script, which
+  holds the schema. Results of files with errors are not cached, and results
+  not used by a run are dropped when the cache is saved."""
+
+  def __init__(self, fname):
+    self.fname = fname
+    source = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+    self.verifier_hash = hashlib.sha1(open(source, "rb").read()).hexdigest()
+    self.entries = {}
+    self.used = {}
+    if os.path.exists(fname):
+      try:
+        cache = json.loads(open(fname, "rb").read())
+      except ValueError:
+        cache = {}
+      if (cache.get("version") == VERIFY_CACHE_VERSION and
+          cache.get("verifier") == self.verifier_hash):
+        self.entries = cache["entries"]
+
+  def MakeKey(self, fname, root_name):
+    digest = hashlib.sha1(root_name)
+    digest.update("\0")
+    digest.update(open(fname, "rb").read())
+    return digest.hexdigest()
+
+  def Get(self, key):
+    entry = self.entries.get(key)
+    if entry:
+      self.used[key] = entry
+    return entry
+
+  def Put(self, key, entry):
+    self.used[key] = entry
+
+  def Save(self):
+    data = json.dumps({
+        "version": VERIFY_CACHE_VERSION, "verifier": self.verifier_hash,
+        "entries": self.used}, sort_keys=True)
+    with open(self.fname + ".tmp", "wb") as file:
+      file.write(data)
+    os.rename(self.fname + ".tmp", self.fname)
 
 
 class Verifier(object):
@@ -787,13 +1157,23 @@ class Verifier(object):
   """A class that knows how to verify Units, Lessons, Assessment and Activities,
   and understands their relationships."""
 
-  def __init__(self):
+  def __init__(self, course_folder=None, use_cache=False, jobs=1):
+    if course_folder is None:
+      course_folder = os.path.join(os.path.dirname(__file__), "..")
+    self.course_folder = course_folder
+    self.use_cache = use_cache
+    self.jobs = jobs
     self.schema_helper = SchemaHelper()
     self.errors = 0
     self.warnings = 0
+    self.recording = None
+
+  @property
+  def export(self):
+    """The export code of the units and lessons, as a list of lines."""
+    return list(GenerateExportLines(self.units, self.lessons))
 
   def VerifyUnitFields(self, units):
-    self.export.append("units = Array();")
     for unit in units:
       if not IsOneOf(unit.now_available, [True, False]):
         self.error("Bad now_available '%s' for unit id %s; expected 'True' or 'False'" % (
@@ -814,30 +1194,24 @@ class Verifier(object):
           self.error("Expected integer unit_id, found %s in unit id %s" % (
               unit.unit_id, unit.id))
 
-      self.export.append("")
-      self.export.append("units[%s] = Array();" % unit.id)
-      self.export.append("units[%s]['lessons'] = Array();" % unit.id)
-      unit.ListProperties("units[%s]" % unit.id, self.export)
-
   def VerifyLessonFields(self, lessons):
     for lesson in lessons:
       if not IsOneOf(lesson.lesson_activity, ["yes", ""]):
         self.error("Bad lesson_activity '%s' for lesson_id %s" %
                    (lesson.lesson_activity, lesson.lesson_id))
 
-      self.export.append("")
-      self.export.append("units[%s]['lessons'][%s] = Array();" % (
-          lesson.unit_id, lesson.lesson_id))
-      lesson.ListProperties("units[%s]['lessons'][%s]" % (
-          lesson.unit_id, lesson.lesson_id), self.export)
-
   def VerifyUnitLessonRelationships(self, units, lessons):
     """Checks how units relate to lessons and otherwise."""
 
     """Checks that each lesson points to a valid unit and all lessons are used
     by one of the units."""
 
-    used_lessons = []
+    # group lessons by unit_id once, so each check is a dictionary lookup
+    lessons_by_unit_id = {}
+    for lesson in lessons:
+      lessons_by_unit_id.setdefault(lesson.unit_id, []).append(lesson)
+    unit_ids = set()
+
     units.sort(key=lambda x: x.id)
     #for unit in units:
     for i in range(0, len(units)):
@@ -849,11 +1223,8 @@ class Verifier(object):
 
       # get the list of lessons for each unit
       self.fine("Unit %s: %s" % (unit.id, unit.title))
-      unit_lessons = []
-      for lesson in lessons:
-        if lesson.unit_id == unit.unit_id:
-          unit_lessons.append(lesson)
-          used_lessons.append(lesson)
+      unit_ids.add(unit.unit_id)
+      unit_lessons = list(lessons_by_unit_id.get(unit.unit_id, []))
 
       # inspect all lessons for the current unit
       unit_lessons.sort(key=lambda x: x.lesson_id)
@@ -869,21 +1240,14 @@ class Verifier(object):
         self.fine("  Lesson %s: %s" % (lesson.lesson_id, lesson.lesson_title))
 
     # find lessons not used by any of the units
-    unused_lessons = list(lessons)
-    for lesson in used_lessons:
-      unused_lessons.remove(lesson)
-    for lesson in unused_lessons:
-      self.warn("Unused lesson_id %s (%s)" % (
-          lesson.lesson_id, lesson.ToIdString()))
+    for lesson in lessons:
+      if not lesson.unit_id in unit_ids:
+        self.warn("Unused lesson_id %s (%s)" % (
+            lesson.lesson_id, lesson.ToIdString()))
 
     # check all lessons point to known units
     for lesson in lessons:
-      has = False
-      for unit in units:
-        if lesson.unit_id == unit.unit_id:
-          has = True
-          break
-      if not has:
+      if not lesson.unit_id in unit_ids:
         self.error("Lesson has unknown unit_id %s (%s)" %
                    (lesson.unit_id, lesson.ToIdString()))
 
@@ -891,42 +1255,108 @@ class Verifier(object):
     """Loads and verifies all activities."""
 
     self.info("Loading activities:")
-    count = 0
+    files = []
     for lesson in lessons:
       if lesson.lesson_activity == "yes":
-        count += 1
-        fname = os.path.join(
-            os.path.dirname(__file__),
-            "../assets/js/activity-" + str(lesson.unit_id) + "." +
-            str(lesson.lesson_id) + ".js")
-        if not os.path.exists(fname):
-          self.error("  Missing activity: %s" % fname)
-        else:
-          activity = EvaluateJavaScriptExpressionFromFile(
-              fname, "activity", Activity().scope, self.error)
-          self.VerifyActivityInstance(activity, fname)
-
-    self.info("Read %s activities" % count)
+        files.append((lesson, os.path.join(
+            self.course_folder,
+            "assets/js/activity-" + str(lesson.unit_id) + "." +
+            str(lesson.lesson_id) + ".js")))
+
+    self.VerifyFilesInParallel([fname for lesson, fname in files], "activity")
+    for lesson, fname in files:
+      if not os.path.exists(fname):
+        self.error("  Missing activity: %s" % fname)
+      else:
+        self.VerifyFile(fname, "activity")
+        self.activity_files["%s.%s" % (
+            lesson.unit_id, lesson.lesson_id)] = fname
+
+    self.info("Read %s activities" % len(files))
 
   def VerifyAssessment(self, units):
     """Loads and verifies all assessments."""
 
     self.info("Loading assessment:")
-    count = 0
+    files = []
     for unit in units:
       if unit.type == "A":
-        count += 1
-        fname = os.path.join(
-            os.path.dirname(__file__),
-            "../assets/js/assessment-" + str(unit.unit_id) + ".js")
-        if not os.path.exists(fname):
-          self.error("  Missing assessment: %s" % fname)
-        else:
-          assessment = EvaluateJavaScriptExpressionFromFile(
-              fname, "assessment", Assessment().scope, self.error)
-          self.VerifyAssessmentInstance(assessment, fname)
-
-    self.info("Read %s assessments" % count)
+        files.append((unit, os.path.join(
+            self.course_folder,
+            "assets/js/assessment-" + str(unit.unit_id) + ".js")))
+
+    self.VerifyFilesInParallel([fname for unit, fname in files], "assessment")
+    for unit, fname in files:
+      if not os.path.exists(fname):
+        self.error("  Missing assessment: %s" % fname)
+      else:
+        self.VerifyFile(fname, "assessment")
+        self.assessment_files[unit.unit_id] = fname
+
+    self.info("Read %s assessments" % len(files))
+
+  def VerifyFilesInParallel(self, fnames, root_name):
+    """Verifies files in a pool of self.jobs processes ahead of VerifyFile()."""
+
+    if self.jobs <= 1:
+      return
+    pending = []
+    for fname in fnames:
+      if not os.path.exists(fname) or fname in self.results:
+        continue
+      if self.cache and self.cache.Get(
+          self.cache.MakeKey(fname, root_name)):
+        continue
+      pending.append((fname, root_name))
+    if len(pending) < 2:
+      return
+
+    # the server imports this module to read assessments, and does not need
+    # the processes; import them only here
+    import multiprocessing
+    pool = multiprocessing.Pool(min(self.jobs, len(pending)))
+    try:
+      results = pool.map(VerifyFileResult, pending)
+    finally:
+      pool.terminate()
+    for (fname, root_name), result in zip(pending, results):
+      self.results[fname] = result
+
+  def VerifyFile(self, fname, root_name):
+    """Verifies an activity or an assessment; replays a cached result.
+
+    The file is verified by a separate Verifier, whose log is replayed here;
+    so the report is the same no matter if the result was cached, made in
+    another process or made just now."""
+
+    key = None
+    if self.cache:
+      key = self.cache.MakeKey(fname, root_name)
+      entry = self.cache.Get(key)
+      if entry:
+        self.cache_hits += 1
+        self.ReplayResult(entry)
+        return
+
+    result = self.results.pop(fname, None)
+    if result is None:
+      result = VerifyFileResult((fname, root_name))
+    if key and not result["errors"] and not result["exception"]:
+      self.cache.Put(key, {
+          "log": result["log"], "type_stats": result["type_stats"]})
+    self.ReplayResult(result)
+    self.file_times[fname] = result["seconds"]
+    self.info("  Took %.1fms to verify %s" % (result["seconds"] * 1000, fname))
+    if result["exception"]:
+      raise SchemaException(result["exception"])
+
+  def ReplayResult(self, result):
+    """Reports the log and the schema usage of a verification of a file."""
+    for level, message in result["log"]:
+      getattr(self, level)(message)
+    for atype, count in result["type_stats"].items():
+      self.schema_helper.type_stats[str(atype)] = (
+          self.schema_helper.type_stats.get(atype, 0) + count)
 
   def FormatParseLog(self):
     return "Parse log:\n%s" % "\n".join(self.schema_helper.parse_log)
@@ -963,18 +1393,26 @@ class Verifier(object):
     else:
       self.error("  Unable to evaluate 'activity =' in %s" % fname)
 
+  def record(self, level, x):
+    if self.recording is not None:
+      self.recording.append((level, x))
+
   def fine(self, x):
+    self.record("fine", x)
     if OUTPUT_FINE_LOG:
       self.echo_func("FINE: " + x)
 
   def info(self, x):
+    self.record("info", x)
     self.echo_func("INFO: " + x)
 
   def warn(self, x):
+    self.record("warn", x)
     self.warnings += 1
     self.echo_func("WARNING: " + x)
 
   def error(self, x):
+    self.record("error", x)
     self.errors += 1
     self.echo_func("ERROR: " + x)
 
@@ -982,12 +1420,20 @@ class Verifier(object):
     """Loads, parses and verifies all content for a course."""
 
     self.echo_func = echo_func
-    self.export = [];
+    self.activity_files = {}
+    self.assessment_files = {}
+    self.cache = None
+    self.cache_hits = 0
+    self.results = {}
+    self.file_times = {}
 
     self.info("Started verification in: %s" % __file__)
 
-    unit_file = os.path.join(os.path.dirname(__file__), "../data/unit.csv")
-    lesson_file = os.path.join(os.path.dirname(__file__), "../data/lesson.csv")
+    unit_file = os.path.join(self.course_folder, "data/unit.csv")
+    lesson_file = os.path.join(self.course_folder, "data/lesson.csv")
+    if self.use_cache:
+      self.cache = VerificationCache(os.path.join(
+          self.course_folder, "data", VERIFY_CACHE_FILE_NAME))
 
     self.info("Loading units from: %s" % unit_file)
     units = ReadObjectsFromCsvFile(unit_file, UNITS_HEADER, lambda: Unit())
@@ -997,6 +1443,11 @@ class Verifier(object):
     lessons = ReadObjectsFromCsvFile(lesson_file, LESSONS_HEADER, lambda: Lesson())
     self.info("Read %s lessons" % len(lessons))
 
+    self.unit_file = unit_file
+    self.lesson_file = lesson_file
+    self.units = units
+    self.lessons = lessons
+
     self.VerifyUnitFields(units)
     self.VerifyLessonFields(lessons)
     self.VerifyUnitLessonRelationships(units, lessons)
@@ -1007,6 +1458,11 @@ class Verifier(object):
     except SchemaException as e:
       self.error(str(e))
 
+    if self.cache:
+      self.cache.Save()
+      self.info("Reused %s cached results from: %s" % (
+          self.cache_hits, self.cache.fname))
+
     self.info("Schema usage statistics: %s" % self.schema_helper.type_stats)
     self.info("Completed verification: %s warnings, %s errors." %
               (self.warnings, self.errors))
@@ -1014,30 +1470,79 @@ class Verifier(object):
     return self.errors
 
 
-def RunAllRegexUnitTests():
-  assert EscapeJavascriptRegex(
-      "blah regex: /site:bls.gov?/i, blah") == (
-          "blah regex: regex(\"/site:bls.gov?/i\"), blah")
-  assert EscapeJavascriptRegex(
-      "blah regex: /site:http:\/\/www.google.com?q=abc/i, blah") == (
-          "blah regex: regex(\"/site:http:\/\/www.google.com?q=abc/i\"), blah")
-  assert RemoveJavaScriptMultiLineComment(
-      "blah\n/*\ncomment\n*/\nblah") == "blah\n\nblah"
-  assert RemoveJavaScriptMultiLineComment(
-      "blah\nblah /*\ncomment\nblah */\nblah") == (
-          "blah\nblah \nblah")
-  assert RemoveJavaScriptSingleLineComment(
-      "blah\n// comment\nblah") == "blah\n\nblah"
-  assert RemoveJavaScriptSingleLineComment(
-      "blah\nblah http://www.foo.com\nblah") == (
-          "blah\nblah http://www.foo.com\nblah")
-  assert RemoveJavaScriptSingleLineComment(
-      "blah\nblah  // comment\nblah") == "blah\nblah\nblah"
-  assert RemoveJavaScriptSingleLineComment(
-      "blah\nblah  // comment http://www.foo.com\nblah") == "blah\nblah\nblah"
-  assert RemoveContentMarkedNoVerify(
-      "blah1\n// <gcb-no-verify>/blah2\n// </gcb-no-verify>\nblah3") == (
-          "blah1\n// \nblah3")
+def VerifyFileResult(args):
+  """Verifies an activity or an assessment file in a new Verifier.
+
+  Args:
+    args: a tuple of the file name and the root name, 'activity' or
+        'assessment'
+
+  Returns:
+    a dict of the log of the verification, the schema usage statistics, the
+    number of errors, the time it took in seconds, and the message of the
+    SchemaException that stopped it, if any
+  """
+  fname, root_name = args
+  verifier = Verifier()
+  verifier.echo_func = lambda x: None
+  verifier.recording = []
+  if root_name == "activity":
+    scope, verify_instance = Activity().scope, verifier.VerifyActivityInstance
+  else:
+    scope, verify_instance = (
+        Assessment().scope, verifier.VerifyAssessmentInstance)
+
+  start = time.time()
+  exception = None
+  try:
+    instance = EvaluateJavaScriptExpressionFromFile(
+        fname, root_name, scope, verifier.error)
+    verify_instance(instance, fname)
+  except SchemaException as e:
+    exception = str(e)
+  return {"log": verifier.recording,
+          "type_stats": verifier.schema_helper.type_stats,
+          "errors": verifier.errors, "seconds": time.time() - start,
+          "exception": exception}
+
+
+def RunAllJavaScriptUnitTests():
+  def Parse(text):
+    return ParseJavaScriptLiterals(text, {
+        "regex": lambda x: {"regex": x}, "correct": lambda x: {"correct": x},
+        "true": True, "false": False})
+
+  def AssertError(text, line, column):
+    try:
+      Parse(text)
+      raise Exception("Expected to fail: %s" % text)
+    except JavaScriptSyntaxError as e:
+      assert (e.line, e.column) == (line, column), (str(e), line, column)
+
+  assert Parse(
+      "var a = {x: /site:bls.gov?/i, y: 'blah'};") == (
+          {"a": {"x": {"regex": "/site:bls.gov?/i"}, "y": "blah"}})
+  assert Parse(
+      "var a = [/site:http:\\/\\/www.google.com?q=abc/i];") == (
+          {"a": [{"regex": "/site:http:\\/\\/www.google.com?q=abc/i"}]})
+  assert Parse("var a = [/[/]x/];") == {"a": [{"regex": "/[/]x/"}]}
+  assert Parse(
+      "var a = [1, /* comment */ 2 /* comment */];") == {"a": [1, 2]}
+  assert Parse(
+      "var a = ['http://www.foo.com', // comment\n 'b'];") == (
+          {"a": ["http://www.foo.com", "b"]})
+  assert Parse(
+      "var a = ['it\\'s', \"<\\/b>\\n\", '\\u00e9'];") == (
+          {"a": ["it's", "</b>\n", "\xc3\xa9"]})
+  assert Parse(
+      "var a = {'b': [true, -1, 2.5, 0x10,], c: [correct('d' + 'e')]};") == (
+          {"a": {"b": [True, -1, 2.5, 16], "c": [{"correct": "de"}]}})
+  assert Parse("var a = 1;\n// <gcb-no-verify>\nb = c(;\n"
+               "// </gcb-no-verify>\nvar d = 2") == {"a": 1, "d": 2}
+  AssertError("var a = {b: 'c' d: 1};", 1, 17)
+  AssertError("var a = [\n  1,\n  foo];", 3, 3)
+  AssertError("var a = ['b\n'];", 1, 10)
+  AssertError("var a = [1, 2];\n/* comment", 2, 1)
 
 
 def RunAllSchemaHelperUnitTests():
@@ -1195,12 +1700,39 @@ def RunAllSchemaHelperUnitTests():
              {"likes": [{"state": "CA", "food": STRING},
                         {"state": "NY", "drink": STRING}]})
 
+  # parse log tests
+  schema_helper = SchemaHelper()
+  schema_helper.CheckInstancesMatchSchema(
+      {"colors": ["red"] * (PARSE_LOG_SIZE + 1)}, {"colors": [STRING]}, "test")
+  AssertSame(PARSE_LOG_SIZE + 1, len(schema_helper.parse_log))
+  AssertSame("  ... 3 earlier elements not logged", schema_helper.parse_log[0])
+  AssertSame("  TERMINAL: STRING //test/colors/colors/[%s] = red" % (
+      PARSE_LOG_SIZE), schema_helper.parse_log[-1])
+
+  # compiled validator tests
+  assert GetSchemaValidator(SCHEMA["activity"]) is GetSchemaValidator(
+      SCHEMA["activity"])
+  try:
+    SchemaHelper().CheckInstancesMatchSchema(
+        ["text", {"questionType": "freetext", "outputHeight": 5}],
+        SCHEMA["activity"], "activity")
+    raise Exception("Expected to fail")
+  except SchemaException as e:
+    AssertSame("Expected: 'string'\nfound: 5", str(e))
+
 
 def RunAllUnitTests():
-  RunAllRegexUnitTests()
+  RunAllJavaScriptUnitTests()
   RunAllSchemaHelperUnitTests()
 
 
-RunAllUnitTests()
 if __name__ == "__main__":
-  Verifier().LoadAndVerifyModel(Echo)
+  RunAllUnitTests()
+  parser = optparse.OptionParser()
+  parser.add_option("--no_cache", action="store_true", default=False,
+                    help="verify all files, not only the changed ones")
+  parser.add_option("--jobs", type="int", default=1,
+                    help="the number of processes verifying files at once")
+  options, args = parser.parse_args()
+  Verifier(use_cache=not options.no_cache, jobs=options.jobs
+          ).LoadAndVerifyModel(Echo)
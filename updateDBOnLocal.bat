@@ -1,3 +1,4 @@
 cd ./data
 appcfg.py upload_data --url=http://localhost:8085/_ah/remote_api --config_file=../bulkloader.yaml --filename=unit.csv --kind=Unit
-appcfg.py upload_data --url=http://localhost:8085/_ah/remote_api --config_file=../bulkloader.yaml --filename=lesson.csv --kind=Lesson
\ No newline at end of file
+appcfg.py upload_data --url=http://localhost:8085/_ah/remote_api --config_file=../bulkloader.yaml --filename=lesson.csv --kind=Lesson
+echo Now visit http://localhost:8085/admin/invalidate_course_index as an administrator
\ No newline at end of file
@@ -1,3 +1,4 @@
 cd ./data
 appcfg.py upload_data --url=http://all-about-python.appspot.com/_ah/remote_api --config_file=../bulkloader.yaml --filename=unit.csv --kind=Unit
-appcfg.py upload_data --url=http://all-about-python.appspot.com/_ah/remote_api --config_file=../bulkloader.yaml --filename=lesson.csv --kind=Lesson
\ No newline at end of file
+appcfg.py upload_data --url=http://all-about-python.appspot.com/_ah/remote_api --config_file=../bulkloader.yaml --filename=lesson.csv --kind=Lesson
+echo Now visit http://all-about-python.appspot.com/admin/invalidate_course_index as an administrator
\ No newline at end of file